@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import UserProfile, Doctor, Patient, Appointment, Billing
+from django.utils import timezone
+from .models import (
+    UserProfile, Doctor, Patient, Appointment, Billing, Task, AppointmentReminder, WaitlistEntry,
+    ArchivedAppointment, ArchivedBilling, ApiToken,
+)
 
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
@@ -87,6 +91,75 @@ class BillingAdmin(admin.ModelAdmin):
         return f"BILL-{obj.id:05d}"
     get_bill_id.short_description = 'Bill ID'
 
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    """Tokens are issued by create_api_token; delete one to revoke it"""
+    list_display = ('user', 'name', 'created_at')
+    list_select_related = ('user',)
+    search_fields = ('user__username', 'name')
+    readonly_fields = ('user', 'name', 'created_at')
+    
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('locked_by', 'locked_at', 'last_error', 'created_at', 'finished_at')
+    ordering = ('-created_at',)
+    actions = ['retry_now']
+    
+    @admin.action(description='Retry selected tasks now')
+    def retry_now(self, request, queryset):
+        queryset.exclude(status='running').update(status='queued', run_at=timezone.now(), attempts=0)
+
+@admin.register(AppointmentReminder)
+class AppointmentReminderAdmin(admin.ModelAdmin):
+    list_display = ('appointment', 'appointment_date', 'appointment_time', 'channel', 'status', 'attempts', 'updated_at')
+    list_filter = ('status', 'channel', 'appointment_date')
+    list_select_related = ('appointment__patient__user', 'appointment__doctor__user')
+    readonly_fields = ('last_error', 'updated_at')
+    raw_id_fields = ('appointment',)
+    actions = ['send_again']
+    
+    @admin.action(description='Send again on the next run')
+    def send_again(self, request, queryset):
+        queryset.delete()
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'doctor', 'appointment_date', 'priority', 'status', 'offer_expires_at', 'created_at')
+    list_filter = ('status', 'appointment_date')
+    list_select_related = ('patient__user', 'doctor__user')
+    search_fields = ('patient__patient_id', 'patient__user__last_name', 'doctor__user__last_name')
+    readonly_fields = ('offered_appointment', 'offer_expires_at', 'created_at')
+    raw_id_fields = ('patient', 'doctor')
+    ordering = ('appointment_date', '-priority', 'created_at')
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """Archived records are kept as they were; archive_records writes them"""
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedAppointment)
+class ArchivedAppointmentAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'patient_name', 'doctor_name', 'appointment_date', 'appointment_time', 'status', 'archived_at')
+    list_filter = ('status', 'specialization')
+    search_fields = ('patient_name', 'patient_code', 'doctor_name')
+    date_hierarchy = 'appointment_date'
+
+@admin.register(ArchivedBilling)
+class ArchivedBillingAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'appointment', 'total_amount', 'payment_status', 'payment_date', 'archived_at')
+    list_filter = ('payment_status', 'payment_method')
+    list_select_related = ('appointment',)
+    search_fields = ('appointment__patient_name', 'appointment__patient_code')
+
 # Customize admin site
 admin.site.site_header = "Hospital Management System"
 admin.site.site_title = "HMS Admin"
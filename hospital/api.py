@@ -0,0 +1,207 @@
+"""
+JSON detail endpoints fetched by the list pages' modals when they open.
+
+Payloads are cached per object, in the cache every worker shares
+(``hospital.caching``). Visibility is still checked on every
+request with the same ``visible_to`` scoping the list pages use, so a
+cached payload is never served to a user who could not see the row.
+
+The endpoints are coroutines: under ASGI a modal fetch waiting on the
+cache or the database no longer ties up a worker thread.
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.utils import formats, timezone
+
+from .async_utils import async_login_required
+from . import metrics
+from .caching import DETAIL_CACHE_TIMEOUT, acache_key, cache
+from .models import Appointment, Billing, Patient
+from .views import get_user_role
+
+STATUS_BADGES = {
+    'scheduled': 'primary',
+    'completed': 'success',
+    'cancelled': 'danger',
+    'no_show': 'warning',
+}
+
+PAYMENT_STATUS_BADGES = {
+    'pending': 'warning',
+    'paid': 'success',
+    'partial': 'info',
+    'overdue': 'danger',
+    'cancelled': 'secondary',
+}
+
+BILL_FIELDS = (
+    'id', 'created_at', 'total_amount', 'discount_amount', 'additional_charges',
+    'additional_charges_description', 'discount_description', 'payment_status',
+    'payment_date', 'due_date', 'notes',
+    'appointment__appointment_date', 'appointment__appointment_time', 'appointment__appointment_type',
+    'appointment__status', 'appointment__reason', 'appointment__notes',
+    'appointment__patient__patient_id',
+    'appointment__patient__user__first_name', 'appointment__patient__user__last_name',
+    'appointment__doctor__specialization', 'appointment__doctor__consultation_fee',
+    'appointment__doctor__user__first_name', 'appointment__doctor__user__last_name',
+)
+
+PATIENT_FIELDS = (
+    'id', 'patient_id', 'blood_group', 'gender', 'date_of_birth', 'emergency_contact',
+    'address', 'medical_history', 'allergies',
+    'user__first_name', 'user__last_name', 'user__email', 'user__userprofile__phone',
+)
+
+APPOINTMENT_FIELDS = (
+    'id', 'appointment_date', 'appointment_time', 'appointment_type', 'status', 'reason', 'notes',
+    'patient__patient_id', 'patient__user__first_name', 'patient__user__last_name',
+    'doctor__specialization', 'doctor__consultation_fee',
+    'doctor__user__first_name', 'doctor__user__last_name',
+)
+
+
+def _display(value):
+    """Format a value the way ``{{ value }}`` would in a template"""
+    if value is None:
+        return ''
+    if hasattr(value, 'tzinfo') and hasattr(value, 'date') and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return formats.localize(value)
+
+
+def _person(patient_or_doctor):
+    return patient_or_doctor.user.get_full_name()
+
+
+def serialize_appointment(appointment):
+    patient, doctor = appointment.patient, appointment.doctor
+    return {
+        'id': appointment.pk,
+        'date': _display(appointment.appointment_date),
+        'time': _display(appointment.appointment_time),
+        'type': appointment.get_appointment_type_display(),
+        'status': appointment.status,
+        'status_display': appointment.get_status_display(),
+        'status_badge': STATUS_BADGES.get(appointment.status, 'secondary'),
+        'reason': appointment.reason,
+        'notes': appointment.notes,
+        'patient': {'name': _person(patient), 'patient_id': patient.patient_id},
+        'doctor': {
+            'name': _person(doctor),
+            'specialization': doctor.get_specialization_display(),
+            'consultation_fee': str(doctor.consultation_fee),
+        },
+    }
+
+
+def serialize_bill(bill):
+    return {
+        'id': bill.pk,
+        'number': f'{bill.pk:05d}',
+        'created_at': _display(bill.created_at),
+        'payment_status': bill.payment_status,
+        'payment_status_display': bill.get_payment_status_display(),
+        'payment_status_badge': PAYMENT_STATUS_BADGES.get(bill.payment_status, 'secondary'),
+        'due_date': _display(bill.due_date),
+        'payment_date': _display(bill.payment_date),
+        'total_amount': str(bill.total_amount),
+        'discount_amount': str(bill.discount_amount) if bill.discount_amount > 0 else '',
+        'discount_description': bill.discount_description,
+        'additional_charges': str(bill.additional_charges) if bill.additional_charges > 0 else '',
+        'additional_charges_description': bill.additional_charges_description,
+        'notes': bill.notes,
+        'appointment': serialize_appointment(bill.appointment),
+    }
+
+
+def serialize_patient(patient):
+    profile = getattr(patient.user, 'userprofile', None)
+    return {
+        'id': patient.pk,
+        'patient_id': patient.patient_id,
+        'name': _person(patient),
+        'email': patient.user.email,
+        'phone': profile.phone if profile else '',
+        'date_of_birth': _display(patient.date_of_birth),
+        'gender': patient.get_gender_display(),
+        'blood_group': patient.blood_group,
+        'emergency_contact': patient.emergency_contact,
+        'address': patient.address,
+        'medical_history': patient.medical_history,
+        'allergies': patient.allergies,
+    }
+
+
+async def _cached_detail(kind, queryset, pk, serialize):
+    """
+    Return the payload for ``pk`` if it is in ``queryset``, else None.
+
+    On a cache hit only a cheap EXISTS query runs against the scoped
+    queryset; on a miss the object is loaded with the given projection,
+    which covers every field ``serialize`` reads.
+    """
+    key = await acache_key(kind, pk)
+    payload = await cache.aget(key)
+    metrics.cache_lookups('detail', payload is not None, payload is None)
+    if payload is not None:
+        return payload if await queryset.filter(pk=pk).aexists() else None
+    obj = await queryset.filter(pk=pk).afirst()
+    if obj is None:
+        return None
+    payload = serialize(obj)
+    await cache.aset(key, payload, DETAIL_CACHE_TIMEOUT)
+    return payload
+
+
+async def _visible(model, user):
+    return await sync_to_async(model.objects.visible_to)(user)
+
+
+def _not_found():
+    return JsonResponse({'error': 'Not found.'}, status=404)
+
+
+def _forbidden(message='Permission denied.'):
+    return JsonResponse({'error': message}, status=403)
+
+
+@async_login_required
+async def bill_detail(request, pk):
+    try:
+        queryset = await _visible(Billing, request.user)
+    except PermissionDenied as exc:
+        return _forbidden(str(exc))
+    queryset = queryset.select_related(
+        'appointment__patient__user', 'appointment__doctor__user'
+    ).only(*BILL_FIELDS)
+    payload = await _cached_detail('bill', queryset, pk, serialize_bill)
+    if payload is None:
+        return _not_found()
+    role = await sync_to_async(get_user_role)(request.user)
+    payload = dict(payload, can_pay=(payload['payment_status'] == 'pending' and role == 'patient'))
+    return JsonResponse(payload)
+
+
+@async_login_required
+async def appointment_detail(request, pk):
+    try:
+        queryset = await _visible(Appointment, request.user)
+    except PermissionDenied as exc:
+        return _forbidden(str(exc))
+    queryset = queryset.select_related('patient__user', 'doctor__user').only(*APPOINTMENT_FIELDS)
+    payload = await _cached_detail('appointment', queryset, pk, serialize_appointment)
+    if payload is None:
+        return _not_found()
+    return JsonResponse(payload)
+
+
+@async_login_required
+async def patient_detail(request, pk):
+    if await sync_to_async(get_user_role)(request.user) not in ('admin', 'doctor'):
+        return _forbidden()
+    queryset = Patient.objects.select_related('user__userprofile').only(*PATIENT_FIELDS)
+    payload = await _cached_detail('patient', queryset, pk, serialize_patient)
+    if payload is None:
+        return _not_found()
+    return JsonResponse(payload)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class HospitalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'hospital'
+
+    def ready(self):
+        from . import signals, slowlog  # noqa: F401
+
+        slowlog.install()
@@ -0,0 +1,269 @@
+"""
+Archival of finished appointments and settled bills.
+
+Appointments that are completed, cancelled or no-shows, older than
+``ARCHIVE_AFTER_MONTHS`` and without an unsettled bill are copied with
+their bill into ``ArchivedAppointment``/``ArchivedBilling`` and deleted
+from the live tables. Each batch is one transaction on the live database,
+so the live tables the dashboard and list views read from stay small
+(the patients' timelines keep their entries: ``hospital.timeline``). The
+archive tables sit in the ``archive`` database when
+``DATABASE_ARCHIVE_URL`` is set. That copy commits just before the live
+delete, and it is an upsert on the original id, so a batch interrupted
+between the two is simply archived again on the next run.
+
+``appointment_records()`` and ``bill_records()`` read both tiers as one
+list, newest first. It supports the usual filters, pagination and CSV
+export, so history pages need not care where a record lives.
+"""
+import csv
+import heapq
+import io
+from calendar import monthrange
+from datetime import date
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat
+
+from . import timeline
+from .models import Appointment, ArchivedAppointment, ArchivedBilling, Billing
+from .routers import archive_db
+
+FINISHED_STATUSES = ('completed', 'cancelled', 'no_show')
+SETTLED_BILL_STATUSES = ('paid', 'cancelled')
+
+APPOINTMENT_COPY_FIELDS = [
+    'appointment_date', 'appointment_time', 'appointment_type', 'reason', 'status', 'notes',
+    'created_at', 'updated_at',
+]
+BILL_COPY_FIELDS = [
+    'total_amount', 'discount_amount', 'additional_charges', 'additional_charges_description',
+    'discount_description', 'payment_status', 'payment_method', 'payment_date', 'due_date', 'notes',
+    'created_at',
+]
+
+
+def months_before(day, months):
+    month = day.month - 1 - months
+    year, month = day.year + month // 12, month % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, monthrange(year, month)[1]))
+
+
+def archive_cutoff(months=None, today=None):
+    """Appointments before this date may be archived"""
+    if months is None:
+        months = getattr(settings, 'ARCHIVE_AFTER_MONTHS', 12)
+    return months_before(today or date.today(), months)
+
+
+def archivable(cutoff):
+    """Finished appointments before ``cutoff`` with no bill or a settled one"""
+    return Appointment.objects.filter(
+        appointment_date__lt=cutoff, status__in=FINISHED_STATUSES,
+    ).filter(Q(billing__isnull=True) | Q(billing__payment_status__in=SETTLED_BILL_STATUSES))
+
+
+def snapshot(rows):
+    """Archive rows for the live appointments (and their bills) in ``rows``"""
+    appointments, bills = [], []
+    for row in rows:
+        appointments.append(ArchivedAppointment(
+            id=row['pk'],
+            patient_ref=row['patient_id'],
+            doctor_ref=row['doctor_id'],
+            patient_user_id=row['patient__user_id'],
+            doctor_user_id=row['doctor__user_id'],
+            patient_code=row['patient__patient_id'],
+            patient_name=f"{row['patient__user__first_name']} {row['patient__user__last_name']}".strip(),
+            doctor_name=f"{row['doctor__user__first_name']} {row['doctor__user__last_name']}".strip(),
+            specialization=row['doctor__specialization'],
+            **{name: row[name] for name in APPOINTMENT_COPY_FIELDS},
+        ))
+        if row['billing__id'] is not None:
+            bills.append(ArchivedBilling(
+                id=row['billing__id'],
+                appointment_id=row['pk'],
+                **{name: row[f'billing__{name}'] for name in BILL_COPY_FIELDS},
+            ))
+    return appointments, bills
+
+
+def copy_to_archive(appointments, bills):
+    using = archive_db()
+    with transaction.atomic(using=using):
+        ArchivedAppointment.objects.using(using).bulk_create(
+            appointments, update_conflicts=True, unique_fields=['id'],
+            update_fields=[field.name for field in ArchivedAppointment._meta.concrete_fields if not field.primary_key],
+        )
+        ArchivedBilling.objects.using(using).bulk_create(
+            bills, update_conflicts=True, unique_fields=['id'],
+            update_fields=[field.name for field in ArchivedBilling._meta.concrete_fields if not field.primary_key],
+        )
+
+
+def archive_batch(ids, cutoff):
+    """Move the archivable appointments among ``ids``; returns (appointments, bills) moved"""
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        # Locked so nothing changes between the copy and the delete
+        rows = list(
+            archivable(cutoff).filter(pk__in=ids).select_for_update(of=('self',)).values(
+                'pk', 'patient_id', 'doctor_id', 'patient__user_id', 'doctor__user_id', 'patient__patient_id',
+                'patient__user__first_name', 'patient__user__last_name', 'doctor__user__first_name',
+                'doctor__user__last_name', 'doctor__specialization', 'billing__id',
+                *APPOINTMENT_COPY_FIELDS, *(f'billing__{name}' for name in BILL_COPY_FIELDS),
+            )
+        )
+        if not rows:
+            return 0, 0
+        appointments, bills = snapshot(rows)
+        copy_to_archive(appointments, bills)
+        with timeline.keeping():
+            Appointment.objects.filter(pk__in=[row['pk'] for row in rows]).delete()
+    return len(appointments), len(bills)
+
+
+def archive(cutoff=None, batch_size=500):
+    """Archive everything archivable before ``cutoff`` in batches; returns counts"""
+    cutoff = cutoff or archive_cutoff()
+    stats = {'appointments': 0, 'bills': 0, 'batches': 0}
+    last = 0
+    while True:
+        ids = list(
+            archivable(cutoff).filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return stats
+        moved_appointments, moved_bills = archive_batch(ids, cutoff)
+        stats['appointments'] += moved_appointments
+        stats['bills'] += moved_bills
+        stats['batches'] += 1
+        last = ids[-1]
+
+
+class Records:
+    """
+    Live and archived rows as one newest-first sequence of dicts.
+
+    ``live`` and ``archived`` are the filtered querysets; ``live_fields``
+    and ``archived_fields`` are the annotations that give both the same
+    ``columns``. Supports ``count()``, slicing (so it works with
+    ``Paginator``) and iteration, which streams both sides.
+    """
+
+    def __init__(self, live, archived, order, columns, live_fields, archived_fields):
+        # Counted without the annotations, which would keep their joins
+        self.counted = (live, archived)
+        self.live, self.archived = (
+            queryset.annotate(**fields).order_by(*(f'-{name}' for name in order)).values(*columns)
+            for queryset, fields in ((live, live_fields), (archived, archived_fields))
+        )
+        self.order = order
+        self.columns = columns
+
+    def key(self, row):
+        return tuple(row[name] for name in self.order)
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.counted)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return heapq.merge(
+            self.live.iterator(chunk_size=2000), self.archived.iterator(chunk_size=2000),
+            key=self.key, reverse=True,
+        )
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        stop = index.stop
+        if stop is None:
+            return list(islice(self, index.start, None))
+        # The first ``stop`` merged rows come from the first ``stop`` of each side
+        merged = heapq.merge(list(self.live[:stop]), list(self.archived[:stop]), key=self.key, reverse=True)
+        return list(islice(merged, index.start, stop))
+
+
+def appointment_records(user, patient_name=None, doctor_name=None, date_from=None, date_to=None, status=None):
+    """Every appointment ``user`` may see, live or archived, newest first"""
+    live = Appointment.objects.visible_to(user)
+    archived = ArchivedAppointment.objects.visible_to(user)
+    if patient_name:
+        live = live.filter(Q(patient__user__first_name__icontains=patient_name)
+                           | Q(patient__user__last_name__icontains=patient_name))
+        archived = archived.filter(patient_name__icontains=patient_name)
+    if doctor_name:
+        live = live.filter(Q(doctor__user__first_name__icontains=doctor_name)
+                           | Q(doctor__user__last_name__icontains=doctor_name))
+        archived = archived.filter(doctor_name__icontains=doctor_name)
+    for lookup, value in [('appointment_date__gte', date_from), ('appointment_date__lte', date_to),
+                          ('status', status)]:
+        if value:
+            live, archived = live.filter(**{lookup: value}), archived.filter(**{lookup: value})
+    return Records(
+        live, archived,
+        order=('appointment_date', 'appointment_time', 'id'),
+        columns=['id', 'appointment_date', 'appointment_time', 'appointment_type', 'status', 'reason',
+                 'patient_code', 'patient_name', 'doctor_name', 'specialization', 'archived'],
+        live_fields={
+            'patient_code': F('patient__patient_id'),
+            'patient_name': Concat('patient__user__first_name', Value(' '), 'patient__user__last_name'),
+            'doctor_name': Concat('doctor__user__first_name', Value(' '), 'doctor__user__last_name'),
+            'specialization': F('doctor__specialization'),
+            'archived': Value(False),
+        },
+        archived_fields={'archived': Value(True)},
+    )
+
+
+def bill_records(user, patient_name=None, date_from=None, date_to=None, payment_status=None):
+    """Every bill ``user`` may see, live or archived, newest first"""
+    live = Billing.objects.visible_to(user)
+    archived = ArchivedBilling.objects.visible_to(user)
+    if patient_name:
+        live = live.filter(Q(appointment__patient__user__first_name__icontains=patient_name)
+                           | Q(appointment__patient__user__last_name__icontains=patient_name))
+        archived = archived.filter(appointment__patient_name__icontains=patient_name)
+    for lookup, value in [('appointment__appointment_date__gte', date_from),
+                          ('appointment__appointment_date__lte', date_to), ('payment_status', payment_status)]:
+        if value:
+            live, archived = live.filter(**{lookup: value}), archived.filter(**{lookup: value})
+    return Records(
+        live, archived,
+        order=('created_at', 'id'),
+        columns=['id', 'appointment_id', 'appointment_date', 'patient_name', 'doctor_name', 'total_amount',
+                 'payment_status', 'payment_method', 'payment_date', 'created_at', 'archived'],
+        live_fields={
+            'appointment_date': F('appointment__appointment_date'),
+            'patient_name': Concat('appointment__patient__user__first_name', Value(' '),
+                                   'appointment__patient__user__last_name'),
+            'doctor_name': Concat('appointment__doctor__user__first_name', Value(' '),
+                                  'appointment__doctor__user__last_name'),
+            'archived': Value(False),
+        },
+        archived_fields={
+            'appointment_date': F('appointment__appointment_date'),
+            'patient_name': F('appointment__patient_name'),
+            'doctor_name': F('appointment__doctor_name'),
+            'archived': Value(True),
+        },
+    )
+
+
+def csv_chunks(records, rows_per_chunk=1000):
+    """``records`` as CSV text with a header row, in chunks for streaming"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=records.columns)
+    writer.writeheader()
+    for number, row in enumerate(records, start=1):
+        writer.writerow(row)
+        if number % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
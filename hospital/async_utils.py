@@ -0,0 +1,100 @@
+"""
+Helpers for the async views.
+
+Django's async ORM methods (``acount()``, ``afirst()``, ...) all hop onto
+the single thread-sensitive executor, so awaiting several of them with
+``asyncio.gather`` still runs them one after another. ``gather_queries``
+instead runs each query on a dedicated pool of ``ASYNC_QUERY_WORKERS``
+threads, each with its own persistent database connection, so
+independent queries really overlap. The pool outlives any one event loop,
+so views served through WSGI (one loop per request) reuse its threads
+and connections too.
+
+A query on the pool uses its own connection, which sees only committed
+data. So inside a transaction (``atomic()``, ``ATOMIC_REQUESTS``, a test
+case) the queries run one after another on the caller's connection,
+where they see its uncommitted writes. The pool adds up to
+``ASYNC_QUERY_WORKERS`` database connections to each process; set it to 0
+to run every query on the caller's connection.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.mixins import AccessMixin
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections, connections
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def query_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ASYNC_QUERY_WORKERS', 8),
+                thread_name_prefix='hospital-query',
+            )
+        return _executor
+
+
+def _run_on_own_connection(query):
+    # Pool threads never see request_started/finished, so apply
+    # CONN_MAX_AGE and drop broken connections here instead.
+    close_old_connections()
+    try:
+        return query()
+    finally:
+        close_old_connections()
+
+
+def in_transaction():
+    """Whether this thread has a transaction open on any database"""
+    return any(connection.in_atomic_block for connection in connections.all(initialized_only=True))
+
+
+async def gather_queries(**queries):
+    """
+    Run independent ORM calls concurrently.
+
+    Each keyword maps a name to a zero-argument callable that evaluates a
+    query (``Doctor.objects.count``, ``lambda: list(qs[:5])``); the result
+    is a dict of the same names to their return values. Inside a
+    transaction they run one after another on the caller's connection.
+    """
+    names = list(queries)
+    if getattr(settings, 'ASYNC_QUERY_WORKERS', 8) < 1 or await sync_to_async(in_transaction)():
+        results = await sync_to_async(lambda: [queries[name]() for name in names])()
+    else:
+        run = sync_to_async(_run_on_own_connection, thread_sensitive=False, executor=query_executor())
+        results = await asyncio.gather(*(run(queries[name]) for name in names))
+    return dict(zip(names, results))
+
+
+async def is_authenticated(request):
+    return await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+def async_login_required(view):
+    """``login_required`` for coroutine views"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await is_authenticated(request):
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """``LoginRequiredMixin`` for class-based views with async handlers"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not await is_authenticated(request):
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
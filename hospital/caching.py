@@ -0,0 +1,50 @@
+"""
+Per-object cache for the JSON detail payloads served by ``hospital.api``.
+
+Keys carry a generation number so that changes touching many payloads at
+once (a doctor's fee, a user's name) can expire everything with a single
+increment instead of a scan.
+
+Everything here lives in the ``shared`` cache: the signal that drops a
+payload runs in whichever worker made the change, and every other worker
+must miss on it afterwards. Without a cache the workers share (see
+``CACHE_URL``) that alias is a dummy cache and every lookup misses.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.utils.connection import ConnectionProxy
+
+SHARED_CACHE_ALIAS = 'shared'
+DETAIL_CACHE_TIMEOUT = 60 * 15
+GENERATION_KEY = 'hospital:detail:generation'
+
+cache = ConnectionProxy(caches, SHARED_CACHE_ALIAS)
+
+
+def shared():
+    """Whether entries written here are seen by every worker process"""
+    return not isinstance(caches[SHARED_CACHE_ALIAS], DummyCache)
+
+
+def cache_key(kind, pk):
+    generation = cache.get_or_set(GENERATION_KEY, 1, None)
+    return f'hospital:detail:{generation}:{kind}:{pk}'
+
+
+async def acache_key(kind, pk):
+    generation = await cache.aget_or_set(GENERATION_KEY, 1, None)
+    return f'hospital:detail:{generation}:{kind}:{pk}'
+
+
+def invalidate(kind, *pks):
+    """Drop cached payloads for the given objects"""
+    if pks:
+        cache.delete_many([cache_key(kind, pk) for pk in pks])
+
+
+def invalidate_all():
+    """Expire every cached payload"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
@@ -0,0 +1,173 @@
+"""
+Doctor-by-day capacity for the admin planner.
+
+A doctor's capacity on a day is the number of ``SCHEDULE_SLOT_MINUTES``
+slots between their ``available_from`` and ``available_to`` (none while
+they are not available). Each appointment takes as many slots as its
+type's duration covers (``APPOINTMENT_DURATIONS``), as on the doctors'
+timelines. The booked and cancelled slots of every doctor and day in the
+range come from a single grouped aggregate over the (date, doctor,
+status) index, so the cost grows with the number of appointments in the
+range rather than with the size of the grid.
+"""
+import csv
+import io
+import math
+from collections import namedtuple
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import List
+
+from django.db.models import Case, IntegerField, Q, Sum, Value, When
+from django.utils.safestring import mark_safe
+
+from .models import Appointment, Doctor
+from .schedule import appointment_durations, slot_minutes, to_minutes
+
+MAX_DAYS = 90
+SPECIALIZATIONS = dict(Doctor.SPECIALIZATION_CHOICES)
+
+
+class Cell(namedtuple('Cell', 'capacity booked cancelled')):
+    __slots__ = ()
+
+    @property
+    def free(self):
+        return max(self.capacity - self.booked, 0)
+
+    @property
+    def utilization(self):
+        """Booked share of capacity, or None on a day with no capacity"""
+        return self.booked / self.capacity if self.capacity else None
+
+    @property
+    def level(self):
+        """0-4 for colouring the grid; 4 means full or overbooked"""
+        if self.utilization is None:
+            return 0 if not self.booked else 4
+        return min(4, int(self.utilization * 4))
+
+    def __add__(self, other):
+        return Cell(*(a + b for a, b in zip(self, other)))
+
+
+EMPTY = Cell(0, 0, 0)
+
+
+@dataclass
+class Row:
+    label: str
+    specialization: str
+    cells: List[Cell] = field(default_factory=list)
+
+    @property
+    def total(self):
+        return sum(self.cells, EMPTY)
+
+    @property
+    def cells_html(self):
+        # Built here rather than in the template: looping 45,000 cells
+        # through the template engine takes seconds. Only integers are
+        # interpolated, so the markup is safe.
+        return mark_safe(''.join(
+            f'<td class="cap-{cell.level}" title="{cell.free} free, {cell.cancelled} cancelled">'
+            f'{cell.booked}/{cell.capacity}</td>'
+            for cell in self.cells
+        ))
+
+
+@dataclass
+class Grid:
+    dates: list
+    doctors: List[Row]
+    departments: List[Row]
+
+    @property
+    def total(self):
+        return sum((row.total for row in self.departments), EMPTY)
+
+
+def slots_per_day(available_from, available_to, is_available=True):
+    if not is_available:
+        return 0
+    return max(0, (to_minutes(available_to) - to_minutes(available_from)) // slot_minutes())
+
+
+def appointment_slots():
+    """The slots each appointment takes, by its type, as an SQL expression"""
+    per_slot = slot_minutes()
+    return Case(
+        *(When(appointment_type=kind, then=Value(math.ceil(minutes / per_slot)))
+          for kind, minutes in appointment_durations().items()),
+        default=Value(1), output_field=IntegerField(),
+    )
+
+
+def appointment_counts(start, end, specialization=None):
+    """{(doctor_id, date): (booked, cancelled)} slots for every doctor-day with appointments in [start, end]"""
+    appointments = Appointment.objects.filter(appointment_date__range=(start, end))
+    if specialization:
+        appointments = appointments.filter(doctor__specialization=specialization)
+    rows = (
+        appointments
+        .values('appointment_date', 'doctor_id')
+        .annotate(
+            booked=Sum(appointment_slots(), filter=~Q(status='cancelled'), default=0),
+            cancelled=Sum(appointment_slots(), filter=Q(status='cancelled'), default=0),
+        )
+        .order_by()
+        .values_list('doctor_id', 'appointment_date', 'booked', 'cancelled')
+    )
+    return {(doctor_id, day): (booked, cancelled) for doctor_id, day, booked, cancelled in rows}
+
+
+def capacity_grid(start, days, specialization=None):
+    """The planner grid for ``days`` days from ``start``: two queries"""
+    days = max(1, min(days, MAX_DAYS))
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+    doctors = Doctor.objects.order_by('specialization', 'user__last_name', 'user__first_name')
+    if specialization:
+        doctors = doctors.filter(specialization=specialization)
+    doctors = doctors.values_list(
+        'pk', 'user__first_name', 'user__last_name', 'specialization',
+        'available_from', 'available_to', 'is_available',
+    )
+    counts = appointment_counts(dates[0], dates[-1], specialization)
+
+    rows, totals = [], {}
+    for pk, first_name, last_name, doctor_specialization, available_from, available_to, is_available in doctors:
+        capacity = slots_per_day(available_from, available_to, is_available)
+        cells = [Cell(capacity, *counts.get((pk, day), (0, 0))) for day in dates]
+        rows.append(Row(f'Dr. {first_name} {last_name}'.strip(), doctor_specialization, cells))
+        # Department totals as plain per-day sums: far cheaper than adding Cells
+        department = totals.setdefault(doctor_specialization, [[0] * days, [0] * days, [0] * days])
+        for column, values in zip(department, zip(*cells)):
+            for index, value in enumerate(values):
+                column[index] += value
+    departments = [
+        Row(SPECIALIZATIONS.get(key, key), key, [Cell(*sums) for sums in zip(*columns)])
+        for key, columns in totals.items()
+    ]
+    return Grid(dates, rows, departments)
+
+
+def csv_chunks(grid, rows_per_chunk=1000):
+    """The grid as CSV text, one row per doctor-day, in chunks for streaming"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for number, row in enumerate(csv_rows(grid), start=1):
+        writer.writerow(row)
+        if number % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_rows(grid):
+    yield ['doctor', 'specialization', 'date', 'capacity', 'booked', 'cancelled', 'free', 'utilization']
+    for row in grid.doctors:
+        for day, cell in zip(grid.dates, row.cells):
+            utilization = '' if cell.utilization is None else f'{cell.utilization:.2f}'
+            yield [row.label, row.specialization, day.isoformat(), cell.capacity, cell.booked,
+                   cell.cancelled, cell.free, utilization]
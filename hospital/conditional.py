@@ -0,0 +1,161 @@
+"""
+HTTP caching for the page views: ``Cache-Control`` and ``Vary`` policies,
+and validators (``ETag`` and ``Last-Modified``) that answer a repeat
+request with 304 Not Modified before the view renders anything.
+
+A page's validator is built from things that are cheap to look up and
+that change whenever the page would:
+
+- version stamps for doctors, patients, users and bills, kept in the
+  shared cache (``hospital.caching``) and moved on by the signal handlers
+  in ``hospital.signals``;
+- the newest ``updated_at`` and the row count (which catches deletions)
+  of the appointments the user may see, in one aggregate query;
+- the templates' modification time, which moves with each deploy;
+- who is asking: their user, role and CSRF cookie.
+
+Stamps are times in nanoseconds, so the newest part doubles as the
+page's ``Last-Modified``. A process-local stamp would let one worker
+answer 304 for a change another worker made, so pages built from stamps
+send no validators unless ``CACHE_URL`` names a shared cache (Memcached,
+Redis) and are rendered in full every time.
+
+Public pages may be kept by shared caches for anonymous visitors (never
+pages with a form, whose CSRF token is the visitor's own); pages
+for signed-in users only by their own browser, which revalidates them on
+each visit (or after ``PAGE_CACHE_PRIVATE_SECONDS``). Either way a repeat
+visit costs the lookups above instead of a render. Pages with flash
+messages waiting are never answered with a 304, since the client's copy
+would not show them.
+"""
+import hashlib
+import time
+from datetime import datetime
+from functools import cache as memoize
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max
+from django.template import engines
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import caching
+from .caching import cache
+from .identity import get_user_context
+
+STAMP_KEY = 'hospital:stamp:{}'
+
+
+def stamps(*kinds):
+    """The current version stamp of each kind; a kind seen for the first time starts now"""
+    keys = [STAMP_KEY.format(kind) for kind in kinds]
+    found = cache.get_many(keys)
+    return [found[key] if key in found else cache.get_or_set(key, time.time_ns, None) for key in keys]
+
+
+def bump(*kinds):
+    """Move the stamps on, so every page built from them changes its validator"""
+    now = time.time_ns()
+    cache.set_many({STAMP_KEY.format(kind): now for kind in kinds}, None)
+
+
+def appointment_state(queryset):
+    """(count, newest ``updated_at``) of an appointment queryset, in one query"""
+    state = queryset.order_by().aggregate(count=Count('pk'), latest=Max('updated_at'))
+    return state['count'], state['latest']
+
+
+@memoize
+def templates_modified():
+    """Newest modification time of the project's templates, in nanoseconds"""
+    newest = 0
+    for engine in engines.all():
+        for directory in map(Path, getattr(engine, 'dirs', [])):
+            for path in directory.rglob('*'):
+                if path.is_file():
+                    newest = max(newest, path.stat().st_mtime_ns)
+    return newest
+
+
+def nanoseconds(moment):
+    return int(moment.timestamp() * 1_000_000_000)
+
+
+class ConditionalGetMixin:
+    """
+    Validators and cache headers for a page view's GET and HEAD requests.
+
+    ``cache_stamps`` names the version stamps the page is built from;
+    override ``page_state()`` to add values that need a query. With
+    ``public_cache`` set, anonymous visitors' copies may be kept by shared
+    caches for ``PAGE_CACHE_PUBLIC_SECONDS``, so it must not be set on
+    pages that render a CSRF token; other pages are kept by the
+    browser alone, for ``PAGE_CACHE_PRIVATE_SECONDS`` before it must
+    revalidate.
+    """
+    cache_stamps = ()
+    public_cache = False
+
+    def page_state(self):
+        """Values the page depends on beyond its stamps, such as ``appointment_state()``"""
+        return ()
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self.async_conditional_dispatch(request, *args, **kwargs)
+        policy = self.cache_policy()
+        response = self.not_modified(policy) or super().dispatch(request, *args, **kwargs)
+        return self.patch_response(response, policy)
+
+    async def async_conditional_dispatch(self, request, *args, **kwargs):
+        # The user, session and stamps are all sync lookups
+        policy = await sync_to_async(self.cache_policy)()
+        response = self.not_modified(policy) or await super().dispatch(request, *args, **kwargs)
+        return self.patch_response(response, policy)
+
+    def cache_policy(self):
+        """
+        (etag, last modified in seconds, public) for this request; no
+        validators while messages wait, or when the stamps are process-local
+        """
+        user = self.request.user
+        if len(get_messages(self.request)):
+            return None, None, False
+        public = self.public_cache and not user.is_authenticated
+        if self.cache_stamps and not caching.shared():
+            return None, None, public
+        identity = (user.pk, get_user_context(user).role, user.is_staff, self.request.META.get('CSRF_COOKIE', ''))
+        times = [templates_modified(), *stamps(*self.cache_stamps)]
+        state = list(self.page_state())
+        times += [nanoseconds(value) for value in state if isinstance(value, datetime)]
+        digest = hashlib.sha256(repr((identity, times, state)).encode()).hexdigest()[:32]
+        last_modified = max(times) // 1_000_000_000
+        # Rendered pages differ byte for byte (the masked CSRF token), so the tag is weak
+        return f'W/"{digest}"', last_modified, public
+
+    def not_modified(self, policy):
+        etag, last_modified, _ = policy
+        if etag is None:
+            return None
+        return get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+
+    def patch_response(self, response, policy):
+        etag, last_modified, public = policy
+        if response.status_code not in (200, 304):
+            return response
+        if etag is not None:
+            response.headers['ETag'] = etag
+            response.headers['Last-Modified'] = http_date(last_modified)
+        if public:
+            patch_cache_control(response, public=True, max_age=getattr(settings, 'PAGE_CACHE_PUBLIC_SECONDS', 60))
+        elif getattr(settings, 'PAGE_CACHE_PRIVATE_SECONDS', 0):
+            patch_cache_control(response, private=True, max_age=settings.PAGE_CACHE_PRIVATE_SECONDS)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+        return response
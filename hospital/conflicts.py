@@ -0,0 +1,99 @@
+"""
+Overlap checks for appointments that last as long as their type.
+
+An appointment occupies [start, start + duration) where the duration comes
+from ``schedule.appointment_minutes()``. Two bookings with the same doctor
+(or the same patient) conflict when those intervals overlap, so a 09:15
+booking clashes with a 30-minute consultation at 09:00 even though the
+start times differ.
+
+``overlapping()`` answers that for one new booking with a bounded range
+scan of the (doctor, date, time) index: only appointments starting less
+than the longest duration before the new one can reach into it.
+``find_overlaps()`` audits existing data with one ordered pass and a sweep
+line, so it needs memory for one doctor-day at a time, not the table.
+
+A check and the insert it allows must run in one transaction that called
+``lock_doctor()`` first, or two bookings checked at the same moment could
+both pass and both be saved.
+"""
+from collections import namedtuple
+
+from .models import Appointment, Doctor
+from .schedule import appointment_durations, appointment_minutes, slot_minutes, to_minutes, to_time
+
+Booked = namedtuple('Booked', 'pk start end appointment_type')
+Overlap = namedtuple('Overlap', 'doctor_id day first second')
+
+
+def interval(appointment_type, start):
+    """(start, end) in minutes since midnight"""
+    begin = to_minutes(start)
+    return begin, begin + appointment_minutes(appointment_type)
+
+
+def lock_doctor(doctor_id):
+    """
+    Hold the doctor's bookings until the transaction ends. PostgreSQL locks
+    the doctor's row; SQLite has no row locks, but its IMMEDIATE
+    transactions (``SQLITE_TRANSACTION_MODE``) hold the database's write
+    lock from the start.
+    """
+    list(Doctor.objects.select_for_update().filter(pk=doctor_id).values_list('pk', flat=True))
+
+
+def overlapping(day, start, appointment_type, doctor_id=None, patient_id=None, exclude_pk=None):
+    """
+    Active appointments of ``doctor_id`` (or ``patient_id``) on ``day`` that
+    overlap a new ``appointment_type`` booking at ``start``, as ``Booked``.
+    """
+    begin, end = interval(appointment_type, start)
+    earliest = begin - max(appointment_durations().values(), default=slot_minutes())
+    candidates = Appointment.objects.filter(appointment_date=day, appointment_time__lt=to_time(end))
+    if earliest >= 0:
+        candidates = candidates.filter(appointment_time__gt=to_time(earliest))
+    if doctor_id is not None:
+        candidates = candidates.filter(doctor_id=doctor_id)
+    if patient_id is not None:
+        candidates = candidates.filter(patient_id=patient_id)
+    if exclude_pk is not None:
+        candidates = candidates.exclude(pk=exclude_pk)
+    rows = candidates.exclude(status='cancelled').order_by('appointment_time').values_list(
+        'pk', 'appointment_time', 'appointment_type',
+    )
+    booked = []
+    for pk, other_start, other_type in rows:
+        other_begin, other_end = interval(other_type, other_start)
+        if other_begin < end and other_end > begin:
+            booked.append(Booked(pk, other_start, to_time(other_end), other_type))
+    return booked
+
+
+def find_overlaps(appointments=None, chunk_size=5000):
+    """
+    Yield an ``Overlap`` for every pair of active appointments of one
+    doctor whose intervals overlap, scanning ``appointments`` (default: all)
+    once in (doctor, date, time) order.
+    """
+    if appointments is None:
+        appointments = Appointment.objects.all()
+    rows = (
+        appointments.exclude(status='cancelled')
+        .order_by('doctor_id', 'appointment_date', 'appointment_time')
+        .values_list('pk', 'doctor_id', 'appointment_date', 'appointment_time', 'appointment_type')
+        .iterator(chunk_size=chunk_size)
+    )
+    durations = appointment_durations()
+    default = slot_minutes()
+    current, active = None, []
+    for pk, doctor_id, day, start, appointment_type in rows:
+        if (doctor_id, day) != current:
+            current, active = (doctor_id, day), []
+        begin = to_minutes(start)
+        end = begin + durations.get(appointment_type, default)
+        # Still running when this one starts
+        active = [booked for booked in active if to_minutes(booked.end) > begin]
+        booked = Booked(pk, start, to_time(end), appointment_type)
+        for earlier in active:
+            yield Overlap(doctor_id, day, earlier, booked)
+        active.append(booked)
@@ -0,0 +1,6 @@
+from .identity import get_user_context
+
+
+def user_role(request):
+    """Expose the current user's role as ``user_role`` without a query"""
+    return {'user_role': get_user_context(request.user).role}
@@ -0,0 +1,331 @@
+"""
+Change feed of appointment and bill writes, streamed to the dashboards
+as server-sent events.
+
+Every save or delete of an appointment or bill adds a ``ChangeEvent`` row
+in the same transaction (``hospital.signals``). Clients connect to
+``/events/`` with an ``EventSource`` and get the events they may see: a
+doctor's and a patient's own, and all of them for admins.
+
+Under an ASGI server ``EventStreamApp`` answers ``/events/`` before
+Django does. Django's handler would give every open request a thread of
+its own (and with it a database connection) for as long as it streams;
+the app instead checks the session once on the shared query pool, then
+leaves the connection to the event loop. Each loop runs one poller that
+reads new rows every ``FEED_POLL_SECONDS`` (one query however many
+clients are connected) and hands each event to the queues of the
+connections that may see it. An idle connection is a coroutine waiting
+on its queue plus a heartbeat comment now and then, so a worker holds
+thousands of them.
+
+Each stream ends after ``FEED_STREAM_SECONDS``, so a session that logged
+out stops getting events. The browser reconnects with the id of the last
+event it got (``Last-Event-ID``) and is sent what it missed from the
+table. Under WSGI nothing can stream, and a request left waiting would
+hold one of the server's few threads, so the ``event_stream`` view answers
+at once with what the client missed and tells it to ask again in
+``FEED_WSGI_RETRY_MS``.
+
+Ids can commit out of order (a transaction that took its id first may
+commit last), so the poller keeps the ids it skipped over and looks for
+them again for ``FEED_GAP_SECONDS`` before giving them up. Only the
+``GAP_WINDOW`` ids below the newest are kept, so a jump in the sequence
+does not turn each poll into a query for every id it skipped.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import time
+import weakref
+from collections import defaultdict
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib import auth
+from django.db import DatabaseError
+from django.db.models import Max, Q
+from django.http import HttpRequest, parse_cookie
+from django.urls import reverse
+
+from .async_utils import gather_queries
+from .identity import get_user_context
+from .models import ChangeEvent
+
+logger = logging.getLogger(__name__)
+
+# Events a reconnecting client is sent; past that it reloads the page instead
+BACKLOG_LIMIT = 200
+QUEUE_SIZE = 100
+# Skipped ids looked for again only within this many of the newest one;
+# a bigger jump (a bumped sequence, many rolled back inserts) is let go
+GAP_WINDOW = 1000
+
+
+def setting(name, default):
+    return getattr(settings, name, default)
+
+
+def record(kind, instance, action, doctor_id, patient_id, **data):
+    """Add the write of ``instance`` to the feed; call inside the writing transaction"""
+    return ChangeEvent.objects.create(
+        kind=kind, object_id=instance.pk, action=action, doctor_id=doctor_id, patient_id=patient_id, data=data,
+    )
+
+
+def prune(before):
+    """Delete events created before ``before``; returns how many went"""
+    return ChangeEvent.objects.filter(created_at__lt=before).delete()[0]
+
+
+def subscription(current):
+    """The feed key a user context listens on, or None if it may not listen"""
+    if current.role == 'admin':
+        return ('admin', None)
+    if current.role == 'doctor' and current.doctor_id:
+        return ('doctor', current.doctor_id)
+    if current.role == 'patient' and current.patient_id:
+        return ('patient', current.patient_id)
+    return None
+
+
+def visible(key):
+    """Events the subscription ``key`` may see"""
+    role, pk = key
+    if role == 'admin':
+        return ChangeEvent.objects.all()
+    return ChangeEvent.objects.filter(**{f'{role}_id': pk})
+
+
+def keys_for(event):
+    return ('admin', None), ('doctor', event.doctor_id), ('patient', event.patient_id)
+
+
+def missed(key, after):
+    """Events for ``key`` after the id ``after``, oldest first, up to one more than BACKLOG_LIMIT"""
+    return list(visible(key).filter(pk__gt=after).order_by('pk')[:BACKLOG_LIMIT + 1])
+
+
+def latest_id():
+    return ChangeEvent.objects.aggregate(latest=Max('pk'))['latest'] or 0
+
+
+def message(event):
+    """A ChangeEvent as a server-sent event"""
+    data = {'id': event.object_id, 'action': event.action, **event.data}
+    return f'id: {event.pk}\nevent: {event.kind}\ndata: {json.dumps(data)}\n\n'
+
+
+def ready(latest):
+    """Tells a new client the feed's position, which it sends back as Last-Event-ID when it reconnects"""
+    return f'id: {latest}\nevent: ready\ndata: {{}}\n\n'
+
+
+RESYNC = 'event: resync\ndata: {}\n\n'
+
+
+class Hub:
+    """One event loop's open streams, and the poller that feeds them"""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.cursor = None
+        self.gaps = {}
+        self.poller = None
+
+    def subscribe(self, key):
+        queue = asyncio.Queue(QUEUE_SIZE)
+        queue.overflowed = False
+        self.subscribers[key].add(queue)
+        if self.poller is None or self.poller.done():
+            # Not in the subscribing request's context: the poller outlives that request
+            self.poller = asyncio.get_running_loop().create_task(self.poll(), context=contextvars.Context())
+        return queue
+
+    def unsubscribe(self, key, queue):
+        queues = self.subscribers.get(key)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[key]
+
+    async def poll(self):
+        # Stops with the last subscriber and starts again with the next one
+        try:
+            while self.subscribers:
+                try:
+                    events = (await gather_queries(events=self.fetch))['events']
+                except DatabaseError as exc:
+                    logger.warning('Change feed poll failed: %s', exc)
+                else:
+                    self.deliver(events)
+                await asyncio.sleep(setting('FEED_POLL_SECONDS', 1))
+        finally:
+            # The next poller starts from the feed's position then, not from
+            # here: its new subscribers were sent their backlog already
+            self.cursor = None
+            self.gaps = {}
+
+    def fetch(self):
+        """New events since the last fetch, and any that filled an earlier gap"""
+        if self.cursor is None:
+            self.cursor = latest_id()
+            return []
+        now = time.monotonic()
+        self.gaps = {pk: seen for pk, seen in self.gaps.items() if now - seen < setting('FEED_GAP_SECONDS', 60)}
+        events = list(ChangeEvent.objects.filter(Q(pk__gt=self.cursor) | Q(pk__in=self.gaps)).order_by('pk'))
+        dropped = 0
+        for event in events:
+            if event.pk in self.gaps:
+                del self.gaps[event.pk]
+            elif event.pk > self.cursor:
+                first = max(self.cursor + 1, event.pk - GAP_WINDOW)
+                dropped += first - self.cursor - 1
+                self.gaps.update(dict.fromkeys(range(first, event.pk), now))
+                self.cursor = event.pk
+        kept = {pk: seen for pk, seen in self.gaps.items() if pk >= self.cursor - GAP_WINDOW}
+        dropped += len(self.gaps) - len(kept)
+        self.gaps = kept
+        if dropped:
+            logger.warning('Change feed jumped to id %s; not looking for %s skipped ids below it', self.cursor, dropped)
+        return events
+
+    def deliver(self, events):
+        for event in events:
+            for key in keys_for(event):
+                for queue in list(self.subscribers.get(key, ())):
+                    try:
+                        queue.put_nowait(event)
+                    except asyncio.QueueFull:
+                        # A stalled reader: end its stream, and it catches up from the table
+                        queue.overflowed = True
+                        self.unsubscribe(key, queue)
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def hub():
+    """The running event loop's hub"""
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = Hub()
+    return _hubs[loop]
+
+
+async def backlog(key, last_event_id):
+    """
+    Messages for what a reconnecting client missed, and the event ids they
+    cover; a new client (no last event id) is told where the feed is.
+    """
+    if last_event_id is None:
+        return [ready((await gather_queries(latest=latest_id))['latest'])], set()
+    events = (await gather_queries(events=lambda: missed(key, last_event_id)))['events']
+    if len(events) > BACKLOG_LIMIT:
+        return [RESYNC], set()
+    return [message(event) for event in events], {event.pk for event in events}
+
+
+async def stream(key, last_event_id=None):
+    """Server-sent events for ``key`` until FEED_STREAM_SECONDS pass or the reader falls behind"""
+    events = hub()
+    queue = events.subscribe(key)
+    try:
+        # Subscribed first, so nothing written while the backlog loads is lost
+        sent, seen = await backlog(key, last_event_id)
+        yield f'retry: {setting("FEED_RETRY_MS", 3000)}\n\n'
+        for chunk in sent:
+            yield chunk
+        deadline = time.monotonic() + setting('FEED_STREAM_SECONDS', 300)
+        while (remaining := deadline - time.monotonic()) > 0:
+            if queue.empty() and queue.overflowed:
+                return
+            try:
+                event = await asyncio.wait_for(queue.get(), min(remaining, setting('FEED_HEARTBEAT_SECONDS', 15)))
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+                continue
+            if event.pk not in seen:
+                yield message(event)
+    finally:
+        events.unsubscribe(key, queue)
+
+
+async def catch_up(key, last_event_id=None):
+    """
+    The body of one polling response, for WSGI servers: what the client
+    missed, and when to ask again (``FEED_WSGI_RETRY_MS``).
+    """
+    sent, _ = await backlog(key, last_event_id)
+    return f'retry: {setting("FEED_WSGI_RETRY_MS", 10000)}\n\n' + ''.join(sent)
+
+
+def session_subscription(session_key):
+    """The feed key of the user signed in with ``session_key``, as ``AuthenticationMiddleware`` would find them"""
+    if not session_key:
+        return None
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    user = auth.get_user(request)
+    if not user.is_authenticated:
+        return None
+    return subscription(get_user_context(user))
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class EventStreamApp:
+    """ASGI app that streams ``/events/`` itself and passes everything else to ``application``"""
+
+    def __init__(self, application):
+        self.application = application
+        self.path = None
+
+    async def __call__(self, scope, receive, send):
+        if self.path is None:
+            self.path = reverse('events')
+        if scope['type'] == 'http' and scope['path'] == self.path and scope['method'] == 'GET':
+            await self.serve(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
+
+    async def serve(self, scope, receive, send):
+        headers = dict(scope['headers'])
+        cookies = parse_cookie(headers.get(b'cookie', b'').decode('latin-1'))
+        session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+        key = (await gather_queries(key=lambda: session_subscription(session_key)))['key']
+        if key is None:
+            await send({'type': 'http.response.start', 'status': 403, 'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Sign in to follow changes.'})
+            return
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Proxies such as nginx must pass events on as they come
+            (b'x-accel-buffering', b'no'),
+        ]})
+        last_event_id = parse_event_id(headers.get(b'last-event-id', b'').decode('latin-1'))
+
+        async def pump():
+            async for chunk in stream(key, last_event_id):
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        pumping = asyncio.ensure_future(pump())
+        listening = asyncio.ensure_future(wait_for_disconnect(receive))
+        await asyncio.wait({pumping, listening}, return_when=asyncio.FIRST_COMPLETED)
+        # A client that went away cancels its stream, which unsubscribes it
+        pumping.cancel()
+        listening.cancel()
+        if pumping.done() and not pumping.cancelled():
+            pumping.result()
+
+
+def parse_event_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
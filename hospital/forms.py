@@ -1,9 +1,11 @@
 from django import forms
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import PasswordResetForm, UserCreationForm
 from django.contrib.auth.models import User
+from django.template import loader
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, Row, Column, Field
-from .models import UserProfile, Doctor, Patient, Appointment, Billing
+from .models import UserProfile, Doctor, Patient, Appointment, Billing, WaitlistEntry
+from .tasks import send_email
 
 class CustomUserCreationForm(UserCreationForm):
     """Custom user registration form with additional fields"""
@@ -38,6 +40,19 @@ class CustomUserCreationForm(UserCreationForm):
             Submit('submit', 'Register', css_class='btn btn-primary btn-lg w-100')
         )
 
+class QueuedPasswordResetForm(PasswordResetForm):
+    """Password reset form that hands the email to the task queue"""
+    
+    def send_mail(self, subject_template_name, email_template_name, context,
+                  from_email, to_email, html_email_template_name=None):
+        subject = ''.join(loader.render_to_string(subject_template_name, context).splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = None
+        if html_email_template_name is not None:
+            html_body = loader.render_to_string(html_email_template_name, context)
+        send_email.delay(subject=subject, body=body, recipients=[to_email],
+                         from_email=from_email, html_body=html_body)
+
 class UserProfileForm(forms.ModelForm):
     """Form for updating user profile"""
     class Meta:
@@ -134,6 +149,48 @@ class AppointmentSearchForm(forms.Form):
     status = forms.ChoiceField(choices=[('', 'All Status')] + Appointment.STATUS_CHOICES, 
                               required=False)
 
+class WaitlistForm(forms.ModelForm):
+    """Form for joining a doctor's waitlist for a day"""
+    class Meta:
+        model = WaitlistEntry
+        fields = ['doctor', 'appointment_date', 'appointment_type', 'reason']
+        widgets = {
+            'appointment_date': forms.DateInput(attrs={'type': 'date'}),
+            'reason': forms.Textarea(attrs={'rows': 3}),
+        }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from datetime import date
+        self.fields['appointment_date'].widget.attrs['min'] = date.today().isoformat()
+        self.fields['doctor'].queryset = Doctor.objects.filter(is_available=True).select_related('user')
+    
+    def clean_appointment_date(self):
+        from datetime import date
+        day = self.cleaned_data['appointment_date']
+        if day < date.today():
+            raise forms.ValidationError('Choose today or a later date.')
+        return day
+
+class RecordSearchForm(forms.Form):
+    """Filters for the appointment and bill history, live and archived"""
+    patient_name = forms.CharField(max_length=100, required=False,
+                                   widget=forms.TextInput(attrs={'placeholder': 'Patient Name'}))
+    doctor_name = forms.CharField(max_length=100, required=False,
+                                  widget=forms.TextInput(attrs={'placeholder': 'Doctor Name'}))
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    status = forms.ChoiceField(choices=[('', 'All Status')] + Appointment.STATUS_CHOICES, required=False)
+    payment_status = forms.ChoiceField(choices=[('', 'All Payments')] + Billing.PAYMENT_STATUS_CHOICES,
+                                       required=False)
+
+class CapacityFilterForm(forms.Form):
+    """Range and department shown by the capacity planner"""
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    days = forms.IntegerField(min_value=1, max_value=90, initial=14, required=False)
+    specialization = forms.ChoiceField(choices=[('', 'All Departments')] + Doctor.SPECIALIZATION_CHOICES,
+                                       required=False)
+
 class BillingForm(forms.ModelForm):
     """Form for creating and updating bills"""
     class Meta:
@@ -0,0 +1,173 @@
+"""
+GraphQL-style read queries: several widgets' data, related objects
+included, in one round trip (``/api/v1/query/``).
+
+A query names each widget and says where its rows come from and what to
+return for each, nesting related objects as deep as needed::
+
+    {"upcoming": {"from": "appointments", "where": {"status": "scheduled"}, "limit": 10,
+                  "select": ["appointment_date", "appointment_time",
+                             {"doctor": ["specialization", {"user": ["first_name", "last_name"]}]}]},
+     "bills": {"from": "bills", "limit": 5,
+               "select": ["total_amount", "payment_status", {"appointment": ["appointment_date"]}]}}
+
+It is sent as the body of a POST or as ``?query=`` on a GET, and the
+answer is ``{"data": {"upcoming": [...], "bills": [...]}}``.
+
+The widgets' rows are read as the JSON API reads them (``hospital.rest``:
+the same scoping, ``where`` filters, order and ``limit``), all widgets at
+once. Related objects are then resolved through the request's
+``hospital.loaders.Loaders``: each relation level is one query for all
+the rows of every widget, so 100 appointments with their doctors,
+patients and both users take the same handful of queries as one would.
+"""
+import asyncio
+from collections import namedtuple
+
+import orjson
+from django.core.exceptions import ValidationError
+from django.http import HttpResponseNotAllowed
+
+from .async_utils import gather_queries, is_authenticated
+from .loaders import Loaders
+from .rest import APPOINTMENT, BILL, DOCTOR, PATIENT, ApiError, json_response, page_size, scope
+
+# Fields a type returns, and its relations: name -> (loader, attribute holding the key, type)
+Type = namedtuple('Type', 'fields relations')
+
+TYPES = {
+    'appointment': Type(
+        ('id', 'doctor_id', 'patient_id', 'appointment_date', 'appointment_time', 'appointment_type', 'status',
+         'reason', 'notes', 'created_at', 'updated_at'),
+        {'doctor': ('doctor', 'doctor_id', 'doctor'), 'patient': ('patient', 'patient_id', 'patient'),
+         'bill': ('bill_for_appointment', 'pk', 'bill')},
+    ),
+    'bill': Type(
+        ('id', 'appointment_id', 'total_amount', 'discount_amount', 'additional_charges', 'payment_status',
+         'payment_method', 'payment_date', 'due_date', 'notes', 'created_at'),
+        {'appointment': ('appointment', 'appointment_id', 'appointment')},
+    ),
+    'doctor': Type(
+        ('id', 'specialization', 'license_number', 'experience_years', 'consultation_fee', 'available_from',
+         'available_to', 'is_available', 'bio', 'qualifications'),
+        {'user': ('user', 'user_id', 'user')},
+    ),
+    'patient': Type(
+        ('id', 'patient_id', 'date_of_birth', 'gender', 'blood_group', 'emergency_contact', 'address',
+         'medical_history', 'allergies'),
+        {'user': ('user', 'user_id', 'user')},
+    ),
+    # Names only: the user's email and login stay private
+    'user': Type(('id', 'first_name', 'last_name'), {}),
+}
+
+ROOTS = {'appointments': APPOINTMENT, 'bills': BILL, 'doctors': DOCTOR, 'patients': PATIENT}
+MAX_DEPTH = 4
+MAX_WIDGETS = 10
+
+
+def parse(document):
+    """The widgets of a query document, checked against the types; raises ApiError"""
+    if not isinstance(document, dict) or not 0 < len(document) <= MAX_WIDGETS:
+        raise ApiError(400, f'A query is an object of 1 to {MAX_WIDGETS} widgets.')
+    for alias, widget in document.items():
+        if not isinstance(widget, dict) or widget.get('from') not in ROOTS:
+            raise ApiError(400, f'{alias}: "from" must be one of {", ".join(ROOTS)}.')
+        resource = ROOTS[widget['from']]
+        where = widget.get('where', {})
+        if not isinstance(where, dict) or set(where) - set(resource.filters):
+            raise ApiError(400, f'{alias}: "where" takes {", ".join(resource.filters) or "nothing"}.')
+        check(resource.name, widget.get('select', ['id']), alias)
+    return document
+
+
+def check(type_name, selection, path, depth=0):
+    if depth > MAX_DEPTH:
+        raise ApiError(400, f'{path}: nested more than {MAX_DEPTH} levels.')
+    if not isinstance(selection, list):
+        raise ApiError(400, f'{path}: "select" is a list.')
+    kind = TYPES[type_name]
+    for entry in selection:
+        if isinstance(entry, str):
+            if entry not in kind.fields:
+                raise ApiError(400, f'{path}: unknown field {entry!r}.')
+        elif isinstance(entry, dict):
+            for name, nested in entry.items():
+                if name not in kind.relations:
+                    raise ApiError(400, f'{path}: unknown relation {name!r}.')
+                check(kind.relations[name][2], nested, f'{path}.{name}', depth + 1)
+        else:
+            raise ApiError(400, f'{path}: select field names and {{relation: [...]}} objects.')
+
+
+def rows(widget, user):
+    """The widget's root objects"""
+    resource = ROOTS[widget['from']]
+    filters = {resource.filters[name]: value for name, value in widget.get('where', {}).items()}
+    try:
+        queryset = scope(resource, user).filter(**filters).order_by(*resource.ordering)
+        return list(queryset[:page_size(widget.get('limit'))])
+    except (ValidationError, ValueError, TypeError):
+        raise ApiError(400, f'Invalid "where" for {widget["from"]}.')
+
+
+async def resolve(loaders, type_name, obj, selection):
+    """``obj`` as a dict of its selected fields, its relations loaded in batches"""
+    if obj is None:
+        return None
+    kind = TYPES[type_name]
+    item, nested = {}, []
+    for entry in selection:
+        if isinstance(entry, str):
+            item[entry] = getattr(obj, entry)
+        else:
+            nested += entry.items()
+    if nested:
+        values = await asyncio.gather(*(relation(loaders, kind, obj, name, sub) for name, sub in nested))
+        item.update(zip((name for name, _ in nested), values))
+    return item
+
+
+async def relation(loaders, kind, obj, name, selection):
+    loader, key, target = kind.relations[name]
+    related = await getattr(loaders, loader).load(getattr(obj, key))
+    return await resolve(loaders, target, related, selection)
+
+
+async def execute(document, user, loaders=None):
+    """``{alias: [items]}`` for a query document"""
+    widgets = parse(document)
+    found = await gather_queries(**{
+        alias: (lambda widget=widget: rows(widget, user)) for alias, widget in widgets.items()
+    })
+    loaders = loaders or Loaders()
+    for alias, widget in widgets.items():
+        loader = getattr(loaders, ROOTS[widget['from']].name)
+        for obj in found[alias]:
+            loader.prime(obj.pk, obj)
+    # Every widget at once, so each relation level is one query across all of them
+    results = await asyncio.gather(*(
+        asyncio.gather(*(
+            resolve(loaders, ROOTS[widget['from']].name, obj, widget.get('select', ['id'])) for obj in found[alias]
+        )) for alias, widget in widgets.items()
+    ))
+    return dict(zip(widgets, map(list, results)))
+
+
+async def query_view(request):
+    if request.method not in ('GET', 'POST'):
+        return HttpResponseNotAllowed(['GET', 'POST'])
+    source = request.GET.get('query', '') if request.method == 'GET' else request.body
+    try:
+        document = orjson.loads(source)
+    except orjson.JSONDecodeError:
+        return json_response({'error': 'The query must be JSON.'}, status=400)
+    # Loads the user here, so the query threads share it
+    await is_authenticated(request)
+    try:
+        return json_response({'data': await execute(document, request.user)})
+    except ApiError as exc:
+        return json_response({'error': str(exc)}, status=exc.status)
+
+
+query_view.use_replica = True
@@ -0,0 +1,78 @@
+"""
+Who the current user is to the hospital: their role and, where they have
+one, the PK of their Doctor or Patient record.
+
+``hospital.middleware.UserContextMiddleware`` resolves this once per
+session and keeps it in the session, so views and templates never query ``UserProfile``,
+``Doctor`` or ``Patient`` just to branch on the role. Each stored context
+carries a token from the shared cache (``hospital.caching``); changing a
+user's profile, doctor or patient record drops the token, and their next
+request re-resolves, whichever worker serves it. Without a cache the
+workers share, nothing is stored and each request resolves the context
+afresh.
+"""
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from django.contrib.auth.models import User
+
+from .caching import cache
+
+SESSION_KEY = '_hospital_user_context'
+USER_ATTR = '_hospital_context'
+
+
+@dataclass(frozen=True)
+class UserContext:
+    user_id: Optional[int] = None
+    role: Optional[str] = None
+    doctor_id: Optional[int] = None
+    patient_id: Optional[int] = None
+    token: str = ''
+
+
+ANONYMOUS = UserContext()
+
+
+def _token_key(user_id):
+    return f'hospital:user-context:{user_id}'
+
+
+def current_token(user_id):
+    return cache.get_or_set(_token_key(user_id), lambda: uuid.uuid4().hex, None)
+
+
+def invalidate(user_id):
+    """Make the user's stored context stale in every session"""
+    cache.delete(_token_key(user_id))
+
+
+def load_user_context(user):
+    """Resolve the context with a single query"""
+    row = User.objects.filter(pk=user.pk).values(
+        'userprofile__role', 'doctor__id', 'patient__id'
+    ).first() or {}
+    return UserContext(
+        user_id=user.pk,
+        role=row.get('userprofile__role'),
+        doctor_id=row.get('doctor__id'),
+        patient_id=row.get('patient__id'),
+        token=current_token(user.pk),
+    )
+
+
+def get_user_context(user):
+    """
+    The context for ``user``, resolved at most once per user object.
+
+    Requests get it pre-filled from the session by the middleware; outside
+    a request (shell, tests, management commands) it costs one query.
+    """
+    if not user.is_authenticated:
+        return ANONYMOUS
+    context = getattr(user, USER_ATTR, None)
+    if context is None:
+        context = load_user_context(user)
+        setattr(user, USER_ATTR, context)
+    return context
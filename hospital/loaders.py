@@ -0,0 +1,99 @@
+"""
+DataLoader-style batching of related-object lookups.
+
+Code that resolves a tree of objects asks for each related object on its
+own (``await loaders.doctor.load(appointment.doctor_id)``), as if it
+were a single lookup. A ``DataLoader`` holds those requests until the
+event loop has run every coroutine that was ready, then fetches all the
+keys asked for in one query and answers each request from it. Resolving
+100 appointments' doctors is therefore one query, not 100; the doctors'
+users are one more, however many rows there are.
+
+Results are cached for the life of the loader, which is one request
+(``Loaders``), so an object reached twice (the same doctor on ten rows,
+or through two widgets) is loaded once. Rows the request already has can
+be added with ``prime``.
+"""
+import asyncio
+
+from django.contrib.auth.models import User
+
+from .async_utils import gather_queries
+from .models import Appointment, Billing, Doctor, Patient
+
+
+class DataLoader:
+    """
+    Batches ``load(key)`` calls made in one turn of the event loop into
+    one call of ``batch_load(keys)``, which returns ``{key: value}``;
+    keys it leaves out load as None.
+    """
+
+    def __init__(self, batch_load):
+        self.batch_load = batch_load
+        self.cache = {}
+        self.pending = []
+        self.batches = 0
+
+    def load(self, key):
+        """A future for the value of ``key``"""
+        if key is None:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(None)
+            return future
+        future = self.cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.cache[key] = loop.create_future()
+            if not self.pending:
+                # Runs after the coroutines already scheduled, which may add keys of their own
+                loop.call_soon(self.dispatch)
+            self.pending.append(key)
+        return future
+
+    async def load_many(self, keys):
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def prime(self, key, value):
+        """Cache a value the caller already has"""
+        if key not in self.cache:
+            self.cache[key] = future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+
+    def dispatch(self):
+        keys, self.pending = self.pending, []
+        self.batches += 1
+        asyncio.ensure_future(self.fetch(keys))
+
+    async def fetch(self, keys):
+        try:
+            found = (await gather_queries(batch=lambda: self.batch_load(keys)))['batch']
+        except Exception as exc:
+            for key in keys:
+                self.cache.pop(key).set_exception(exc)
+            return
+        for key in keys:
+            self.cache[key].set_result(found.get(key))
+
+
+def by_pk(queryset):
+    return lambda keys: queryset.in_bulk(keys)
+
+
+def by_field(queryset, field):
+    return lambda keys: {getattr(row, field): row for row in queryset.filter(**{f'{field}__in': keys})}
+
+
+class Loaders:
+    """One request's loaders, one per kind of lookup"""
+
+    def __init__(self):
+        self.appointment = DataLoader(by_pk(Appointment.objects.all()))
+        self.bill = DataLoader(by_pk(Billing.objects.all()))
+        self.bill_for_appointment = DataLoader(by_field(Billing.objects.all(), 'appointment_id'))
+        self.doctor = DataLoader(by_pk(Doctor.objects.all()))
+        self.patient = DataLoader(by_pk(Patient.objects.all()))
+        self.user = DataLoader(by_pk(User.objects.only('id', 'first_name', 'last_name')))
+
+    def batches(self):
+        return sum(loader.batches for loader in vars(self).values())
@@ -0,0 +1,155 @@
+"""
+Shared helpers for the bench_* management commands.
+
+Benchmarks never touch the project database: they build a throwaway test
+database, seed it with synthetic records and tear it down afterwards.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import date, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from hospital.models import Doctor, Patient, Appointment, Billing, UserProfile
+
+BENCH_PASSWORD = 'bench123'
+
+# Half-hour slots between 09:00 and 16:30
+SLOTS = [dt_time(hour, minute) for hour in range(9, 17) for minute in (0, 30)]
+
+
+@contextmanager
+def benchmark_database(test_name=None):
+    """
+    Run the enclosed block against a freshly migrated throwaway database.
+
+    ``test_name`` overrides the test database name, e.g. to put a SQLite
+    benchmark in a file so that connections from other threads do not
+    share an in-memory database.
+    """
+    old_name = connection.settings_dict['NAME']
+    old_test_name = connection.settings_dict['TEST'].get('NAME')
+    if test_name:
+        connection.settings_dict['TEST']['NAME'] = test_name
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        connection.settings_dict['TEST']['NAME'] = old_test_name
+        teardown_test_environment()
+
+
+def seed(doctors=20, patients=200, appointments=2000, days=30, start=None, seed_value=42):
+    """
+    Bulk-create synthetic doctors, patients, appointments and bills.
+
+    Appointments are spread over ``days`` days starting at ``start`` (default:
+    ``days // 2`` days ago) without violating the doctor/date/time uniqueness
+    constraint. Returns the admin user plus one doctor and one patient user.
+    """
+    rng = random.Random(seed_value)
+    start = start or date.today() - timedelta(days=days // 2)
+    password = make_password(BENCH_PASSWORD)
+
+    users = [User(username='bench_admin', first_name='Bench', last_name='Admin', password=password)]
+    users += [
+        User(username=f'bench_dr{i}', first_name=f'Doc{i}', last_name='Bench',
+             email=f'dr{i}@bench.local', password=password)
+        for i in range(doctors)
+    ]
+    users += [
+        User(username=f'bench_pt{i}', first_name=f'Pat{i}', last_name='Bench',
+             email=f'pt{i}@bench.local', password=password)
+        for i in range(patients)
+    ]
+    User.objects.bulk_create(users, batch_size=500)
+    users = list(User.objects.filter(username__startswith='bench_').order_by('id'))
+    admin, doctor_users, patient_users = users[0], users[1:doctors + 1], users[doctors + 1:]
+
+    UserProfile.objects.bulk_create(
+        [UserProfile(user=admin, role='admin')]
+        + [UserProfile(user=u, role='doctor') for u in doctor_users]
+        + [UserProfile(user=u, role='patient', phone='+1-555-0100') for u in patient_users],
+        batch_size=500,
+    )
+    specializations = [choice for choice, _ in Doctor.SPECIALIZATION_CHOICES]
+    Doctor.objects.bulk_create(
+        [
+            Doctor(user=u, specialization=specializations[i % len(specializations)],
+                   experience_years=i % 30, consultation_fee=Decimal('150.00'))
+            for i, u in enumerate(doctor_users)
+        ],
+        batch_size=500,
+    )
+    Patient.objects.bulk_create(
+        [
+            Patient(user=u, patient_id=f'PAT{100000 + i}', blood_group='O+',
+                    medical_history='Seasonal allergies. ' * 20, allergies='Penicillin')
+            for i, u in enumerate(patient_users)
+        ],
+        batch_size=500,
+    )
+    doctor_ids = list(Doctor.objects.order_by('id').values_list('id', flat=True))
+    patient_ids = list(Patient.objects.order_by('id').values_list('id', flat=True))
+
+    slots = [
+        (doctor_id, start + timedelta(days=day), slot)
+        for day in range(days)
+        for doctor_id in doctor_ids
+        for slot in SLOTS
+    ]
+    rng.shuffle(slots)
+    statuses = ['scheduled', 'scheduled', 'completed', 'cancelled']
+    Appointment.objects.bulk_create(
+        [
+            Appointment(doctor_id=doctor_id, patient_id=rng.choice(patient_ids),
+                        appointment_date=day, appointment_time=slot,
+                        reason='Benchmark consultation', status=rng.choice(statuses))
+            for doctor_id, day, slot in slots[:appointments]
+        ],
+        batch_size=1000,
+    )
+    Billing.objects.bulk_create(
+        [
+            Billing(appointment_id=appointment_id, total_amount=Decimal('150.00'),
+                    payment_status=rng.choice(['pending', 'paid']), notes='Consultation')
+            for appointment_id in Appointment.objects.filter(status='completed').values_list('id', flat=True)
+        ],
+        batch_size=1000,
+    )
+    return {
+        'admin': admin,
+        'doctor': doctor_users[0] if doctor_users else None,
+        'patient': patient_users[0] if patient_users else None,
+    }
+
+
+def count_query(counter, execute, sql, params, many, context):
+    """``connection.execute_wrapper`` hook counting queries into ``counter[0]``"""
+    counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def measure(func, repeat=20, warmup=2):
+    """Time ``func`` and return min/median/p95 in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'min': samples[0],
+        'median': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from hospital.archive import archivable, archive, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = 'Move finished appointments and their settled bills into the archive tables'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, help='Archive visits older than this (default: ARCHIVE_AFTER_MONTHS)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Appointments moved per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['months'])
+        if options['dry_run']:
+            self.stdout.write(f'{archivable(cutoff).count()} appointment(s) before {cutoff} would be archived.')
+            return
+        stats = archive(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {stats['appointments']} appointment(s) and {stats['bills']} bill(s) "
+            f"before {cutoff} in {stats['batches']} batch(es)."
+        ))
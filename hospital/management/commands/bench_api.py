@@ -0,0 +1,96 @@
+import json
+import tracemalloc
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import Client
+
+from hospital import rest
+from hospital.models import Appointment, Doctor, Patient
+
+from ._bench import BENCH_PASSWORD, benchmark_database, measure, seed
+
+
+def instance_page(limit):
+    """A page built the usual way: model instances, then the stdlib encoder"""
+    appointments = Appointment.objects.select_related('doctor__user', 'patient__user__userprofile')[:limit]
+    return json.dumps([{
+        **{name: getattr(appointment, name) for name in rest.APPOINTMENT.fields},
+        'doctor': {'id': appointment.doctor.pk, 'name': appointment.doctor.user.get_full_name(),
+                   'specialization': appointment.doctor.specialization},
+        'patient': {'id': appointment.patient.pk, 'name': appointment.patient.user.get_full_name(),
+                    'patient_id': appointment.patient.patient_id},
+    } for appointment in appointments], cls=DjangoJSONEncoder)
+
+
+def api_page(limit):
+    columns, selection = rest.select(
+        rest.APPOINTMENT, include='doctor,patient',
+        fields=','.join([*rest.APPOINTMENT.fields, 'doctor.name', 'doctor.specialization',
+                         'patient.name', 'patient.patient_id']),
+    )
+    rows = Appointment.objects.order_by(*rest.APPOINTMENT.ordering).values_list(*columns)[:limit]
+    return rest.json_response([selection.build(row) for row in rows]).content
+
+
+def peak_kib(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+class Command(BaseCommand):
+    help = 'Measure the JSON API: page encoding against model instances, and batch booking against one call each'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per measurement')
+        parser.add_argument('--rows', type=int, default=500, help='Appointments per page')
+        parser.add_argument('--batch', type=int, default=50, help='Appointments booked per batch')
+
+    def handle(self, *args, **options):
+        rows, batch = options['rows'], options['batch']
+        with benchmark_database():
+            users = seed(appointments=max(rows, 2000))
+            self.stdout.write(f'{"page of %d" % rows:<28}{"median ms":>11}{"p95 ms":>9}{"peak KiB":>10}')
+            for label, build in (('instances + json', instance_page), ('values_list + orjson', api_page)):
+                timing = measure(lambda: build(rows), repeat=options['repeat'])
+                peak = peak_kib(lambda: build(rows))
+                self.stdout.write(f'{label:<28}{timing["median"]:>11.2f}{timing["p95"]:>9.2f}{peak:>10.0f}')
+
+            client = Client()
+            client.login(username=users['admin'].username, password=BENCH_PASSWORD)
+            doctor = Doctor.objects.filter(is_available=True).first()
+            patients = list(Patient.objects.values_list('pk', flat=True)[:batch])
+            url = '/api/v1/appointments/'
+            # Each run books on days of its own, far past the seeded ones
+            day = [date.today() + timedelta(days=400)]
+
+            def bookings():
+                day[0] += timedelta(days=batch // 16 + 1)
+                return [{
+                    'patient': patients[index % len(patients)], 'doctor': doctor.pk, 'reason': 'Bench',
+                    'appointment_date': str(day[0] + timedelta(days=index // 16)),
+                    'appointment_time': f'{9 + index % 16 // 2:02d}:{index % 2 * 30:02d}',
+                    'appointment_type': 'consultation',
+                } for index in range(batch)]
+
+            def one_batch():
+                response = client.post(url, json.dumps(bookings()), content_type='application/json')
+                assert response.status_code == 201, response.content
+
+            def one_by_one():
+                for booking in bookings():
+                    response = client.post(url, json.dumps(booking), content_type='application/json')
+                    assert response.status_code == 201, response.content
+
+            self.stdout.write(f'\n{"booking %d" % batch:<28}{"median ms":>11}{"p95 ms":>9}')
+            for label, book in (('one request each', one_by_one), ('one batch', one_batch)):
+                timing = measure(book, repeat=max(options['repeat'] // 4, 3), warmup=1)
+                self.stdout.write(f'{label:<28}{timing["median"]:>11.2f}{timing["p95"]:>9.2f}')
+        self.stdout.write(self.style.SUCCESS(
+            'Medians; bookings go through the test client. Peak is traced allocation while building one page.'
+        ))
@@ -0,0 +1,82 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.test.utils import override_settings
+
+from hospital.archive import appointment_records, archivable, archive, archive_cutoff
+from hospital.models import Appointment, ArchivedAppointment, Billing
+
+from ._bench import benchmark_database, measure, seed
+
+
+class Command(BaseCommand):
+    help = 'Archive two years of history and time the live-table queries before and after'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=200000)
+        parser.add_argument('--days', type=int, default=730)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with benchmark_database(), override_settings(DEBUG=False):
+            days = options['days']
+            users = seed(doctors=100, patients=2000, appointments=options['appointments'], days=days,
+                         start=date.today() - timedelta(days=days - 30))
+            # Past visits took place and were paid for, as they would be by now
+            Appointment.objects.filter(appointment_date__lt=date.today(), status='scheduled').update(status='completed')
+            Billing.objects.update(payment_status='paid')
+            cutoff = archive_cutoff()
+            self.stdout.write(
+                f'{Appointment.objects.count()} appointments, {Billing.objects.count()} bills; '
+                f'{archivable(cutoff).count()} archivable before {cutoff}'
+            )
+            timings = self.queries(users, options['repeat'])
+
+            started = time.perf_counter()
+            stats = archive(cutoff, batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"archived {stats['appointments']} appointments and {stats['bills']} bills in "
+                f"{stats['batches']} batches, {elapsed:.1f}s ({stats['appointments'] / elapsed:,.0f}/s); "
+                f'{Appointment.objects.count()} live, {ArchivedAppointment.objects.count()} archived'
+            )
+            after = self.queries(users, options['repeat'])
+
+            self.stdout.write(f'\n{"median ms":<36}{"before":>9}{"after":>9}')
+            for label, value in timings.items():
+                self.stdout.write(f'{label:<36}{value:>9.1f}{after[label]:>9.1f}')
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def queries(self, users, repeat):
+        today = date.today()
+        patient, admin = users['patient'], users['admin']
+
+        def appointment_page():
+            queryset = Appointment.objects.visible_to(admin).select_related('patient__user', 'doctor__user')
+            queryset.count()
+            list(queryset.order_by('-appointment_date', '-appointment_time')[:20])
+
+        def finished_page():
+            queryset = Appointment.objects.visible_to(admin).filter(~Q(status='scheduled'))
+            queryset.count()
+            list(queryset.order_by('-appointment_date', '-appointment_time')[:20])
+
+        def upcoming():
+            list(Appointment.objects.visible_to(patient).filter(appointment_date__gte=today, status='scheduled')
+                 .order_by('appointment_date', 'appointment_time')[:5])
+
+        def history_page():
+            records = appointment_records(admin)
+            records.count()
+            records[:20]
+
+        checks = {
+            'appointments page (count + 20)': appointment_page,
+            'finished appointments page': finished_page,
+            "patient's upcoming appointments": upcoming,
+            'history page, live + archived': history_page,
+        }
+        return {label: measure(func, repeat=repeat, warmup=1)['median'] for label, func in checks.items()}
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from hospital.models import Appointment
+
+from ._bench import BENCH_PASSWORD, benchmark_database, seed
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def copy_cookies(cookies):
+    copied = SimpleCookie()
+    for name, morsel in cookies.items():
+        copied[name] = morsel.value
+    return copied
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the home page, dashboard and JSON endpoints through the WSGI '
+        'handler (one thread per worker) and the ASGI handler (one task per worker)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent threads (WSGI) or tasks (ASGI)')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+        parser.add_argument('--role', choices=['admin', 'doctor', 'patient'], default='admin')
+        parser.add_argument('--appointments', type=int, default=5000, help='Appointments to seed')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            # A file database, so each thread's connection reads concurrently
+            with benchmark_database(test_name=os.path.join(tmp, 'bench.sqlite3')):
+                users = seed(appointments=options['appointments'])
+                user = users[options['role']]
+                client = Client()
+                client.login(username=user.username, password=BENCH_PASSWORD)
+                appointment = Appointment.objects.visible_to(user).order_by('pk').first()
+                paths = [
+                    reverse('home'),
+                    reverse('dashboard'),
+                    reverse('api_appointment_detail', args=[appointment.pk]),
+                ]
+                connection.close()
+
+                self.stdout.write(
+                    f'{"path":<26}{"handler":<9}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}'
+                )
+                for path in paths:
+                    for handler, run in (('wsgi', self.run_wsgi), ('asgi', self.run_asgi)):
+                        cache.clear()
+                        samples, errors = run(path, client.cookies, options)
+                        samples.sort()
+                        self.stdout.write(
+                            f'{path:<26}{handler:<9}{len(samples) / options["seconds"]:>9.1f}'
+                            f'{percentile(samples, 0.5):>9.2f}{percentile(samples, 0.99):>9.2f}{errors:>8}'
+                        )
+        self.stdout.write(self.style.SUCCESS(
+            '%d %s workers per handler, %.0fs per run.' % (options['workers'], options['role'], options['seconds'])
+        ))
+
+    def run_wsgi(self, path, cookies, options):
+        deadline = time.perf_counter() + options['seconds']
+        lock = threading.Lock()
+        samples, errors = [], [0]
+
+        def worker(_):
+            client = Client()
+            client.cookies = copy_cookies(cookies)
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = client.get(path)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    if response.status_code == 200:
+                        samples.append(elapsed)
+                    else:
+                        errors[0] += 1
+            connection.close()
+
+        with ThreadPoolExecutor(options['workers']) as pool:
+            list(pool.map(worker, range(options['workers'])))
+        return samples, errors[0]
+
+    def run_asgi(self, path, cookies, options):
+        samples, errors = [], [0]
+
+        async def worker(deadline):
+            client = AsyncClient()
+            client.cookies = copy_cookies(cookies)
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get(path)
+                elapsed = (time.perf_counter() - started) * 1000
+                if response.status_code == 200:
+                    samples.append(elapsed)
+                else:
+                    errors[0] += 1
+
+        async def main():
+            deadline = time.perf_counter() + options['seconds']
+            await asyncio.gather(*(worker(deadline) for _ in range(options['workers'])))
+
+        asyncio.run(main())
+        return samples, errors[0]
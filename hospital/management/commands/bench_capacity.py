@@ -0,0 +1,62 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from hospital.capacity import appointment_counts, capacity_grid
+from hospital.models import Appointment
+
+from ._bench import BENCH_PASSWORD, benchmark_database, measure, seed
+
+
+class Command(BaseCommand):
+    help = 'Time the capacity planner over a doctors x days grid: aggregate, grid, HTML page and CSV export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=500)
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--appointments', type=int, default=200000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        days, repeat = options['days'], options['repeat']
+        with benchmark_database(), override_settings(DEBUG=False):
+            start = date.today() - timedelta(days=days // 2)
+            users = seed(doctors=options['doctors'], patients=1000, appointments=options['appointments'],
+                         days=days, start=start)
+            end = start + timedelta(days=days - 1)
+            client = Client()
+            client.login(username=users['admin'].username, password=BENCH_PASSWORD)
+            query = f'?start={start}&days={days}'
+            url = reverse('capacity')
+
+            def page():
+                assert client.get(url + query).status_code == 200
+
+            def export():
+                b''.join(client.get(url + query + '&format=csv').streaming_content)
+
+            self.stdout.write(
+                f'{options["doctors"]} doctors x {days} days = {options["doctors"] * days} cells, '
+                f'{Appointment.objects.count()} appointments'
+            )
+            self.stdout.write(f'{"":<34}{"min ms":>9}{"median":>9}{"p95":>9}')
+            timings = [
+                ('grouped aggregate', lambda: appointment_counts(start, end)),
+                ('grid (aggregate + doctors)', lambda: capacity_grid(start, days)),
+                ('HTML page', page),
+                ('CSV export', export),
+            ]
+            for label, func in timings:
+                self.report(label, measure(func, repeat=repeat, warmup=1))
+            with connection.cursor() as cursor:
+                cursor.execute('DROP INDEX hospital_appt_day_doctor_idx')
+            self.report('aggregate without covering index',
+                        measure(lambda: appointment_counts(start, end), repeat=repeat, warmup=1))
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def report(self, label, stats):
+        self.stdout.write(f'{label:<34}{stats["min"]:>9.1f}{stats["median"]:>9.1f}{stats["p95"]:>9.1f}')
@@ -0,0 +1,160 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, transaction
+
+from hospital.models import Appointment, Doctor, Patient
+
+from ._bench import SLOTS, seed
+
+# Environment overrides for each profile; see hospital_management/db.py
+SQLITE_PROFILES = {
+    'sqlite-default': {
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_MMAP_SIZE': '0',
+        'SQLITE_TRANSACTION_MODE': 'DEFERRED',
+        'DB_CONN_MAX_AGE': '0',
+    },
+    'sqlite-tuned': {},
+}
+
+POSTGRES_PROFILES = {
+    'postgres-reconnect': {'DB_CONN_MAX_AGE': '0'},
+    'postgres-persistent': {'DB_CONN_MAX_AGE': '60', 'DB_CONN_HEALTH_CHECKS': '1'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare booking and list throughput across database profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+        parser.add_argument('--readers', type=int, default=4, help='Threads running list queries')
+        parser.add_argument('--writers', type=int, default=2, help='Threads booking appointments')
+        parser.add_argument('--postgres-url', help='Also benchmark this (empty, disposable) Postgres database')
+        parser.add_argument('--profile', help='Run a single profile against the configured database (internal)')
+
+    def handle(self, *args, **options):
+        if options['profile']:
+            result = self.run_profile(options)
+            self.stdout.write(json.dumps(result))
+            return
+
+        profiles = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, env in SQLITE_PROFILES.items():
+                profiles[name] = dict(env, DATABASE_URL=f'sqlite:///{tmp}/{name}.sqlite3')
+            if options['postgres_url']:
+                for name, env in POSTGRES_PROFILES.items():
+                    profiles[name] = dict(env, DATABASE_URL=options['postgres_url'])
+
+            self.stdout.write(f'{"profile":<22}{"bookings/s":>12}{"lists/s":>10}{"p95 list ms":>13}{"errors":>8}')
+            for name, env in profiles.items():
+                result = self.spawn(name, env, options)
+                self.stdout.write(
+                    f'{name:<22}{result["bookings_per_sec"]:>12.1f}{result["lists_per_sec"]:>10.1f}'
+                    f'{result["list_p95_ms"]:>13.2f}{result["errors"]:>8}'
+                )
+
+    def spawn(self, name, env, options):
+        """Run one profile in a fresh process so settings pick up its environment"""
+        command = [
+            sys.executable, sys.argv[0], 'bench_database', '--profile', name,
+            '--seconds', str(options['seconds']),
+            '--readers', str(options['readers']), '--writers', str(options['writers']),
+        ]
+        completed = subprocess.run(
+            command, env=dict(os.environ, **env), capture_output=True, text=True
+        )
+        if completed.returncode:
+            raise CommandError(f'{name} failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run_profile(self, options):
+        if self.has_schema():
+            call_command('flush', interactive=False, verbosity=0)
+        call_command('migrate', verbosity=0)
+        seed(doctors=20, patients=200, appointments=5000)
+        doctor_ids = list(Doctor.objects.values_list('id', flat=True))
+        patient_ids = list(Patient.objects.values_list('id', flat=True))
+        connection.close()
+
+        deadline = time.perf_counter() + options['seconds']
+        lock = threading.Lock()
+        stats = {'bookings': 0, 'lists': 0, 'errors': 0, 'list_ms': []}
+
+        def book(worker):
+            # Book free future slots, mirroring AppointmentCreateView's conflict check
+            first_day, per_day, n = date.today() + timedelta(days=365 + worker * 1000), len(doctor_ids) * len(SLOTS), 0
+            while time.perf_counter() < deadline:
+                day = first_day + timedelta(days=n // per_day)
+                doctor_id = doctor_ids[n % len(doctor_ids)]
+                slot = SLOTS[(n // len(doctor_ids)) % len(SLOTS)]
+                n += 1
+                try:
+                    with transaction.atomic():
+                        taken = Appointment.objects.filter(
+                            doctor_id=doctor_id, appointment_date=day,
+                            appointment_time=slot, status='scheduled',
+                        ).exists()
+                        if not taken:
+                            Appointment.objects.create(
+                                doctor_id=doctor_id, patient_id=patient_ids[n % len(patient_ids)],
+                                appointment_date=day, appointment_time=slot, reason='Benchmark booking',
+                            )
+                    with lock:
+                        stats['bookings'] += 1
+                except OperationalError:
+                    with lock:
+                        stats['errors'] += 1
+                close_old_connections()
+            connection.close()
+
+        def browse(worker):
+            # One page of AppointmentListView plus its paginator count
+            page = 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    queryset = Appointment.objects.filter(
+                        doctor_id=doctor_ids[(worker + page) % len(doctor_ids)]
+                    ).select_related('patient__user', 'doctor__user')
+                    queryset.count()
+                    list(queryset[:20])
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with lock:
+                        stats['lists'] += 1
+                        stats['list_ms'].append(elapsed)
+                except OperationalError:
+                    with lock:
+                        stats['errors'] += 1
+                page += 1
+                close_old_connections()
+            connection.close()
+
+        threads = [threading.Thread(target=book, args=(i,)) for i in range(options['writers'])]
+        threads += [threading.Thread(target=browse, args=(i,)) for i in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        list_ms = sorted(stats['list_ms']) or [0.0]
+        return {
+            'bookings_per_sec': stats['bookings'] / options['seconds'],
+            'lists_per_sec': stats['lists'] / options['seconds'],
+            'list_p95_ms': list_ms[int(len(list_ms) * 0.95) - 1 if len(list_ms) > 1 else 0],
+            'errors': stats['errors'],
+        }
+
+    def has_schema(self):
+        return 'hospital_appointment' in connection.introspection.table_names()
@@ -0,0 +1,74 @@
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from hospital.conflicts import find_overlaps, overlapping
+from hospital.models import Appointment, Doctor
+
+from ._bench import SLOTS, benchmark_database, measure, seed
+
+
+class Command(BaseCommand):
+    help = 'Time the overlap check for one booking and the full-table overlap audit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=200)
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--appointments', type=int, default=200000)
+        parser.add_argument('--clashes', type=int, default=1000, help='Overlapping bookings to plant')
+
+    def handle(self, *args, **options):
+        rng = random.Random(3)
+        with benchmark_database(), override_settings(DEBUG=False):
+            start = date.today() - timedelta(days=options['days'] // 2)
+            seed(doctors=options['doctors'], patients=1000, appointments=options['appointments'],
+                 days=options['days'], start=start)
+            self.plant_clashes(rng, options['clashes'])
+            self.stdout.write(f'{Appointment.objects.count()} appointments, {options["clashes"]} planted clashes')
+
+            doctor_id, day = Doctor.objects.values_list('pk', flat=True).first(), start + timedelta(days=1)
+            self.stdout.write(f'{"":<34}{"min ms":>9}{"median":>9}{"p95":>9}')
+            self.report('overlap check, one booking',
+                        measure(lambda: overlapping(day, SLOTS[3], 'emergency', doctor_id=doctor_id), repeat=200))
+
+            started = time.perf_counter()
+            found = sum(1 for _ in find_overlaps())
+            elapsed = time.perf_counter() - started
+            # Measured on a second pass: tracing slows the first down several times
+            tracemalloc.start()
+            sum(1 for _ in find_overlaps())
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.stdout.write(
+                f'audit: {found} overlaps in {elapsed:.2f}s '
+                f'({Appointment.objects.count() / elapsed:,.0f} rows/s), peak {peak / 2 ** 20:.1f} MB'
+            )
+            with connection.cursor() as cursor:
+                cursor.execute('DROP INDEX hospital_appt_doctor_slot_idx')
+            self.report('overlap check without the index',
+                        measure(lambda: overlapping(day, SLOTS[3], 'emergency', doctor_id=doctor_id), repeat=50))
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def plant_clashes(self, rng, count):
+        """Follow-ups 15 minutes into existing consultations, as an unchecked import would leave them"""
+        existing = list(
+            Appointment.objects.exclude(status='cancelled').values_list('doctor_id', 'patient_id', 'appointment_date',
+                                                                        'appointment_time')[:count * 3]
+        )
+        Appointment.objects.bulk_create(
+            [
+                Appointment(doctor_id=doctor_id, patient_id=patient_id, appointment_date=day,
+                            appointment_time=at.replace(minute=at.minute + 15), appointment_type='follow_up',
+                            reason='Imported follow-up')
+                for doctor_id, patient_id, day, at in rng.sample(existing, min(count, len(existing)))
+            ],
+            batch_size=1000,
+        )
+
+    def report(self, label, stats):
+        self.stdout.write(f'{label:<34}{stats["min"]:>9.1f}{stats["median"]:>9.1f}{stats["p95"]:>9.1f}')
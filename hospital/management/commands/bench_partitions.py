@@ -0,0 +1,100 @@
+import re
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from hospital.capacity import appointment_counts
+from hospital.models import Appointment
+from hospital.partitions import month_start, next_month, partition, partitions
+
+from ._bench import benchmark_database, measure, seed
+
+PARTITION_PATTERN = re.compile(r'hospital_appointment_(p\d{4}_\d{2}|default)\b')
+
+
+class Command(BaseCommand):
+    help = 'Time date-range appointment queries on PostgreSQL before and after monthly partitioning'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=1000000)
+        parser.add_argument('--days', type=int, default=1095)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL: run with DATABASE_URL=postgres://... '
+                               '(a test database is created on that server and dropped afterwards).')
+        with benchmark_database(), override_settings(DEBUG=False):
+            days = options['days']
+            users = seed(doctors=200, patients=5000, appointments=options['appointments'], days=days,
+                         start=date.today() - timedelta(days=days - 90))
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            checks = self.checks(users)
+            before = {label: measure(func, repeat=options['repeat'], warmup=2)['median'] for label, func in checks.items()}
+            plan_before = self.scanned(checks)
+
+            started = time.perf_counter()
+            created = partition()
+            self.stdout.write(
+                f'{Appointment.objects.count()} appointments partitioned into {len(created)} months '
+                f'({len(partitions())} partitions with the default) in {time.perf_counter() - started:.1f}s'
+            )
+            after = {label: measure(func, repeat=options['repeat'], warmup=2)['median'] for label, func in checks.items()}
+            plan_after = self.scanned(checks)
+
+            self.stdout.write(f'\n{"median ms":<36}{"before":>9}{"after":>9}{"partitions scanned":>20}')
+            for label in checks:
+                self.stdout.write(
+                    f'{label:<36}{before[label]:>9.1f}{after[label]:>9.1f}'
+                    f'{plan_before[label]:>10} -> {plan_after[label]}'
+                )
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def checks(self, users):
+        today = date.today()
+        month = month_start(today)
+        admin, patient = users['admin'], users['patient']
+        doctor_id = users['doctor'].doctor.pk
+
+        def month_page():
+            queryset = Appointment.objects.visible_to(admin).filter(
+                appointment_date__gte=month, appointment_date__lt=next_month(month),
+            )
+            queryset.count()
+            list(queryset.order_by('-appointment_date', '-appointment_time')[:20])
+
+        checks = {
+            "this month's list page": month_page,
+            "doctor's week": lambda: list(Appointment.objects.filter(
+                doctor_id=doctor_id, appointment_date__range=(today, today + timedelta(days=6)),
+            )),
+            "patient's upcoming appointments": lambda: list(
+                Appointment.objects.visible_to(patient).filter(appointment_date__gte=today)
+                .order_by('appointment_date', 'appointment_time')[:5]
+            ),
+            'capacity counts, 30 days': lambda: appointment_counts(today, today + timedelta(days=29)),
+        }
+        return checks
+
+    def scanned(self, checks):
+        """Partitions in each check's last query plan (1 before partitioning)"""
+        counts = {}
+        for label, func in checks.items():
+            with connection.execute_wrapper(self.explain(counts, label)):
+                func()
+        return counts
+
+    def explain(self, counts, label):
+        def wrapper(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if sql.startswith('SELECT') and 'hospital_appointment' in sql:
+                with context['connection'].cursor() as cursor:
+                    cursor.execute('EXPLAIN ' + sql, params)
+                    plan = '\n'.join(line for line, in cursor.fetchall())
+                counts[label] = max(len(set(PARTITION_PATTERN.findall(plan))), 1)
+            return result
+        return wrapper
@@ -0,0 +1,60 @@
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from hospital.models import Appointment, AppointmentReminder
+from hospital.reminders import FileBackend, dispatch_reminders
+
+from ._bench import SLOTS, benchmark_database, count_query, seed
+
+
+class Command(BaseCommand):
+    help = 'Time a reminder run over a day of appointments, then a rerun that should send nothing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reminders', type=int, default=100000, help='Scheduled appointments in the window')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # DEBUG keeps the SQL of every query, which would swamp the memory figure
+        with tempfile.TemporaryDirectory() as tmp, benchmark_database(), override_settings(DEBUG=False):
+            count = options['reminders']
+            seed(doctors=math.ceil(count / len(SLOTS)), patients=1000, appointments=count, days=1, start=date.today())
+            Appointment.objects.update(status='scheduled')
+            midnight = datetime.combine(date.today(), datetime.min.time())
+            output = os.path.join(tmp, 'reminders.log')
+
+            self.stdout.write(f'{"run":<8}{"sent":>9}{"seconds":>10}{"per sec":>10}{"queries":>9}')
+            for run in ('first', 'rerun'):
+                queries = [0]
+                started = time.perf_counter()
+                with connection.execute_wrapper(partial(count_query, queries)):
+                    stats = self.dispatch(output, midnight, options)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{run:<8}{stats["sent"]:>9}{elapsed:>10.2f}{stats["sent"] / elapsed:>10.0f}{queries[0]:>9}'
+                )
+
+            # Traced separately: tracemalloc slows the run down several times
+            AppointmentReminder.objects.all().delete()
+            tracemalloc.start()
+            self.dispatch(output, midnight, options)
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            self.stdout.write(f'Peak Python memory during a full run: {peak:.1f} MB')
+        self.stdout.write(self.style.SUCCESS('File backend, no rate limit.'))
+
+    def dispatch(self, output, now, options):
+        return dispatch_reminders(
+            backend=FileBackend(output), now=now, rate=0,
+            workers=options['workers'], batch_size=options['batch_size'],
+        )
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from hospital_management.db import SESSION_ENGINES
+
+from ._bench import BENCH_PASSWORD, benchmark_database, measure, seed
+
+CONTEXT_MIDDLEWARE = 'hospital.middleware.UserContextMiddleware'
+PAGES = ['dashboard', 'appointments', 'billing', 'doctors']
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request queries and latency across session backends, with and without the user context middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30, help='Timed requests per page')
+        parser.add_argument('--appointments', type=int, default=2000, help='Appointments to seed')
+
+    def handle(self, *args, **options):
+        without_context = [m for m in settings.MIDDLEWARE if m != CONTEXT_MIDDLEWARE]
+        with benchmark_database():
+            users = seed(appointments=options['appointments'])
+            self.stdout.write(
+                f'{"sessions":<16}{"context":<9}{"role":<9}{"queries/req":>13}{"median ms":>11}'
+            )
+            for backend, engine in SESSION_ENGINES.items():
+                for label, middleware in (('per-req', without_context), ('session', settings.MIDDLEWARE)):
+                    with override_settings(SESSION_ENGINE=engine, MIDDLEWARE=middleware):
+                        for role in ('admin', 'doctor', 'patient'):
+                            queries, median = self.run(users[role], options['repeat'])
+                            self.stdout.write(
+                                f'{backend:<16}{label:<9}{role:<9}{queries:>13.1f}{median:>11.2f}'
+                            )
+        self.stdout.write(self.style.SUCCESS(
+            'Queries are averaged over %s after one warm-up request per page.' % ', '.join(PAGES)
+        ))
+
+    def run(self, user, repeat):
+        cache.clear()
+        client = Client()
+        client.login(username=user.username, password=BENCH_PASSWORD)
+        urls = [reverse(name) for name in PAGES]
+        for url in urls:
+            client.get(url)
+
+        with CaptureQueriesContext(connection) as captured:
+            for url in urls:
+                client.get(url)
+        queries = len(captured.captured_queries) / len(urls)
+
+        def browse():
+            for url in urls:
+                client.get(url)
+
+        return queries, measure(browse, repeat=repeat)['median'] / len(urls)
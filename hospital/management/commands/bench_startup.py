@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import measure
+
+# Commands meant for cron and workers; each should start well under the target
+CRON_COMMANDS = {
+    'run_tasks --once': ['run_tasks', '--once'],
+    'send_reminders': ['send_reminders', '--backend', 'console'],
+    'archive_records --dry-run': ['archive_records', '--dry-run'],
+    'partition_appointments': ['partition_appointments'],
+    'check_overlaps': ['check_overlaps'],
+}
+# For comparison: the interpreter and Django alone, and a command that loads every view, form and admin
+BASELINES = {
+    'python -c "import django"': ['-c', 'import django'],
+    'check': ['manage.py', 'check'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Time cold starts of the cron commands, each in a fresh interpreter, and list their slowest imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--target-ms', type=float, default=500, help='Median cold start a cron command should beat')
+        parser.add_argument('--imports', type=int, default=12, help='Slowest top-level imports of send_reminders to list')
+
+    def handle(self, *args, **options):
+        # The commands run for real, so give them an empty throwaway database
+        with tempfile.TemporaryDirectory() as directory:
+            env = {key: value for key, value in os.environ.items()
+                   if key not in ('DATABASE_REPLICA_URL', 'DATABASE_ARCHIVE_URL')}
+            env.update(
+                DATABASE_URL=f'sqlite:///{Path(directory) / "startup.sqlite3"}',
+                SLOW_QUERY_LOG=str(Path(directory) / 'slow_queries.log'),
+            )
+            self.run(['manage.py', 'migrate', '--verbosity', '0'], env)
+
+            self.stdout.write(f'{"cold start, ms":<36}{"min":>8}{"median":>8}{"p95":>8}')
+            for label, argv in BASELINES.items():
+                self.report(label, argv, env, options['repeat'])
+            over = [
+                label for label, argv in CRON_COMMANDS.items()
+                if self.report(label, ['manage.py', *argv], env, options['repeat']) > options['target_ms']
+            ]
+
+            self.stdout.write('\nSlowest top-level imports of send_reminders (cumulative ms):')
+            for module, cumulative in self.imports(['manage.py', *CRON_COMMANDS['send_reminders']], env)[:options['imports']]:
+                self.stdout.write(f'  {cumulative:>8.1f}  {module}')
+
+        if over:
+            self.stdout.write(self.style.WARNING(f"Over the {options['target_ms']:.0f} ms target: {', '.join(over)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Every cron command starts within {options['target_ms']:.0f} ms."))
+
+    def run(self, argv, env, python_options=()):
+        result = subprocess.run(
+            [sys.executable, *python_options, *argv], cwd=settings.BASE_DIR, env=env,
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f'{" ".join(argv)} failed:\n{result.stderr}')
+        return result.stderr
+
+    def report(self, label, argv, env, repeat):
+        timings = measure(lambda: self.run(argv, env), repeat=repeat, warmup=1)
+        self.stdout.write(f"{label:<36}{timings['min']:>8.0f}{timings['median']:>8.0f}{timings['p95']:>8.0f}")
+        return timings['median']
+
+    def imports(self, argv, env):
+        """(module, cumulative ms) for each import made directly by the program, slowest first"""
+        found = []
+        for line in self.run(argv, env, ['-X', 'importtime']).splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            # Nested imports are indented under the module that made them
+            if not name[1:].startswith(' '):
+                found.append((name.strip(), int(cumulative) / 1000))
+        return sorted(found, key=lambda item: item[1], reverse=True)
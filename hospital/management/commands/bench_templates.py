@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from ._bench import BENCH_PASSWORD, benchmark_database, measure, seed
+
+
+def uncached_templates():
+    """The TEMPLATES setting with the cached loader unwrapped"""
+    templates = [dict(engine, OPTIONS=dict(engine['OPTIONS'])) for engine in settings.TEMPLATES]
+    for engine in templates:
+        loaders = []
+        for loader in engine['OPTIONS'].get('loaders', []):
+            if isinstance(loader, (list, tuple)) and loader[0].endswith('cached.Loader'):
+                loaders.extend(loader[1])
+            else:
+                loaders.append(loader)
+        engine['OPTIONS']['loaders'] = loaders
+    return templates
+
+
+class Command(BaseCommand):
+    help = 'Measure page render times with and without the cached template loader and fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30, help='Timed renders per page')
+        parser.add_argument('--appointments', type=int, default=2000, help='Appointments to seed')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        with benchmark_database():
+            users = seed(appointments=options['appointments'])
+            client = Client()
+            client.login(username=users['admin'].username, password=BENCH_PASSWORD)
+            pages = ['dashboard', 'billing', 'patients', 'doctors', 'about', 'contact']
+
+            self.stdout.write(f'{"page":<12}{"uncached ms":>14}{"cached ms":>12}{"fragments ms":>15}{"KiB":>8}')
+            for name in pages:
+                url = reverse(name)
+
+                def render_cold():
+                    cache.clear()
+                    return client.get(url)
+
+                with override_settings(TEMPLATES=uncached_templates()):
+                    uncached = measure(render_cold, repeat=repeat)
+                cached = measure(render_cold, repeat=repeat)
+                warm = measure(lambda: client.get(url), repeat=repeat)
+                size = len(client.get(url).content) / 1024
+                self.stdout.write(
+                    f'{name:<12}{uncached["median"]:>14.2f}{cached["median"]:>12.2f}'
+                    f'{warm["median"]:>15.2f}{size:>8.1f}'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            'Medians over %d renders. "fragments" keeps {%% cache %%} fragments warm.' % repeat
+        ))
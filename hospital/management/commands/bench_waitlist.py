@@ -0,0 +1,140 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from hospital.models import Appointment, Doctor, Patient, WaitlistEntry
+from hospital.waitlist import accept_offer, next_in_line, release_offer
+
+from ._bench import SLOTS, benchmark_database, count_query, measure, seed
+
+
+class Command(BaseCommand):
+    help = 'Simulate cancellations and waitlist churn on fully booked doctors and time the slot backfill'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--days', type=int, default=14)
+        parser.add_argument('--patients', type=int, default=5000)
+        parser.add_argument('--waitlist', type=int, default=200, help='Waiting patients per doctor-day')
+        parser.add_argument('--events', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with benchmark_database(), override_settings(DEBUG=False):
+            seed(doctors=options['doctors'], patients=options['patients'], appointments=0)
+            doctor_ids = list(Doctor.objects.values_list('pk', flat=True))
+            patient_ids = list(Patient.objects.values_list('pk', flat=True))
+            days = [date.today() + timedelta(days=offset) for offset in range(1, options['days'] + 1)]
+            self.book_everything(rng, doctor_ids, patient_ids, days)
+            self.fill_waitlists(rng, doctor_ids, patient_ids, days, options['waitlist'])
+            self.stdout.write(
+                f'{Appointment.objects.count()} booked slots, '
+                f'{WaitlistEntry.objects.count()} waitlist entries '
+                f'({options["waitlist"]} per doctor-day)'
+            )
+            self.simulate(rng, doctor_ids, patient_ids, days, options['events'])
+
+            doctor_id, day = doctor_ids[0], days[0]
+            self.stdout.write(f'\n{"next in line":<34}{"min ms":>9}{"median":>9}{"p95":>9}')
+            self.report('priority index seek', measure(lambda: next_in_line(doctor_id, day).first(), repeat=200))
+            with connection.cursor() as cursor:
+                cursor.execute('DROP INDEX hospital_waitlist_next_idx')
+            self.report('without the index', measure(lambda: next_in_line(doctor_id, day).first(), repeat=200))
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def book_everything(self, rng, doctor_ids, patient_ids, days):
+        Appointment.objects.bulk_create(
+            [
+                Appointment(doctor_id=doctor_id, patient_id=rng.choice(patient_ids), appointment_date=day,
+                            appointment_time=slot, reason='Benchmark consultation')
+                for doctor_id in doctor_ids for day in days for slot in SLOTS
+            ],
+            batch_size=1000,
+        )
+
+    def fill_waitlists(self, rng, doctor_ids, patient_ids, days, per_day):
+        now = timezone.now()
+        WaitlistEntry.objects.bulk_create(
+            [
+                WaitlistEntry(patient_id=patient_id, doctor_id=doctor_id, appointment_date=day,
+                              reason='Benchmark waitlist', priority=rng.choice([0, 0, 0, 1, 5]),
+                              created_at=now - timedelta(seconds=rng.randrange(86400)))
+                for doctor_id in doctor_ids for day in days
+                for patient_id in rng.sample(patient_ids, min(per_day, len(patient_ids)))
+            ],
+            batch_size=1000,
+        )
+
+    def simulate(self, rng, doctor_ids, patient_ids, days, events):
+        """Cancel bookings, each backfilled through the signal, interleaved with waitlist churn"""
+        booked = list(Appointment.objects.values_list('pk', flat=True))
+        rng.shuffle(booked)
+        cancellations = []
+        churn = dict.fromkeys(['join', 'withdraw', 'accept', 'decline', 'expire'], 0)
+        started = time.perf_counter()
+        for _ in range(events):
+            action = rng.choices(['cancel', 'join', 'withdraw', 'respond'], weights=[4, 2, 1, 3])[0]
+            if action == 'cancel' and booked:
+                appointment = Appointment.objects.get(pk=booked.pop())
+                queries = [0]
+                before = time.perf_counter()
+                with connection.execute_wrapper(partial(count_query, queries)):
+                    appointment.status = 'cancelled'
+                    appointment.save()
+                cancellations.append(((time.perf_counter() - before) * 1000, queries[0]))
+            elif action == 'join':
+                patient_id, doctor_id, day = rng.choice(patient_ids), rng.choice(doctor_ids), rng.choice(days)
+                waiting = WaitlistEntry.objects.filter(patient_id=patient_id, doctor_id=doctor_id, appointment_date=day,
+                                                       status__in=['waiting', 'offered'])
+                if not waiting.exists():
+                    WaitlistEntry.objects.create(patient_id=patient_id, doctor_id=doctor_id, appointment_date=day,
+                                                 reason='Benchmark waitlist')
+                    churn['join'] += 1
+            elif action == 'withdraw':
+                withdrawn = WaitlistEntry.objects.filter(
+                    pk__in=next_in_line(rng.choice(doctor_ids), rng.choice(days)).values('pk')[:1],
+                ).update(status='withdrawn')
+                churn['withdraw'] += withdrawn
+            else:
+                entry = WaitlistEntry.objects.filter(status='offered').order_by('?').first()
+                if entry is None:
+                    continue
+                outcome = rng.choice(['accept', 'accept', 'decline', 'expire'])
+                if outcome == 'accept':
+                    accept_offer(entry.pk, entry.patient_id)
+                elif outcome == 'decline':
+                    release_offer(entry.pk, 'declined', patient_id=entry.patient_id)
+                else:
+                    WaitlistEntry.objects.filter(pk=entry.pk).update(offer_expires_at=timezone.now())
+                    release_offer(entry.pk, 'expired')
+                churn[outcome] += 1
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'\n{events} events in {elapsed:.1f}s: {len(cancellations)} cancellations, '
+            + ', '.join(f'{count} {name}' for name, count in churn.items())
+        )
+        if not cancellations:
+            return
+        latencies = sorted(ms for ms, _ in cancellations)
+        self.stdout.write(
+            f'cancel + backfill: p50 {statistics.median(latencies):.2f} ms, '
+            f'p99 {latencies[int(len(latencies) * 0.99)]:.2f} ms, '
+            f'{statistics.mean(count for _, count in cancellations):.1f} queries'
+        )
+        # Every slot a cancellation vacated is either held for or booked by a waitlisted patient, or empty
+        refilled = Appointment.objects.filter(Q(status='held') | Q(waitlist_offer__status='booked')).count()
+        self.stdout.write(f'vacated slots refilled from the waitlist: {refilled}/{len(cancellations)} '
+                          f'({refilled / len(cancellations):.0%})')
+
+    def report(self, label, stats):
+        self.stdout.write(f'{label:<34}{stats["min"]:>9.1f}{stats["median"]:>9.1f}{stats["p95"]:>9.1f}')
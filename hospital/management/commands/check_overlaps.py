@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from hospital.conflicts import find_overlaps
+from hospital.models import Appointment
+
+
+class Command(BaseCommand):
+    help = 'Report active appointments with the same doctor whose durations overlap'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First date to check (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Last date to check (YYYY-MM-DD)')
+        parser.add_argument('--doctor', type=int, help='Only this doctor (Doctor id)')
+        parser.add_argument('--limit', type=int, default=100, help='Overlaps to list; all are counted')
+
+    def handle(self, *args, **options):
+        appointments = Appointment.objects.all()
+        for option, lookup in (('start', 'appointment_date__gte'), ('end', 'appointment_date__lte')):
+            if options[option]:
+                day = parse_date(options[option])
+                if day is None:
+                    raise CommandError(f'Invalid date: {options[option]}')
+                appointments = appointments.filter(**{lookup: day})
+        if options['doctor']:
+            appointments = appointments.filter(doctor_id=options['doctor'])
+
+        count, doctor_days = 0, set()
+        for overlap in find_overlaps(appointments):
+            count += 1
+            doctor_days.add((overlap.doctor_id, overlap.day))
+            if count <= options['limit']:
+                first, second = overlap.first, overlap.second
+                self.stdout.write(
+                    f'Doctor {overlap.doctor_id} on {overlap.day}: '
+                    f'#{first.pk} {first.start:%H:%M}-{first.end:%H:%M} ({first.appointment_type}) overlaps '
+                    f'#{second.pk} {second.start:%H:%M}-{second.end:%H:%M} ({second.appointment_type})'
+                )
+        if count > options['limit']:
+            self.stdout.write(f'... and {count - options["limit"]} more')
+        style = self.style.WARNING if count else self.style.SUCCESS
+        self.stdout.write(style(f'{count} overlap(s) across {len(doctor_days)} doctor-day(s).'))
@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital.rest import create_token
+
+
+class Command(BaseCommand):
+    help = "Issue a JSON API token for a user and print its key, which is shown only this once"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', default='', help='What the token is for, e.g. "Ward 3 kiosk"')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}.")
+        self.stdout.write(create_token(user, options['name']))
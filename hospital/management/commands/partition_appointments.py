@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, NotSupportedError
+
+from hospital.partitions import ensure_partitions, is_partitioned, partition, partitions
+
+
+class Command(BaseCommand):
+    help = 'Convert the appointments table to monthly partitions (PostgreSQL), or create the months ahead'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Partition the table; it is locked while the rows are copied')
+        parser.add_argument('--ahead', type=int,
+                            help='Months to create ahead (default: APPOINTMENT_PARTITION_MONTHS_AHEAD)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if options['convert']:
+            try:
+                created = partition(options['ahead'], using=using)
+            except NotSupportedError as exc:
+                raise CommandError(str(exc))
+        elif not is_partitioned(using):
+            self.stdout.write('The appointments table is not partitioned; run with --convert first.')
+            return
+        else:
+            created = ensure_partitions(options['ahead'], using=using)
+        for name in created:
+            self.stdout.write(f'Created {name}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(created)} partition(s) created; {len(partitions(using))} in total.'
+        ))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from hospital.feed import prune
+
+
+class Command(BaseCommand):
+    help = 'Delete change feed events older than the retention window'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, help='Events to keep (default: FEED_RETENTION_HOURS)')
+
+    def handle(self, *args, **options):
+        hours = options['hours'] or getattr(settings, 'FEED_RETENTION_HOURS', 24)
+        deleted = prune(timezone.now() - timedelta(hours=hours))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} change feed event(s) older than {hours:g} hour(s).'))
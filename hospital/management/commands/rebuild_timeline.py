@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from hospital.timeline import rebuild
+
+
+class Command(BaseCommand):
+    help = "Write the patients' timeline entries for the appointments, bills and patients already stored"
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, action='append', help='Only this patient id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Entries written per statement')
+
+    def handle(self, *args, **options):
+        written = rebuild(options['patient'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} timeline entr{"y" if written == 1 else "ies"}.'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from hospital.taskqueue import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (emails, bills, thumbnails) until stopped'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread',
+                            help='Run tasks on threads (I/O-bound work) or processes (CPU-bound work)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Tasks run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls when idle')
+        parser.add_argument('--visibility-timeout', type=int, default=300,
+                            help='Seconds without a heartbeat before a running task is requeued')
+        parser.add_argument('--once', action='store_true', help='Exit once no task is due')
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            pool=options['pool'],
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            visibility_timeout=options['visibility_timeout'],
+        )
+        if not options['once']:
+            worker.install_signal_handlers()
+            self.stdout.write(f'Worker {worker.worker_id} running on a {options["pool"]} pool, Ctrl+C to stop')
+        worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {worker.processed} task(s), {worker.failed} failed or retried.'
+        ))
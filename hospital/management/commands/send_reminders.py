@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from hospital.reminders import BACKENDS, dispatch_reminders, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Remind patients of their scheduled appointments in the next 24 hours (safe to rerun)'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=sorted(BACKENDS), help='Defaults to REMINDER_BACKEND')
+        parser.add_argument('--file', help='Output file for the file backend (default: REMINDER_FILE_PATH)')
+        parser.add_argument('--hours', type=int, default=24, help='How far ahead to look')
+        parser.add_argument('--workers', type=int, help='Sender threads (default: REMINDER_WORKERS)')
+        parser.add_argument('--rate', type=float, help='Sends per second, 0 for no limit (default: REMINDER_RATE_LIMIT)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Appointments loaded and rendered at a time')
+
+    def handle(self, *args, **options):
+        kwargs = {'path': options['file']} if options['backend'] == 'file' else {}
+        stats = dispatch_reminders(
+            backend=get_backend(options['backend'], **kwargs),
+            hours=options['hours'],
+            workers=options['workers'],
+            rate=options['rate'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {stats['sent']} reminder(s); {stats['failed']} failed, {stats['skipped']} skipped."
+        ))
@@ -0,0 +1,93 @@
+import json
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SORTS = {
+    'total': lambda found: found['total_ms'],
+    'count': lambda found: found['count'],
+    'max': lambda found: found['worst']['duration_ms'],
+    'mean': lambda found: found['total_ms'] / found['count'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Summarise the slow query log: the statements that cost the most, with where they ran and their plan'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=None, help='Log file to read (default: SLOW_QUERY_LOG)')
+        parser.add_argument('--top', type=int, default=10, help='Fingerprints to show')
+        parser.add_argument('--sort', choices=sorted(SORTS), default='total', help='Rank by total, count, max or mean time')
+        parser.add_argument('--since', type=datetime.fromisoformat,
+                            help='Only entries logged at or after this ISO time (UTC unless it has an offset)')
+        parser.add_argument('--plans', action='store_true', help="Print each fingerprint's slowest plan and parameters")
+
+    def handle(self, *args, **options):
+        path = options['log'] or getattr(settings, 'SLOW_QUERY_LOG', None)
+        try:
+            log = open(path, encoding='utf-8')
+        except (OSError, TypeError) as exc:
+            raise CommandError(f'Cannot read the slow query log {path!r}: {exc}')
+        since = options['since']
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        with log:
+            found, skipped = self.aggregate(log, since)
+        if not found:
+            self.stdout.write('No slow queries logged.')
+            return
+        ranked = sorted(found.values(), key=SORTS[options['sort']], reverse=True)[:options['top']]
+        entries = sum(stats['count'] for stats in found.values())
+        self.stdout.write(
+            f'{entries} slow quer{"y" if entries == 1 else "ies"} over {len(found)} fingerprint(s) in {path}, '
+            f"top {len(ranked)} by {options['sort']}" + (f' ({skipped} unreadable line(s) skipped)' if skipped else '')
+        )
+        for rank, stats in enumerate(ranked, 1):
+            worst = stats['worst']
+            self.stdout.write(
+                f"\n{rank}. {stats['count']}x  total {stats['total_ms']:.1f} ms  "
+                f"mean {stats['total_ms'] / stats['count']:.1f} ms  max {worst['duration_ms']:.1f} ms"
+            )
+            self.stdout.write(f"   {stats['fingerprint']}")
+            for label, counts in (('view', stats['views']), ('caller', stats['callers']), ('template', stats['templates'])):
+                if counts:
+                    self.stdout.write(f'   {label}: ' + ', '.join(f'{name} ({count})' for name, count in counts.most_common(3)))
+            if options['plans']:
+                self.stdout.write(f"   slowest at {worst.get('time')} on {worst.get('alias')}, params {worst.get('params')}")
+                for line in worst.get('plan') or ['(no plan)']:
+                    self.stdout.write(f'     {line}')
+
+    def aggregate(self, log, since):
+        """{fingerprint: stats} over the log's entries, and the number of lines that were not entries"""
+        found = {}
+        skipped = 0
+        for line in log:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                duration = float(entry['duration_ms'])
+                key = entry['fingerprint']
+                logged = datetime.fromisoformat(entry['time'])
+            except (ValueError, KeyError, TypeError):
+                skipped += 1
+                continue
+            if since is not None and logged < since:
+                continue
+            stats = found.get(key)
+            if stats is None:
+                stats = found[key] = {
+                    'fingerprint': key, 'count': 0, 'total_ms': 0.0, 'worst': entry,
+                    'views': Counter(), 'callers': Counter(), 'templates': Counter(),
+                }
+            stats['count'] += 1
+            stats['total_ms'] += duration
+            if duration > stats['worst']['duration_ms']:
+                stats['worst'] = entry
+            for field, counts in (('view', 'views'), ('caller', 'callers'), ('template', 'templates')):
+                if entry.get(field):
+                    stats[counts][entry[field]] += 1
+        return found, skipped
@@ -0,0 +1,391 @@
+"""
+Counters and histograms for the ``/metrics`` endpoint, in the Prometheus
+text exposition format.
+
+Every process keeps its samples in its own memory-mapped file under
+``METRICS_DIR``: recording one is a dictionary lookup and an 8-byte
+write, with no locks shared with other processes and no database access.
+``/metrics`` sums the files of every process, live or exited, so a
+scrape served by any gunicorn worker sees the whole server. When a
+process opens its file it folds the files of processes that have exited
+into one aggregate file, so recycled workers do not pile up files.
+Counters only grow while the directory lives; clear it when the server
+starts (see ``clear()``).
+
+Histograms store one count per bucket, which ``/metrics`` accumulates
+into the cumulative ``le`` buckets Prometheus expects. The pending-bill
+gauges are the one thing read from the database: one aggregate per
+``METRICS_GAUGE_CACHE_SECONDS``, on scrapes only.
+"""
+import fcntl
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count, Sum
+
+from .models import Billing
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+GAUGE_CACHE_KEY = 'hospital:metrics:pending-bills'
+
+HEADER = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+INITIAL_SIZE = 16 * 1024
+AGGREGATE_NAME = 'exited.metrics'
+
+
+def metrics_dir():
+    return Path(getattr(settings, 'METRICS_DIR', None) or Path(tempfile.gettempdir()) / 'hospital-metrics')
+
+
+def padded(size):
+    return (size + 7) // 8 * 8
+
+
+def read_entries(data, used):
+    """(key, value, value offset) for each sample in a metrics file's bytes"""
+    position = HEADER.size
+    while position < used:
+        length, = LENGTH.unpack_from(data, position)
+        key = bytes(data[position + LENGTH.size:position + LENGTH.size + length]).decode()
+        position += padded(LENGTH.size + length)
+        yield key, VALUE.unpack_from(data, position)[0], position
+        position += VALUE.size
+
+
+class SampleFile:
+    """
+    One process's samples: float64 values keyed by string in an mmap.
+
+    Only the owning process writes (the aggregate file, only the process
+    holding the directory's lock). An entry is complete before the
+    header's used length grows to include it, so readers in other
+    processes never see half of one.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, 'a+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < INITIAL_SIZE:
+            self.file.truncate(INITIAL_SIZE)
+            size = INITIAL_SIZE
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.used = HEADER.unpack_from(self.map, 0)[0] or HEADER.size
+        self.offsets = {key: offset for key, _, offset in read_entries(self.map, self.used)}
+
+    def add(self, key, amount):
+        with self.lock:
+            offset = self.offsets.get(key)
+            if offset is None:
+                offset = self.append(key)
+            VALUE.pack_into(self.map, offset, VALUE.unpack_from(self.map, offset)[0] + amount)
+
+    def append(self, key):
+        encoded = key.encode()
+        offset = self.used + padded(LENGTH.size + len(encoded))
+        end = offset + VALUE.size
+        if end > len(self.map):
+            size = len(self.map)
+            while size < end:
+                size *= 2
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+        LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[self.used + LENGTH.size:self.used + LENGTH.size + len(encoded)] = encoded
+        VALUE.pack_into(self.map, offset, 0.0)
+        self.used = end
+        HEADER.pack_into(self.map, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+_file = None
+_file_id = None
+_file_lock = threading.Lock()
+
+
+def sample_file():
+    """This process's sample file, reopened after a fork or when ``METRICS_DIR`` changes"""
+    global _file, _file_id
+    file_id = (os.getpid(), getattr(settings, 'METRICS_DIR', None))
+    if _file_id != file_id:
+        with _file_lock:
+            if _file_id != file_id:
+                fold_exited()
+                _file = SampleFile(metrics_dir() / f'{file_id[0]}.metrics')
+                _file_id = file_id
+    return _file
+
+
+@contextmanager
+def directory_lock(operation):
+    """Hold the metrics directory's lock: shared to read the files, exclusive to fold them"""
+    directory = metrics_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / '.lock', 'a') as lock:
+        fcntl.flock(lock, operation)
+        yield
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def file_totals(path):
+    data = path.read_bytes()
+    if len(data) < HEADER.size:
+        return []
+    used = min(HEADER.unpack_from(data, 0)[0], len(data))
+    return [(key, value) for key, value, _ in read_entries(data, used)]
+
+
+def fold_exited():
+    """Add the files of exited processes into the aggregate file and delete them"""
+    with directory_lock(fcntl.LOCK_EX):
+        exited = [path for path in metrics_dir().glob('*.metrics')
+                  if path.stem.isdigit() and not is_running(int(path.stem))]
+        if not exited:
+            return
+        aggregate = SampleFile(metrics_dir() / AGGREGATE_NAME)
+        for path in exited:
+            for key, value in file_totals(path):
+                aggregate.add(key, value)
+            path.unlink()
+        aggregate.close()
+
+
+def collect():
+    """{key: value} summed over every process's file"""
+    totals = {}
+    with directory_lock(fcntl.LOCK_SH):
+        for path in sorted(metrics_dir().glob('*.metrics')):
+            for key, value in file_totals(path):
+                totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def clear():
+    """Forget every process's samples, e.g. when the server starts"""
+    global _file_id
+    with _file_lock:
+        shutil.rmtree(metrics_dir(), ignore_errors=True)
+        _file_id = None
+
+
+REGISTRY = []
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.keys = {}
+        REGISTRY.append(self)
+
+    def key(self, sample, labels, **extra):
+        """The file key of one series, encoded once per process"""
+        labels = {**labels, **extra}
+        cache_key = (sample, *labels.items())
+        key = self.keys.get(cache_key)
+        if key is None:
+            if set(labels) - set(extra) != set(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+            key = self.keys[cache_key] = json.dumps([self.name, sample, sorted(labels.items())])
+        return key
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        sample_file().add(self.key(self.name, labels), amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        index = bisect_left(self.buckets, value)
+        bound = self.buckets[index] if index < len(self.buckets) else float('inf')
+        samples = sample_file()
+        samples.add(self.key(f'{self.name}_bucket', labels, le=format_value(bound)), 1)
+        samples.add(self.key(f'{self.name}_sum', labels), value)
+        samples.add(self.key(f'{self.name}_count', labels), 1)
+
+
+REQUEST_LATENCY = Histogram(
+    'hms_http_request_duration_seconds', 'Time to respond to a request, by URL name', ['url_name', 'method'],
+)
+RESPONSES = Counter('hms_http_responses_total', 'Responses by URL name and status code', ['url_name', 'status'])
+DB_QUERIES = Counter(
+    'hms_db_queries_total', 'SQL queries, by the URL name of the request that ran them ("none" outside requests)',
+    ['url_name'],
+)
+CACHE_LOOKUPS = Counter('hms_cache_lookups_total', 'Cache lookups by cache and result (hit or miss)', ['cache', 'result'])
+BOOKINGS = Counter('hms_bookings_total', 'Appointments booked, by source (web, api or waitlist)', ['source'])
+BOOKING_CONFLICTS = Counter(
+    'hms_booking_conflicts_total', 'Bookings refused because the slot was taken, by reason', ['reason'],
+)
+SIGNUPS = Counter('hms_signups_total', 'Accounts created through the signup page, by role', ['role'])
+
+
+def cache_lookups(cache_name, hits, misses):
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache=cache_name, result='hit')
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache=cache_name, result='miss')
+
+
+# Methods labelled as themselves; any other verb a client sends is "other",
+# so clients cannot add series
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+_request_queries = ContextVar('hospital_metrics_queries', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """Execute wrapper: a request's queries are counted once it ends, others straight away"""
+    counter = _request_queries.get()
+    if counter is None:
+        DB_QUERIES.inc(url_name='none')
+    else:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def instrument(connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def install():
+    connection_created.connect(instrument, dispatch_uid='hospital.metrics')
+    for alias in connections:
+        instrument(connections[alias])
+
+
+def begin_request():
+    counter = [0]
+    return time.perf_counter(), counter, _request_queries.set(counter)
+
+
+def end_request(state, request, response):
+    """Record a request begun with ``begin_request()``"""
+    started, counter, token = state
+    _request_queries.reset(token)
+    match = request.resolver_match
+    url_name = (match.url_name or match.view_name) if match is not None else 'unresolved'
+    method = request.method if request.method in METHODS else 'other'
+    REQUEST_LATENCY.observe(time.perf_counter() - started, url_name=url_name, method=method)
+    RESPONSES.inc(url_name=url_name, status=str(response.status_code if response is not None else 500))
+    if counter[0]:
+        DB_QUERIES.inc(counter[0], url_name=url_name)
+
+
+def pending_bills():
+    """(count, total amount) of pending bills, from the database at most once per cache period"""
+    totals = cache.get(GAUGE_CACHE_KEY)
+    if totals is None:
+        aggregate = Billing.objects.filter(payment_status='pending').aggregate(
+            count=Count('pk'), amount=Sum('total_amount'),
+        )
+        totals = (aggregate['count'], float(aggregate['amount'] or 0))
+        cache.set(GAUGE_CACHE_KEY, totals, getattr(settings, 'METRICS_GAUGE_CACHE_SECONDS', 60))
+    return totals
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def sample_line(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{label}="{escape(text)}"' for label, text in labels) + '}'
+    return f'{name} {format_value(value)}'
+
+
+def exposition():
+    """Every metric in the text exposition format"""
+    samples = {}
+    for key, value in collect().items():
+        name, sample, labels = json.loads(key)
+        samples.setdefault(name, []).append((sample, [tuple(pair) for pair in labels], value))
+    lines = []
+    for metric in REGISTRY:
+        lines += [f'# HELP {metric.name} {metric.documentation}', f'# TYPE {metric.name} {metric.kind}']
+        found = samples.get(metric.name, [])
+        if metric.kind == 'histogram':
+            lines += histogram_lines(metric, found)
+        else:
+            lines += [sample_line(sample, labels, value) for sample, labels, value in sorted(found)]
+    count, amount = pending_bills()
+    lines += [
+        '# HELP hms_pending_bills Bills awaiting payment',
+        '# TYPE hms_pending_bills gauge',
+        sample_line('hms_pending_bills', [], count),
+        '# HELP hms_pending_bills_amount Total amount of the bills awaiting payment',
+        '# TYPE hms_pending_bills_amount gauge',
+        sample_line('hms_pending_bills_amount', [], amount),
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def histogram_lines(metric, found):
+    by_labels = {}
+    for sample, labels, value in found:
+        series = by_labels.setdefault(tuple(pair for pair in labels if pair[0] != 'le'), {'buckets': {}})
+        if sample.endswith('_bucket'):
+            series['buckets'][dict(labels)['le']] = value
+        else:
+            series[sample] = value
+    lines = []
+    for labels, series in sorted(by_labels.items()):
+        cumulative = 0
+        for bound in (*metric.buckets, float('inf')):
+            cumulative += series['buckets'].get(format_value(bound), 0)
+            lines.append(sample_line(f'{metric.name}_bucket', [*labels, ('le', format_value(bound))], cumulative))
+        lines.append(sample_line(f'{metric.name}_sum', labels, series.get(f'{metric.name}_sum', 0)))
+        lines.append(sample_line(f'{metric.name}_count', labels, series.get(f'{metric.name}_count', 0)))
+    return lines
@@ -0,0 +1,234 @@
+import time
+from dataclasses import asdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import caching, identity, metrics, profiling, routers, slowlog
+
+STICKY_COOKIE = 'hms_primary_until'
+
+
+class MetricsMiddleware:
+    """
+    Request latency, status and per-URL query counts for ``/metrics``.
+
+    Listed first so it times the whole stack. See ``hospital.metrics``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        metrics.install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = metrics.begin_request()
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(state, request, response)
+        return response
+
+    async def __acall__(self, request):
+        state = metrics.begin_request()
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(state, request, response)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sample of requests for the staff profiling page.
+
+    Opt-in: the middleware drops out of the stack unless
+    ``PROFILING_SAMPLE_RATE`` is above zero. Listed first so the queries of
+    the other middleware are counted too. See ``hospital.profiling``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if profiling.sample_rate() <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        profiling.install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = profiling.begin(request)
+        if profile is None:
+            return self.get_response(request)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            profiling.end(profile, request, response)
+        return response
+
+    async def __acall__(self, request):
+        profile = profiling.begin(request)
+        if profile is None:
+            return await self.get_response(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.end(profile, request, response)
+        return response
+
+    def process_template_response(self, request, response):
+        profiling.rendering(response)
+        return response
+
+
+class SlowQueryMiddleware:
+    """
+    Tell the slow query log which request its queries belong to.
+
+    Dropped from the stack when ``SLOW_QUERY_MS`` is 0. See
+    ``hospital.slowlog``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if slowlog.threshold_ms() <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = slowlog.begin_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            slowlog.end_request(token)
+
+    async def __acall__(self, request):
+        token = slowlog.begin_request(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            slowlog.end_request(token)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Route read-only views to the replica, with a sticky-primary window.
+
+    A GET/HEAD request to a view marked ``use_replica`` reads from the
+    replica unless the client wrote within the last
+    ``DATABASE_REPLICA_STICKY_SECONDS``. Any request that writes sets a
+    cookie that keeps that client on the primary for the window, so a
+    freshly booked appointment shows up on the very next page.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = routers.begin_request()
+        try:
+            response = self.get_response(request)
+            self.stick_if_written(response)
+        finally:
+            routers.end_request(token)
+        return response
+
+    async def __acall__(self, request):
+        token = routers.begin_request()
+        try:
+            response = await self.get_response(request)
+            self.stick_if_written(response)
+        finally:
+            routers.end_request(token)
+        return response
+
+    def stick_if_written(self, response):
+        if routers.wrote_primary():
+            window = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 15)
+            response.set_cookie(
+                STICKY_COOKIE, str(int(time.time() + window)),
+                max_age=window, httponly=True, samesite='Lax',
+            )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        if (request.method in ('GET', 'HEAD')
+                and getattr(view, 'use_replica', False)
+                and not self.is_sticky(request)):
+            routers.allow_replica()
+
+    def is_sticky(self, request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+
+class UserContextMiddleware:
+    """
+    Resolve the user's role and Doctor/Patient PKs once per session.
+
+    The context is stored in the session and attached to ``request.user``
+    for ``identity.get_user_context``; it is re-resolved only when its
+    token no longer matches (see ``hospital.identity``), or on every
+    request when there is no shared cache to hold the tokens. Under ASGI the
+    user is loaded here too, so async views never trigger the lazy
+    ``request.user`` lookup themselves.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.attach_context(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await sync_to_async(self.attach_context)(request)
+        return await self.get_response(request)
+
+    def attach_context(self, request):
+        user = request.user
+        if user.is_authenticated:
+            setattr(user, identity.USER_ATTR, self.session_context(request, user))
+
+    def session_context(self, request, user):
+        if not caching.shared():
+            return identity.load_user_context(user)
+        stored = request.session.get(identity.SESSION_KEY)
+        if (stored and stored.get('user_id') == user.pk
+                and stored.get('token') == identity.current_token(user.pk)):
+            return identity.UserContext(**stored)
+        context = identity.load_user_context(user)
+        request.session[identity.SESSION_KEY] = asdict(context)
+        return context
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0004_appointment_reminders'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['appointment_date', 'doctor', 'status'], name='hospital_appt_day_doctor_idx'),
+        ),
+    ]
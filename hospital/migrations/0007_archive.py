@@ -0,0 +1,72 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0006_waitlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAppointment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('patient_ref', models.BigIntegerField(help_text='Patient id')),
+                ('doctor_ref', models.BigIntegerField(help_text='Doctor id')),
+                ('patient_user_id', models.BigIntegerField()),
+                ('doctor_user_id', models.BigIntegerField()),
+                ('patient_code', models.CharField(max_length=20)),
+                ('patient_name', models.CharField(max_length=301)),
+                ('doctor_name', models.CharField(max_length=301)),
+                ('specialization', models.CharField(max_length=50)),
+                ('appointment_date', models.DateField()),
+                ('appointment_time', models.TimeField()),
+                ('appointment_type', models.CharField(choices=[('consultation', 'Consultation'), ('follow_up', 'Follow-up'), ('emergency', 'Emergency'), ('routine', 'Routine Checkup')], max_length=15)),
+                ('reason', models.TextField()),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('no_show', 'No Show'), ('held', 'Held for Waitlist')], max_length=10)),
+                ('notes', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-appointment_date', '-appointment_time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedBilling',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('discount_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('additional_charges', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('additional_charges_description', models.TextField(blank=True)),
+                ('discount_description', models.TextField(blank=True)),
+                ('payment_status', models.CharField(choices=[('pending', 'Pending'), ('paid', 'Paid'), ('partial', 'Partial'), ('overdue', 'Overdue'), ('cancelled', 'Cancelled')], max_length=10)),
+                ('payment_method', models.CharField(blank=True, choices=[('cash', 'Cash'), ('card', 'Credit/Debit Card'), ('insurance', 'Insurance'), ('online', 'Online Payment')], max_length=10)),
+                ('payment_date', models.DateTimeField(blank=True, null=True)),
+                ('due_date', models.DateField(blank=True, null=True)),
+                ('notes', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('appointment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='bill', to='hospital.archivedappointment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['patient_user_id', 'appointment_date'], name='hospital_arch_appt_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['doctor_user_id', 'appointment_date'], name='hospital_arch_appt_doctor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['appointment_date', 'appointment_time'], name='hospital_arch_appt_date_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0007_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('appointment', 'Appointment'), ('bill', 'Bill')], max_length=15)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=10)),
+                ('doctor_id', models.BigIntegerField()),
+                ('patient_id', models.BigIntegerField()),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor_id', 'id'], name='hospital_feed_doctor_idx'), models.Index(fields=['patient_id', 'id'], name='hospital_feed_patient_idx'), models.Index(fields=['created_at'], name='hospital_feed_created_idx')],
+            },
+        ),
+    ]
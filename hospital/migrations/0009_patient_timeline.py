@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0008_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, unique=True)),
+                ('kind', models.CharField(choices=[('appointment', 'Appointment'), ('note', 'Note'), ('bill', 'Bill'), ('profile', 'Profile change')], max_length=12)),
+                ('occurred_at', models.DateTimeField()),
+                ('title', models.CharField(max_length=200)),
+                ('detail', models.TextField(blank=True)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='hospital.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', '-occurred_at', '-id'], name='hospital_timeline_patient_idx')],
+            },
+        ),
+    ]
@@ -1,8 +1,15 @@
+import logging
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
 from django.urls import reverse
 from django.utils import timezone
 
+from .identity import get_user_context
+
+logger = logging.getLogger(__name__)
+
 class UserProfile(models.Model):
     """Extended user profile for role-based access"""
     ROLE_CHOICES = [
@@ -17,10 +24,17 @@ class UserProfile(models.Model):
     address = models.TextField(blank=True)
     date_of_birth = models.DateField(null=True, blank=True)
     profile_picture = models.ImageField(upload_to='profiles/', blank=True, null=True)
+    profile_thumbnail = models.ImageField(upload_to='profiles/thumbs/', blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.role}"
+    
+    @property
+    def avatar_url(self):
+        """The thumbnail once the task queue has made it, else the full picture"""
+        picture = self.profile_thumbnail or self.profile_picture
+        return picture.url if picture else ''
 
 class Doctor(models.Model):
     """Doctor model with specialization and availability"""
@@ -83,6 +97,53 @@ class Patient(models.Model):
     def get_absolute_url(self):
         return reverse('patient_detail', kwargs={'pk': self.pk})
 
+class RoleScopedQuerySet(models.QuerySet):
+    """
+    Querysets that know which rows each role may see.
+
+    Subclasses name the lookups from their model to the patient's and the
+    doctor's user; ``visible_to`` filters on those in the same query
+    instead of loading the user's Patient or Doctor row first.
+    """
+    patient_user_lookup = None
+    doctor_user_lookup = None
+    
+    def visible_to(self, user):
+        """
+        Rows ``user`` may see: their own as a patient or doctor, all as admin.
+
+        Raises PermissionDenied for anonymous users and for accounts
+        without a hospital role, rather than quietly returning nothing. The
+        message reaches API clients, so the details are only logged.
+        """
+        if not user.is_authenticated:
+            raise PermissionDenied('Sign in to view hospital records.')
+        role = get_user_context(user).role
+        if role == 'admin':
+            return self.all()
+        if role == 'patient':
+            return self.filter(**{self.patient_user_lookup: user.pk})
+        if role == 'doctor':
+            return self.filter(**{self.doctor_user_lookup: user.pk})
+        logger.warning('User %s has no hospital role (got %r)', user.pk, role)
+        raise PermissionDenied('Your account has no hospital role.')
+
+class AppointmentQuerySet(RoleScopedQuerySet):
+    patient_user_lookup = 'patient__user_id'
+    doctor_user_lookup = 'doctor__user_id'
+
+class BillingQuerySet(RoleScopedQuerySet):
+    patient_user_lookup = 'appointment__patient__user_id'
+    doctor_user_lookup = 'appointment__doctor__user_id'
+
+class ArchivedAppointmentQuerySet(RoleScopedQuerySet):
+    patient_user_lookup = 'patient_user_id'
+    doctor_user_lookup = 'doctor_user_id'
+
+class ArchivedBillingQuerySet(RoleScopedQuerySet):
+    patient_user_lookup = 'appointment__patient_user_id'
+    doctor_user_lookup = 'appointment__doctor_user_id'
+
 class Appointment(models.Model):
     """Appointment booking system"""
     STATUS_CHOICES = [
@@ -90,6 +151,7 @@ class Appointment(models.Model):
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
         ('no_show', 'No Show'),
+        ('held', 'Held for Waitlist'),
     ]
     
     APPOINTMENT_TYPE_CHOICES = [
@@ -110,9 +172,26 @@ class Appointment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = AppointmentQuerySet.as_manager()
+    
     class Meta:
-        unique_together = ['doctor', 'appointment_date', 'appointment_time']
         ordering = ['-appointment_date', '-appointment_time']
+        constraints = [
+            # A cancelled appointment gives its slot back
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date', 'appointment_time'],
+                condition=~models.Q(status='cancelled'),
+                name='hospital_appointment_active_slot',
+                violation_error_message='This time slot is already booked. Please choose another time.',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['doctor', 'appointment_date', 'appointment_time'], name='hospital_appt_doctor_slot_idx'),
+            # Upcoming scheduled appointments, e.g. for reminders
+            models.Index(fields=['status', 'appointment_date', 'appointment_time'], name='hospital_appt_status_slot_idx'),
+            # Covers the capacity planner's per doctor-day counts
+            models.Index(fields=['appointment_date', 'doctor', 'status'], name='hospital_appt_day_doctor_idx'),
+        ]
     
     def __str__(self):
         return f"{self.patient.user.get_full_name()} - Dr. {self.doctor.user.get_full_name()} on {self.appointment_date}"
@@ -150,6 +229,8 @@ class Billing(models.Model):
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = BillingQuerySet.as_manager()
+    
     def __str__(self):
         return f"Bill #{self.id:05d} - {self.appointment.patient.user.get_full_name()}"
     
@@ -158,4 +239,251 @@ class Billing(models.Model):
         if not self.total_amount:
             base_amount = float(self.appointment.doctor.consultation_fee)
             self.total_amount = base_amount + float(self.additional_charges) - float(self.discount_amount)
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class Task(models.Model):
+    """A queued background job; see hospital.taskqueue"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'], name='hospital_task_due_idx')]
+    
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+class AppointmentReminder(models.Model):
+    """Delivery record of the reminder for one appointment slot; see hospital.reminders"""
+    STATUS_CHOICES = [
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),
+    ]
+    
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='reminders')
+    # The slot the reminder was for: a rescheduled appointment gets a new one
+    appointment_date = models.DateField()
+    appointment_time = models.TimeField()
+    channel = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['appointment', 'appointment_date', 'appointment_time'], name='hospital_reminder_once',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Reminder for appointment #{self.appointment_id} ({self.status})"
+
+class WaitlistEntry(models.Model):
+    """A patient waiting for any slot with a doctor on a day; see hospital.waitlist"""
+    STATUS_CHOICES = [
+        ('waiting', 'Waiting'),
+        ('offered', 'Offered'),
+        ('booked', 'Booked'),
+        ('declined', 'Declined'),
+        ('expired', 'Expired'),
+        ('withdrawn', 'Withdrawn'),
+    ]
+    
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='waitlist_entries')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='waitlist_entries')
+    appointment_date = models.DateField()
+    appointment_type = models.CharField(max_length=15, choices=Appointment.APPOINTMENT_TYPE_CHOICES, default='consultation')
+    reason = models.TextField()
+    # Higher goes first; ties go to whoever joined first
+    priority = models.PositiveSmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='waiting')
+    offered_appointment = models.OneToOneField(
+        Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name='waitlist_offer',
+    )
+    offer_expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['appointment_date', '-priority', 'created_at']
+        indexes = [
+            # The next patient for a freed slot is the first entry of this index
+            models.Index(fields=['doctor', 'appointment_date', 'status', '-priority', 'created_at'],
+                         name='hospital_waitlist_next_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['patient', 'doctor', 'appointment_date'],
+                condition=models.Q(status__in=['waiting', 'offered']),
+                name='hospital_waitlist_once',
+                violation_error_message='You are already on the waitlist for this doctor on that day.',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.patient} waiting for {self.doctor} on {self.appointment_date} ({self.status})"
+
+class ArchivedAppointment(models.Model):
+    """
+    A finished appointment moved out of the live table; see hospital.archive.
+
+    Keeps the original id and copies the patient's and doctor's names, so
+    it reads the same after those accounts change or go, and it may live in
+    a separate database (no foreign keys to the live tables).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    patient_ref = models.BigIntegerField(help_text='Patient id')
+    doctor_ref = models.BigIntegerField(help_text='Doctor id')
+    patient_user_id = models.BigIntegerField()
+    doctor_user_id = models.BigIntegerField()
+    patient_code = models.CharField(max_length=20)
+    patient_name = models.CharField(max_length=301)
+    doctor_name = models.CharField(max_length=301)
+    specialization = models.CharField(max_length=50)
+    appointment_date = models.DateField()
+    appointment_time = models.TimeField()
+    appointment_type = models.CharField(max_length=15, choices=Appointment.APPOINTMENT_TYPE_CHOICES)
+    reason = models.TextField()
+    status = models.CharField(max_length=10, choices=Appointment.STATUS_CHOICES)
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    objects = ArchivedAppointmentQuerySet.as_manager()
+    
+    class Meta:
+        ordering = ['-appointment_date', '-appointment_time']
+        indexes = [
+            models.Index(fields=['patient_user_id', 'appointment_date'], name='hospital_arch_appt_patient_idx'),
+            models.Index(fields=['doctor_user_id', 'appointment_date'], name='hospital_arch_appt_doctor_idx'),
+            models.Index(fields=['appointment_date', 'appointment_time'], name='hospital_arch_appt_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.patient_name} - Dr. {self.doctor_name} on {self.appointment_date} (archived)"
+
+class ArchivedBilling(models.Model):
+    """A settled bill archived with its appointment; see hospital.archive"""
+    id = models.BigIntegerField(primary_key=True)
+    appointment = models.OneToOneField(ArchivedAppointment, on_delete=models.CASCADE, related_name='bill')
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    additional_charges = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    additional_charges_description = models.TextField(blank=True)
+    discount_description = models.TextField(blank=True)
+    payment_status = models.CharField(max_length=10, choices=Billing.PAYMENT_STATUS_CHOICES)
+    payment_method = models.CharField(max_length=10, choices=Billing.PAYMENT_METHOD_CHOICES, blank=True)
+    payment_date = models.DateTimeField(null=True, blank=True)
+    due_date = models.DateField(null=True, blank=True)
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    objects = ArchivedBillingQuerySet.as_manager()
+    
+    def __str__(self):
+        return f"Bill #{self.id:05d} - {self.appointment.patient_name} (archived)"
+
+class ChangeEvent(models.Model):
+    """
+    One write to an appointment or bill, for the live dashboards; see hospital.feed.
+
+    Rows are added in the writing transaction, so their ids order the
+    feed. The doctor and patient are plain ids: events outlive the rows
+    they describe.
+    """
+    KIND_CHOICES = [
+        ('appointment', 'Appointment'),
+        ('bill', 'Bill'),
+    ]
+    
+    ACTION_CHOICES = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted'),
+    ]
+    
+    kind = models.CharField(max_length=15, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    doctor_id = models.BigIntegerField()
+    patient_id = models.BigIntegerField()
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # What a reconnecting doctor or patient missed
+            models.Index(fields=['doctor_id', 'id'], name='hospital_feed_doctor_idx'),
+            models.Index(fields=['patient_id', 'id'], name='hospital_feed_patient_idx'),
+            models.Index(fields=['created_at'], name='hospital_feed_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} {self.action} (event {self.pk})"
+
+class TimelineEntry(models.Model):
+    """
+    One event in a patient's medical timeline; see hospital.timeline.
+
+    Written when the appointment, bill or patient record it describes is,
+    with what the timeline shows copied in, so a page of it is read from
+    this table alone. ``key`` names the source (``appointment:12``), so
+    writing an entry again replaces it.
+    """
+    KIND_CHOICES = [
+        ('appointment', 'Appointment'),
+        ('note', 'Note'),
+        ('bill', 'Bill'),
+        ('profile', 'Profile change'),
+    ]
+    
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='timeline')
+    key = models.CharField(max_length=50, unique=True)
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    occurred_at = models.DateTimeField()
+    title = models.CharField(max_length=200)
+    detail = models.TextField(blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    
+    class Meta:
+        indexes = [
+            # A patient's timeline, newest first, is one range of this index
+            models.Index(fields=['patient', '-occurred_at', '-id'], name='hospital_timeline_patient_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.patient} {self.kind}: {self.title} ({self.occurred_at:%Y-%m-%d})"
+
+class ApiToken(models.Model):
+    """
+    A bearer token for the JSON API's kiosk and mobile clients; see hospital.rest.
+
+    Only the SHA-256 of the key is stored: the key itself is shown once,
+    by create_api_token. Deleting the row revokes it.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, blank=True)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.user.username}: {self.name or 'API token'}"
@@ -0,0 +1,256 @@
+"""
+Monthly partitioning of the appointments table on PostgreSQL.
+
+``partition()`` converts ``hospital_appointment`` into a table partitioned
+by range on ``appointment_date``: one partition per month that has
+appointments, one per month from now to ``APPOINTMENT_PARTITION_MONTHS_AHEAD``
+ahead, and a default partition for anything else. The indexes and
+constraints are recreated on the parent, so every partition gets its own
+small copy. A query bounded on ``appointment_date`` (the list filters, the
+dashboards' upcoming appointments, the timelines and the capacity planner)
+is then planned against the matching months only.
+
+Nothing here runs on its own: ``partition_appointments --convert``
+partitions the table, and ``partition_appointments`` (put it in cron)
+calls ``ensure_partitions()`` to keep months ahead of time. ``migrate``
+never touches the partitions. A month whose rows already landed in the
+default partition has them moved into its new partition.
+
+Postgres requires the primary key of a partitioned table to include the
+partition key, so it becomes (id, appointment_date), with ids still drawn
+from one sequence. Foreign keys can only reference a unique key, so the
+foreign keys from bills, reminders and waitlist entries to appointments
+are replaced by triggers that enforce the same rule
+(``reference_triggers()``). A row that names a missing appointment fails
+when its transaction commits, as with Django's deferred foreign keys, and
+deleting an appointment that rows still point to fails at once. Django
+deletes those rows first, as it does with the foreign keys. A lookup by
+id alone probes each partition's primary key index. SQLite has no
+partitioning: it keeps one table, and its (date, doctor, status) index
+bounds date-range queries the same way.
+"""
+from datetime import date
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, NotSupportedError, connections, transaction
+
+from .models import Appointment
+
+PARTITION_KEY = 'appointment_date'
+# Set for the transaction while rows move between partitions, which the
+# reference triggers must not take for deletes
+MOVING_SETTING = 'hospital.moving_partition_rows'
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(month):
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def months_ahead(today=None, ahead=None):
+    """The current month and the ``ahead`` months after it"""
+    if ahead is None:
+        ahead = getattr(settings, 'APPOINTMENT_PARTITION_MONTHS_AHEAD', 3)
+    months = [month_start(today or date.today())]
+    for _ in range(ahead):
+        months.append(next_month(months[-1]))
+    return months
+
+
+def partition_name(month):
+    return f'{Appointment._meta.db_table}_p{month:%Y_%m}'
+
+
+def default_partition_name():
+    return f'{Appointment._meta.db_table}_default'
+
+
+def is_partitioned(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [Appointment._meta.db_table]
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions(using=DEFAULT_DB_ALIAS):
+    """Names of the appointment table's partitions, oldest first"""
+    if not is_partitioned(using):
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = to_regclass(%s) ORDER BY child.relname',
+            [Appointment._meta.db_table],
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+def add_month_partition(cursor, quote_name, month):
+    """Attach ``month``'s partition, moving its rows out of the default partition"""
+    table, name, default = Appointment._meta.db_table, partition_name(month), default_partition_name()
+    start, end = month.isoformat(), next_month(month).isoformat()
+    cursor.execute(f'CREATE TABLE {quote_name(name)} (LIKE {quote_name(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    # Until the new table is attached its rows are not in the parent, so
+    # the delete trigger would take the move for a delete of referenced rows
+    cursor.execute("SELECT set_config(%s, 'on', true)", [MOVING_SETTING])
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {quote_name(default)} '
+        f'WHERE {PARTITION_KEY} >= %s AND {PARTITION_KEY} < %s RETURNING *) '
+        f'INSERT INTO {quote_name(name)} SELECT * FROM moved',
+        [start, end],
+    )
+    cursor.execute("SELECT set_config(%s, 'off', true)", [MOVING_SETTING])
+    cursor.execute(
+        f"ALTER TABLE {quote_name(table)} ATTACH PARTITION {quote_name(name)} FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+
+
+def reference_triggers(cursor, quote_name, references):
+    """
+    Enforce the foreign keys ``references`` (referencing table, column) into
+    the appointments table with triggers, since constraints can no longer
+    point at it.
+    """
+    table, pk = quote_name(Appointment._meta.db_table), quote_name(Appointment._meta.pk.column)
+    exists = quote_name(f'{Appointment._meta.db_table}_exists')
+    referenced = quote_name(f'{Appointment._meta.db_table}_referenced')
+    cursor.execute(
+        f'CREATE OR REPLACE FUNCTION {exists}() RETURNS trigger LANGUAGE plpgsql AS $$\n'
+        f'DECLARE target bigint := (to_jsonb(NEW) ->> TG_ARGV[0])::bigint;\n'
+        f'BEGIN\n'
+        f'    IF target IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {table} WHERE {pk} = target) THEN\n'
+        f"        RAISE foreign_key_violation USING MESSAGE = TG_TABLE_NAME || '.' || TG_ARGV[0] || ' = ' "
+        f"|| target || ' is not an appointment';\n"
+        f'    END IF;\n'
+        f'    RETURN NULL;\n'
+        f'END $$'
+    )
+    checks = ' OR '.join(
+        f'EXISTS (SELECT 1 FROM {quote_name(referencing)} WHERE {quote_name(column)} = OLD.{pk})'
+        for referencing, column in references
+    ) or 'false'
+    # A row moved to another month's partition is deleted and inserted
+    # again; one moved by add_month_partition() is not in the parent yet
+    cursor.execute(
+        f'CREATE OR REPLACE FUNCTION {referenced}() RETURNS trigger LANGUAGE plpgsql AS $$\n'
+        f'BEGIN\n'
+        f"    IF current_setting('{MOVING_SETTING}', true) = 'on' THEN\n"
+        f'        RETURN NULL;\n'
+        f'    END IF;\n'
+        f'    IF NOT EXISTS (SELECT 1 FROM {table} WHERE {pk} = OLD.{pk}) AND ({checks}) THEN\n'
+        f"        RAISE foreign_key_violation USING MESSAGE = 'appointment ' || OLD.{pk} || ' is still referenced';\n"
+        f'    END IF;\n'
+        f'    RETURN NULL;\n'
+        f'END $$'
+    )
+    cursor.execute(
+        f'CREATE TRIGGER {referenced} AFTER DELETE ON {table} FOR EACH ROW EXECUTE FUNCTION {referenced}()'
+    )
+    for referencing, column in references:
+        cursor.execute(
+            f'CREATE CONSTRAINT TRIGGER {quote_name(f"{referencing}_{column}_exists")} '
+            f'AFTER INSERT OR UPDATE OF {quote_name(column)} ON {quote_name(referencing)} '
+            f'DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION {exists}(%s)',
+            [column],
+        )
+
+
+def ensure_partitions(ahead=None, using=DEFAULT_DB_ALIAS, today=None):
+    """Create the partitions for this month and ``ahead`` more; returns the names created"""
+    if not is_partitioned(using):
+        return []
+    connection = connections[using]
+    existing = set(partitions(using))
+    created = []
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for month in months_ahead(today, ahead):
+            if partition_name(month) not in existing:
+                add_month_partition(cursor, connection.ops.quote_name, month)
+                created.append(partition_name(month))
+    return created
+
+
+def partition(ahead=None, using=DEFAULT_DB_ALIAS, today=None):
+    """
+    Convert the appointments table to monthly partitions in one transaction,
+    which holds an exclusive lock on it while the rows are copied. Returns
+    the partitions created; an already partitioned table only gets the
+    months ahead.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        raise NotSupportedError('Monthly partitioning needs PostgreSQL; other databases keep a single table.')
+    if is_partitioned(using):
+        return ensure_partitions(ahead, using, today)
+    table, old = Appointment._meta.db_table, f'{Appointment._meta.db_table}_unpartitioned'
+    pk = Appointment._meta.pk.column
+    quote_name = connection.ops.quote_name
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {quote_name(table)} IN ACCESS EXCLUSIVE MODE')
+        # Definitions to recreate on the partitioned table
+        cursor.execute(
+            'SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = to_regclass(%s) AND NOT indisprimary',
+            [table],
+        )
+        indexes = [definition for definition, in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) "
+            "AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        # Foreign keys into the table cannot survive, (id) alone is no longer
+        # unique; reference_triggers() takes their place below
+        cursor.execute(
+            'SELECT referencing.relname, con.conname, att.attname FROM pg_constraint con '
+            'JOIN pg_class referencing ON referencing.oid = con.conrelid '
+            'JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = con.conkey[1] '
+            "WHERE con.confrelid = to_regclass(%s) AND con.contype = 'f'",
+            [table],
+        )
+        references = []
+        for referencing, name, column in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {quote_name(referencing)} DROP CONSTRAINT {quote_name(name)}')
+            references.append((referencing, column))
+        cursor.execute(f'SELECT DISTINCT date_trunc(\'month\', {PARTITION_KEY})::date FROM {quote_name(table)}')
+        months = sorted({month for month, in cursor.fetchall()} | set(months_ahead(today, ahead)))
+
+        cursor.execute(f'ALTER TABLE {quote_name(table)} RENAME TO {quote_name(old)}')
+        cursor.execute(
+            f'CREATE TABLE {quote_name(table)} (LIKE {quote_name(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ({PARTITION_KEY})'
+        )
+        cursor.execute(f'CREATE TABLE {quote_name(default_partition_name())} PARTITION OF {quote_name(table)} DEFAULT')
+        for month in months:
+            add_month_partition(cursor, quote_name, month)
+        cursor.execute(f'INSERT INTO {quote_name(table)} SELECT * FROM {quote_name(old)}')
+        cursor.execute(f'DROP TABLE {quote_name(old)}')
+
+        # Partitioned tables cannot have identity columns before Postgres 17
+        sequence = f'{table}_{pk}_seq'
+        cursor.execute(f'CREATE SEQUENCE {quote_name(sequence)} OWNED BY {quote_name(table)}.{quote_name(pk)}')
+        cursor.execute(
+            f"ALTER TABLE {quote_name(table)} ALTER COLUMN {quote_name(pk)} SET DEFAULT nextval('{sequence}')"
+        )
+        cursor.execute(
+            f"SELECT setval('{sequence}', COALESCE(MAX({quote_name(pk)}), 0) + 1, false) FROM {quote_name(table)}"
+        )
+        cursor.execute(
+            f'ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(f"{table}_pkey")} '
+            f'PRIMARY KEY ({quote_name(pk)}, {PARTITION_KEY})'
+        )
+        for definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(name)} {definition}')
+        reference_triggers(cursor, quote_name, references)
+        cursor.execute(f'ANALYZE {quote_name(table)}')
+    return [partition_name(month) for month in months]
+
@@ -0,0 +1,252 @@
+"""
+Sampled request profiles for the staff profiling page.
+
+``ProfilingMiddleware`` (``hospital.middleware``) profiles a
+``PROFILING_SAMPLE_RATE`` share of requests. For each one it records:
+
+- the resolved view;
+- the number and total time of SQL queries on every database alias,
+  including those run on the async views' query threads;
+- how often each query fingerprint ran, so an N+1 loop shows up as one
+  fingerprint with a high count;
+- the time spent rendering a ``TemplateResponse``, which covers every
+  class-based page;
+- the peak traced memory while the request ran.
+
+Fingerprints are the SQL before parameters are bound, with ``IN`` and
+``VALUES`` lists and inlined numbers collapsed.
+
+Profiles go to a ring buffer holding the last ``PROFILING_BUFFER_SIZE``
+in this process. Concurrent sampled requests share one tracemalloc
+session, so their memory peaks can include each other's;
+``PROFILING_TRACE_MEMORY = False`` turns memory tracing off.
+"""
+import random
+import re
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+DEFAULT_BUFFER_SIZE = 1000
+FINGERPRINT_LENGTH = 500
+
+_current = ContextVar('hospital_profile', default=None)
+_buffer = deque(maxlen=DEFAULT_BUFFER_SIZE)
+_tracing_lock = threading.Lock()
+_tracing = 0
+
+PLACEHOLDER_LIST = re.compile(r'%s(?:, %s)+')
+ROW_LIST = re.compile(r'(\([^()]*\))(?:, \1)+')
+NUMBER = re.compile(r'\b\d+\b')
+WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """``sql`` with the parts that vary between otherwise identical queries collapsed"""
+    sql = PLACEHOLDER_LIST.sub('%s, ...', sql)
+    sql = ROW_LIST.sub(r'\1, ...', sql)
+    sql = NUMBER.sub('N', sql)
+    return WHITESPACE.sub(' ', sql).strip()[:FINGERPRINT_LENGTH]
+
+
+@dataclass
+class Profile:
+    method: str
+    path: str
+    view: str = 'unresolved'
+    status: int = 0
+    started_at: float = field(default_factory=time.time)
+    duration_ms: float = 0.0
+    queries: int = 0
+    sql_ms: float = 0.0
+    render_ms: float = 0.0
+    peak_kb: Optional[float] = None
+    fingerprints: Counter = field(default_factory=Counter, repr=False)
+
+    def __post_init__(self):
+        self.lock = threading.Lock()
+        self.clock = time.perf_counter()
+        self.token = None
+        self.baseline = None
+
+    def add_query(self, sql, seconds):
+        with self.lock:
+            self.queries += 1
+            self.sql_ms += seconds * 1000
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        """(count, fingerprint) for statements that ran more than once, most repeated first"""
+        return [(count, sql) for sql, count in self.fingerprints.most_common() if count > 1]
+
+    @property
+    def duplicate_queries(self):
+        return sum(count - 1 for count, _ in self.duplicates)
+
+
+@dataclass
+class Endpoint:
+    """The profiles of one view and method"""
+    view: str
+    method: str
+    profiles: list
+
+    @property
+    def requests(self):
+        return len(self.profiles)
+
+    def durations(self):
+        return sorted(profile.duration_ms for profile in self.profiles)
+
+    @property
+    def median_ms(self):
+        return statistics.median(self.durations())
+
+    @property
+    def p95_ms(self):
+        durations = self.durations()
+        return durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+
+    @property
+    def max_ms(self):
+        return self.durations()[-1]
+
+    @property
+    def queries(self):
+        return statistics.mean(profile.queries for profile in self.profiles)
+
+    @property
+    def sql_ms(self):
+        return statistics.mean(profile.sql_ms for profile in self.profiles)
+
+    @property
+    def render_ms(self):
+        return statistics.mean(profile.render_ms for profile in self.profiles)
+
+    @property
+    def peak_kb(self):
+        return max((profile.peak_kb for profile in self.profiles if profile.peak_kb is not None), default=None)
+
+    @property
+    def duplicates(self):
+        """The most repeated fingerprints of the endpoint's worst request for them"""
+        return max((profile.duplicates for profile in self.profiles), key=lambda found: found[:1], default=[])[:3]
+
+
+def sample_rate():
+    return float(getattr(settings, 'PROFILING_SAMPLE_RATE', 0))
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection; only the sampled requests pay for timing"""
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+def instrument(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install():
+    """Time queries on connections this thread has and every connection opened from now on"""
+    global _buffer
+    size = getattr(settings, 'PROFILING_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)
+    if _buffer.maxlen != size:
+        _buffer = deque(_buffer, maxlen=size)
+    connection_created.connect(instrument, dispatch_uid='hospital.profiling')
+    for alias in connections:
+        instrument(connections[alias])
+
+
+def start_tracing():
+    global _tracing
+    with _tracing_lock:
+        if _tracing == 0:
+            tracemalloc.start()
+        _tracing += 1
+        return tracemalloc.get_traced_memory()[0]
+
+
+def stop_tracing(baseline):
+    global _tracing
+    with _tracing_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        _tracing -= 1
+        if _tracing == 0:
+            tracemalloc.stop()
+    return max(peak - baseline, 0) / 1024
+
+
+def begin(request):
+    """Start profiling ``request`` if it is sampled; returns the profile or None"""
+    if random.random() >= sample_rate():
+        return None
+    profile = Profile(request.method, request.path)
+    profile.token = _current.set(profile)
+    profile.baseline = start_tracing() if getattr(settings, 'PROFILING_TRACE_MEMORY', True) else None
+    return profile
+
+
+def rendering(response):
+    """Time the rendering of a ``TemplateResponse`` under the current profile"""
+    profile = _current.get()
+    if profile is None:
+        return
+    started = time.perf_counter()
+
+    def rendered(response):
+        profile.render_ms += (time.perf_counter() - started) * 1000
+
+    response.add_post_render_callback(rendered)
+
+
+def end(profile, request, response):
+    """Finish ``profile`` and add it to the buffer"""
+    profile.duration_ms = (time.perf_counter() - profile.clock) * 1000
+    _current.reset(profile.token)
+    if profile.baseline is not None:
+        profile.peak_kb = stop_tracing(profile.baseline)
+    match = request.resolver_match
+    if match is not None:
+        view = getattr(match.func, 'view_class', match.func)
+        profile.view = view.__name__
+    profile.status = response.status_code if response is not None else 500
+    _buffer.append(profile)
+
+
+def profiles():
+    return list(_buffer)
+
+
+def clear():
+    _buffer.clear()
+
+
+def slowest(limit=20):
+    return sorted(profiles(), key=lambda profile: profile.duration_ms, reverse=True)[:limit]
+
+
+def endpoints():
+    """Every profiled view and method, slowest (by p95) first"""
+    grouped = {}
+    for profile in profiles():
+        grouped.setdefault((profile.view, profile.method), []).append(profile)
+    found = [Endpoint(view, method, group) for (view, method), group in grouped.items()]
+    return sorted(found, key=lambda endpoint: endpoint.p95_ms, reverse=True)
@@ -0,0 +1,231 @@
+"""
+Appointment reminders.
+
+``dispatch_reminders()`` (run by ``manage.py send_reminders``, e.g. from
+cron every 15 minutes) selects the scheduled appointments of the next 24
+hours that still need a reminder with one query over the
+(status, date, time) index. The rows are streamed in batches, so memory
+stays flat however many there are. Each batch is rendered from one
+compiled template, delivered through a backend on a bounded thread pool
+throttled by a shared token bucket, and its outcomes are written back
+with a single upsert. A rerun therefore skips everything already sent and
+retries failures up to ``REMINDER_MAX_ATTEMPTS``; a run that dies half way
+through a batch resends at most that batch.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from itertools import islice
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Appointment, AppointmentReminder
+
+logger = logging.getLogger(__name__)
+
+Reminder = namedtuple('Reminder', 'appointment_id recipient subject body')
+
+APPOINTMENT_TYPES = dict(Appointment.APPOINTMENT_TYPE_CHOICES)
+
+
+class ConsoleBackend:
+    """Writes reminders to stdout"""
+    channel = 'console'
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+
+    def send(self, reminder):
+        with self.lock:
+            self.stream.write(
+                f'To: {reminder.recipient}\nSubject: {reminder.subject}\n\n{reminder.body}\n{"-" * 72}\n'
+            )
+
+    def close(self):
+        self.stream.flush()
+
+
+class FileBackend(ConsoleBackend):
+    """Appends reminders to ``REMINDER_FILE_PATH``"""
+    channel = 'file'
+
+    def __init__(self, path=None):
+        path = path or getattr(settings, 'REMINDER_FILE_PATH', 'reminders.log')
+        super().__init__(open(path, 'a', encoding='utf-8'))
+
+    def close(self):
+        self.stream.close()
+
+
+class EmailBackend:
+    """
+    Emails reminders through Django's email backend, keeping one open
+    connection per worker thread rather than one per message.
+    """
+    channel = 'email'
+
+    def __init__(self):
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def send(self, reminder):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = get_connection()
+            with self.lock:
+                self.connections.append(connection)
+        EmailMessage(reminder.subject, reminder.body, to=[reminder.recipient], connection=connection).send()
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+
+BACKENDS = {'console': ConsoleBackend, 'file': FileBackend, 'email': EmailBackend}
+
+
+def get_backend(name=None, **kwargs):
+    """Instantiate the backend ``name`` (an alias or dotted path), by default ``REMINDER_BACKEND``"""
+    name = name or getattr(settings, 'REMINDER_BACKEND', 'email')
+    backend_class = BACKENDS[name] if name in BACKENDS else import_string(name)
+    return backend_class(**kwargs)
+
+
+class RateLimiter:
+    """A token bucket shared by the sender threads: ``rate`` sends a second, 0 for no limit"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def slot_window(start, end):
+    """Match appointments whose date and time fall in [start, end)"""
+    if start.date() == end.date():
+        return Q(appointment_date=start.date(), appointment_time__gte=start.time(), appointment_time__lt=end.time())
+    # The date range keeps the whole condition a range scan of the index
+    return Q(appointment_date__range=(start.date(), end.date())) & (
+        Q(appointment_date=start.date(), appointment_time__gte=start.time())
+        | Q(appointment_date__gt=start.date(), appointment_date__lt=end.date())
+        | Q(appointment_date=end.date(), appointment_time__lt=end.time())
+    )
+
+
+def due_reminders(start, end, max_attempts):
+    """Scheduled appointments in [start, end) whose slot has no finished reminder, as dicts"""
+    slot_reminder = AppointmentReminder.objects.filter(
+        appointment=OuterRef('pk'),
+        appointment_date=OuterRef('appointment_date'),
+        appointment_time=OuterRef('appointment_time'),
+    )
+    finished = slot_reminder.filter(Q(status__in=['sent', 'skipped']) | Q(attempts__gte=max_attempts))
+    return (
+        Appointment.objects
+        .filter(slot_window(start, end), ~Exists(finished), status='scheduled')
+        .annotate(previous_attempts=Coalesce(Subquery(slot_reminder.values('attempts')[:1]), 0))
+        .order_by('appointment_date', 'appointment_time', 'pk')
+        .values(
+            'pk', 'appointment_date', 'appointment_time', 'appointment_type', 'previous_attempts',
+            'patient__user__first_name', 'patient__user__last_name', 'patient__user__email',
+            'doctor__user__first_name', 'doctor__user__last_name',
+        )
+    )
+
+
+def render(template, row):
+    # Plain strings only: formatting dates in the template costs more than
+    # the rest of the render put together
+    day, at = row['appointment_date'], row['appointment_time']
+    context = {
+        'patient_name': f"{row['patient__user__first_name']} {row['patient__user__last_name']}".strip(),
+        'doctor_name': f"{row['doctor__user__first_name']} {row['doctor__user__last_name']}".strip(),
+        'appointment_type': APPOINTMENT_TYPES.get(row['appointment_type'], row['appointment_type']).lower(),
+        'date': f'{day:%A} {day.day} {day:%B %Y}',
+        'time': f'{at:%H:%M}',
+    }
+    subject = f'Reminder: your appointment on {day.day} {day:%b} at {at:%H:%M}'
+    return Reminder(row['pk'], row['patient__user__email'], subject, template.render(context))
+
+
+def deliver(backend, limiter, reminder):
+    """Send one reminder; returns its status and error text"""
+    if not reminder.recipient:
+        return 'skipped', 'Patient has no email address'
+    limiter.acquire()
+    try:
+        backend.send(reminder)
+    except Exception as exc:
+        logger.warning('Reminder for appointment #%s failed: %s', reminder.appointment_id, exc)
+        return 'failed', f'{type(exc).__name__}: {exc}'
+    return 'sent', ''
+
+
+def dispatch_reminders(backend=None, hours=24, now=None, workers=None, rate=None, batch_size=1000,
+                       max_attempts=None):
+    """
+    Remind patients of their appointments in the next ``hours`` hours.
+
+    ``now`` is a naive local datetime (default: the current time). Returns
+    a Counter of reminder statuses for this run.
+    """
+    backend = backend or get_backend()
+    start = now or timezone.localtime().replace(tzinfo=None)
+    max_attempts = max_attempts or getattr(settings, 'REMINDER_MAX_ATTEMPTS', 3)
+    limiter = RateLimiter(getattr(settings, 'REMINDER_RATE_LIMIT', 20) if rate is None else rate)
+    send = partial(deliver, backend, limiter)
+    template = get_template('emails/appointment_reminder.txt')
+    rows = due_reminders(start, start + timedelta(hours=hours), max_attempts).iterator(chunk_size=batch_size)
+    stats = Counter()
+    try:
+        with ThreadPoolExecutor(workers or getattr(settings, 'REMINDER_WORKERS', 8),
+                                thread_name_prefix='hospital-reminder') as pool:
+            while batch := list(islice(rows, batch_size)):
+                outcomes = pool.map(send, [render(template, row) for row in batch])
+                records = [
+                    AppointmentReminder(
+                        appointment_id=row['pk'], appointment_date=row['appointment_date'],
+                        appointment_time=row['appointment_time'], channel=backend.channel,
+                        status=status, attempts=row['previous_attempts'] + 1, last_error=error,
+                    )
+                    for row, (status, error) in zip(batch, outcomes)
+                ]
+                AppointmentReminder.objects.bulk_create(
+                    records,
+                    update_conflicts=True,
+                    unique_fields=['appointment', 'appointment_date', 'appointment_time'],
+                    update_fields=['channel', 'status', 'attempts', 'last_error', 'updated_at'],
+                )
+                stats.update(record.status for record in records)
+    finally:
+        backend.close()
+    return stats
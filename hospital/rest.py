@@ -0,0 +1,522 @@
+"""
+Versioned JSON API (``/api/v1/``) over doctors, patients, appointments and
+bills, for the kiosk and mobile clients.
+
+Rows are scoped the way the pages scope them: appointments and bills by
+``visible_to``, patients to admins and doctors, and doctors are public
+(available ones only, except to admins). A list takes:
+
+- ``?fields=id,status,doctor.name``: only those fields, and only their
+  columns are selected;
+- ``?include=doctor,patient``: related objects nested in each row (a
+  dotted field includes its object too). They are joined into the same
+  query, as ``select_related`` would, so a page is one query whatever it
+  includes; ``appointment.doctor`` reaches through two relations;
+- ``?limit=`` and ``?cursor=``: keyset pages. ``next`` carries the last
+  row's sort key, so a deep page costs what the first one does and rows
+  written meanwhile do not shift the pages;
+- filters named in each resource's ``filters``.
+
+Rows are read as tuples (``values_list``), never as model instances; each
+becomes one dict, and the page is encoded by orjson.
+
+``/api/v1/patients/<pk>/timeline/`` pages through a patient's timeline
+(``hospital.timeline``) with the same keyset cursors, for admins, doctors and
+the patient.
+
+Appointments are written in batches: POST a list of bookings, or PATCH a
+list of ``{"id": ..., field: value}`` changes. A batch is validated as
+the booking page validates (the form, the slot constraint and the overlap
+check), each item seeing the ones before it, and is saved in one
+transaction or not at all.
+
+Clients sign in with an API token (``Authorization: Bearer <key>``, from
+``create_api_token``) or with the site's session. Only token requests skip
+the CSRF check: a session-authenticated POST or PATCH needs the CSRF token,
+as a form would, since a browser sends the session cookie on any site's
+behalf but never the token.
+"""
+import base64
+import binascii
+import hashlib
+import secrets
+from collections import namedtuple
+from decimal import Decimal
+
+import orjson
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.forms import modelform_factory
+from django.http import HttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views import View
+
+from . import conflicts, metrics, tasks, timeline
+from .forms import AppointmentForm
+from .identity import get_user_context
+from .models import ApiToken, Appointment, Billing, Doctor, Patient
+
+# A field's columns, and the function building its value from them (None: the one column's value)
+Field = namedtuple('Field', 'columns build')
+
+
+def column(name):
+    return Field((name,), None)
+
+
+def full_name(first_name, last_name):
+    return f'{first_name} {last_name}'.strip()
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Resource:
+    """
+    How a model is exposed: its fields, the related resources it may
+    include (by the lookup that joins them), its sort order (ending in a
+    unique column) and its filters (query parameter to lookup).
+    """
+
+    def __init__(self, name, fields, ordering, filters=None, includes=None):
+        self.name = name
+        self.fields = {'id': column('id'), **fields}
+        self.ordering = ordering
+        self.filters = filters or {}
+        self.includes = includes or {}
+
+
+DOCTOR = Resource('doctor', {
+    'name': Field(('user__first_name', 'user__last_name'), full_name),
+    'specialization': column('specialization'),
+    'license_number': column('license_number'),
+    'experience_years': column('experience_years'),
+    'consultation_fee': column('consultation_fee'),
+    'available_from': column('available_from'),
+    'available_to': column('available_to'),
+    'is_available': column('is_available'),
+    'bio': column('bio'),
+    'qualifications': column('qualifications'),
+}, ordering=('id',), filters={'specialization': 'specialization'})
+
+PATIENT = Resource('patient', {
+    'patient_id': column('patient_id'),
+    'name': Field(('user__first_name', 'user__last_name'), full_name),
+    'email': column('user__email'),
+    'phone': column('user__userprofile__phone'),
+    'date_of_birth': column('date_of_birth'),
+    'gender': column('gender'),
+    'blood_group': column('blood_group'),
+    'emergency_contact': column('emergency_contact'),
+    'address': column('address'),
+    'medical_history': column('medical_history'),
+    'allergies': column('allergies'),
+}, ordering=('patient_id',), filters={'patient_id': 'patient_id'})
+
+BILL = Resource('bill', {
+    'appointment_id': column('appointment_id'),
+    'total_amount': column('total_amount'),
+    'discount_amount': column('discount_amount'),
+    'additional_charges': column('additional_charges'),
+    'payment_status': column('payment_status'),
+    'payment_method': column('payment_method'),
+    'payment_date': column('payment_date'),
+    'due_date': column('due_date'),
+    'notes': column('notes'),
+    'created_at': column('created_at'),
+}, ordering=('-created_at', '-id'), filters={'payment_status': 'payment_status'})
+
+APPOINTMENT = Resource('appointment', {
+    'doctor_id': column('doctor_id'),
+    'patient_id': column('patient_id'),
+    'appointment_date': column('appointment_date'),
+    'appointment_time': column('appointment_time'),
+    'appointment_type': column('appointment_type'),
+    'status': column('status'),
+    'reason': column('reason'),
+    'notes': column('notes'),
+    'created_at': column('created_at'),
+    'updated_at': column('updated_at'),
+}, ordering=('-appointment_date', '-appointment_time', '-id'), filters={
+    'status': 'status',
+    'doctor': 'doctor_id',
+    'patient': 'patient_id',
+    'date_from': 'appointment_date__gte',
+    'date_to': 'appointment_date__lte',
+}, includes={'doctor': ('doctor__', DOCTOR), 'patient': ('patient__', PATIENT), 'bill': ('billing__', BILL)})
+
+BILL.includes = {'appointment': ('appointment__', APPOINTMENT)}
+
+
+class Selection:
+    """The columns one request reads for a resource, and how each row becomes a dict"""
+
+    def __init__(self, resource, names, columns, prefix='', nullable=False):
+        self.parts = []
+        for name in ['id', *(name for name in names if name != 'id')]:
+            field = resource.fields[name]
+            start = len(columns)
+            columns.extend(prefix + lookup for lookup in field.columns)
+            self.parts.append((name, start, len(columns), field.build))
+        # A missing reverse relation (an appointment without a bill) reads as all NULLs
+        self.key = self.parts[0][1] if nullable else None
+        self.nested = []
+
+    def build(self, row):
+        if self.key is not None and row[self.key] is None:
+            return None
+        item = {}
+        for name, start, stop, build in self.parts:
+            item[name] = row[start] if build is None else build(*row[start:stop])
+        for name, selection in self.nested:
+            item[name] = selection.build(row)
+        return item
+
+
+def select(resource, fields=None, include=None):
+    """
+    (columns, selection) for the ``fields`` and ``include`` query
+    parameters; raises ApiError for names the resource does not have.
+    """
+    wanted = {}
+    for name in filter(None, (fields or '').split(',')):
+        path, _, field = name.rpartition('.')
+        wanted.setdefault(path, []).append(field)
+    paths = set()
+    for path in set(wanted) | set(filter(None, (include or '').split(','))):
+        while path:
+            paths.add(path)
+            path = path.rpartition('.')[0]
+    columns = []
+    root = Selection(resource, fields_of(resource, wanted.get('', ''), ''), columns)
+    selections = {'': (root, resource, '')}
+    for path in sorted(paths, key=lambda path: path.count('.')):
+        parent, _, name = path.rpartition('.')
+        if parent not in selections:
+            raise ApiError(400, f'Unknown include {path!r}.')
+        parent_selection, parent_resource, parent_prefix = selections[parent]
+        if name not in parent_resource.includes:
+            raise ApiError(400, f'Unknown include {path!r}.')
+        lookup, included = parent_resource.includes[name]
+        prefix = parent_prefix + lookup
+        selection = Selection(included, fields_of(included, wanted.get(path, ''), path), columns, prefix, nullable=True)
+        parent_selection.nested.append((name, selection))
+        selections[path] = (selection, included, prefix)
+    return columns, root
+
+
+def fields_of(resource, names, path):
+    if not names:
+        return list(resource.fields)
+    unknown = [name for name in names if name not in resource.fields]
+    if unknown:
+        raise ApiError(400, f"Unknown field {'.'.join(filter(None, (path, unknown[0])))!r}.")
+    return names
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(orjson.dumps(values, default=str)).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise ApiError(400, 'Invalid cursor.')
+
+
+def after(ordering, values):
+    """Rows sorting after ``values`` by ``ordering``, as one condition"""
+    condition, equal = Q(), {}
+    for term, value in zip(ordering, values):
+        name = term.lstrip('-')
+        condition |= Q(**equal, **{f"{name}__{'lt' if term.startswith('-') else 'gt'}": value})
+        equal[name] = value
+    return condition
+
+
+def scope(resource, user):
+    """The rows of ``resource`` ``user`` may read"""
+    role = get_user_context(user).role
+    if resource is DOCTOR:
+        doctors = Doctor.objects.all()
+        return doctors if role == 'admin' else doctors.filter(is_available=True)
+    if not user.is_authenticated:
+        raise ApiError(401, 'Sign in to use the API.')
+    if resource is PATIENT:
+        if role not in ('admin', 'doctor'):
+            raise ApiError(403, 'Only admins and doctors can read patient records.')
+        return Patient.objects.all()
+    model = Appointment if resource is APPOINTMENT else Billing
+    try:
+        return model.objects.visible_to(user)
+    except PermissionDenied as exc:
+        raise ApiError(403, str(exc))
+
+
+def encode_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError
+
+
+def json_response(payload, status=200):
+    return HttpResponse(orjson.dumps(payload, default=encode_default), status=status, content_type='application/json')
+
+
+def page_size(value):
+    default = getattr(settings, 'API_PAGE_SIZE', 50)
+    try:
+        size = int(value) if value else default
+    except ValueError:
+        raise ApiError(400, 'limit must be a number.')
+    return max(1, min(size, getattr(settings, 'API_MAX_PAGE_SIZE', 500)))
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def create_token(user, name=''):
+    """A new API token for ``user``; returns the key, which is not stored"""
+    key = secrets.token_urlsafe(32)
+    ApiToken.objects.create(user=user, name=name, key_hash=hash_key(key))
+    return key
+
+
+def token_user(request):
+    """The user of the request's bearer token, or None without one; raises ApiError for a bad one"""
+    scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    token = ApiToken.objects.select_related('user').filter(key_hash=hash_key(key.strip())).first()
+    if token is None or not token.user.is_active:
+        raise ApiError(401, 'Invalid API token.')
+    return token.user
+
+
+def check_csrf(request):
+    """Raise ApiError unless the request passes the CSRF check the middleware would make"""
+    middleware = CsrfViewMiddleware(lambda request: None)
+    middleware.process_request(request)
+    if middleware.process_view(request, None, (), {}) is not None:
+        raise ApiError(403, 'CSRF check failed: send the CSRF token, or use an API token.')
+
+
+# Exempt from the middleware's check; dispatch() makes it for session requests
+@method_decorator(csrf_exempt, name='dispatch')
+class ResourceView(View):
+    """A resource's list (GET) or one of its rows (GET with a pk)"""
+    resource = None
+    use_replica = True
+    http_method_names = ['get', 'head', 'options']
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            user = token_user(request)
+            if user is None:
+                check_csrf(request)
+            else:
+                request.user = user
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as exc:
+            return json_response({'error': str(exc)}, status=exc.status)
+
+    def get(self, request, pk=None):
+        columns, selection = select(self.resource, request.GET.get('fields'), request.GET.get('include'))
+        queryset = scope(self.resource, request.user)
+        if pk is not None:
+            row = queryset.filter(pk=pk).values_list(*columns).first()
+            if row is None:
+                raise ApiError(404, 'Not found.')
+            return json_response({'data': selection.build(row)})
+        return self.list(queryset, columns, selection)
+
+    def list(self, queryset, columns, selection):
+        params = self.request.GET
+        limit = page_size(params.get('limit'))
+        ordering = self.resource.ordering
+        keys = [term.lstrip('-') for term in ordering]
+        try:
+            queryset = queryset.filter(**{
+                lookup: params[name] for name, lookup in self.resource.filters.items() if params.get(name)
+            })
+            if params.get('cursor'):
+                queryset = queryset.filter(after(ordering, decode_cursor(params['cursor'])))
+            rows = list(queryset.order_by(*ordering).values_list(*columns, *keys)[:limit + 1])
+        except (ValidationError, ValueError, TypeError):
+            raise ApiError(400, 'Invalid filter or cursor.')
+        following = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            query = params.copy()
+            query['cursor'] = encode_cursor(rows[-1][len(columns):])
+            following = f'{self.request.path}?{query.urlencode()}'
+        return json_response({'data': [selection.build(row) for row in rows], 'next': following})
+
+
+class DoctorApiView(ResourceView):
+    resource = DOCTOR
+
+
+class PatientApiView(ResourceView):
+    resource = PATIENT
+
+
+class BillApiView(ResourceView):
+    resource = BILL
+
+
+class AppointmentApiView(ResourceView):
+    """Appointments; POST books a batch, PATCH changes a batch"""
+    resource = APPOINTMENT
+    http_method_names = ['get', 'head', 'options', 'post', 'patch']
+    # Fields each role may change through PATCH
+    UPDATABLE = {
+        'admin': {'appointment_date', 'appointment_time', 'appointment_type', 'status', 'reason', 'notes'},
+        'doctor': {'status', 'notes'},
+        'patient': {'status'},
+    }
+
+    def post(self, request):
+        current = get_user_context(request.user)
+        if current.role != 'admin' and current.patient_id is None:
+            raise ApiError(403, 'Only patients and admins can book appointments.')
+        items = self.batch()
+        with transaction.atomic():
+            saved, errors = [], []
+            for index, item in enumerate(items):
+                data = dict(item)
+                # Admins book for any patient; patients for themselves
+                patient_id = data.pop('patient', None) if current.role == 'admin' else current.patient_id
+                if not isinstance(patient_id, int) or not Patient.objects.filter(pk=patient_id).exists():
+                    errors.append({'index': index, 'errors': {'patient': ['Choose an existing patient.']}})
+                    continue
+                form = AppointmentForm(data=data)
+                form.instance.patient_id = patient_id
+                self.save(form, index, saved, errors)
+            if errors:
+                transaction.set_rollback(True)
+                return json_response({'errors': errors}, status=400)
+        for pk in saved:
+            tasks.send_appointment_confirmation.delay(appointment_id=pk)
+        metrics.BOOKINGS.inc(len(saved), source='api')
+        return self.saved(saved, status=201)
+
+    def patch(self, request):
+        current = get_user_context(request.user)
+        items = self.batch()
+        allowed = self.UPDATABLE.get(current.role, set())
+        with transaction.atomic():
+            ids = [item.get('id') for item in items]
+            try:
+                appointments = scope(APPOINTMENT, request.user).select_for_update().in_bulk(
+                    [pk for pk in ids if isinstance(pk, int)]
+                )
+            except PermissionDenied as exc:
+                raise ApiError(403, str(exc))
+            saved, errors = [], []
+            for index, item in enumerate(items):
+                changes = {name: value for name, value in item.items() if name != 'id'}
+                appointment = appointments.get(item.get('id'))
+                refused = sorted(set(changes) - allowed)
+                if appointment is None:
+                    errors.append({'index': index, 'errors': {'id': ['Not found.']}})
+                elif refused or not changes:
+                    errors.append({'index': index, 'errors': {
+                        name: ['You cannot change this field.'] for name in refused or ['id']
+                    }})
+                elif current.role == 'patient' and changes.get('status') != 'cancelled':
+                    errors.append({'index': index, 'errors': {'status': ['Patients can only cancel.']}})
+                else:
+                    form_class = modelform_factory(Appointment, fields=sorted(changes))
+                    self.save(form_class(data=changes, instance=appointment), index, saved, errors)
+            if errors:
+                transaction.set_rollback(True)
+                return json_response({'errors': errors}, status=400)
+        return self.saved(saved)
+
+    def batch(self):
+        """The request body's list of objects"""
+        try:
+            items = orjson.loads(self.request.body)
+        except orjson.JSONDecodeError:
+            raise ApiError(400, 'The body must be JSON.')
+        if isinstance(items, dict):
+            items = [items]
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ApiError(400, 'Send an object or a list of objects.')
+        limit = getattr(settings, 'API_BATCH_LIMIT', 100)
+        if not 0 < len(items) <= limit:
+            raise ApiError(400, f'A batch holds 1 to {limit} items.')
+        return items
+
+    def save(self, form, index, saved, errors):
+        """Save a valid booking that overlaps nothing, or add its errors"""
+        if form.is_valid():
+            instance = form.instance
+            # post() and patch() hold the transaction until every item is saved
+            if instance.status != 'cancelled':
+                conflicts.lock_doctor(instance.doctor_id)
+            clashes = [] if instance.status == 'cancelled' else conflicts.overlapping(
+                instance.appointment_date, instance.appointment_time, instance.appointment_type,
+                doctor_id=instance.doctor_id, exclude_pk=instance.pk,
+            )
+            if clashes:
+                metrics.BOOKING_CONFLICTS.inc(reason='overlap')
+                form.add_error(None, f'This time overlaps a booking from {clashes[0].start:%H:%M} '
+                                     f'to {clashes[0].end:%H:%M}.')
+            else:
+                saved.append(form.save().pk)
+                return
+        errors.append({'index': index, 'errors': {name: list(messages) for name, messages in form.errors.items()}})
+
+    def saved(self, pks, status=200):
+        """The saved rows, in the order they were sent, with the request's fields and includes"""
+        columns, selection = select(APPOINTMENT, self.request.GET.get('fields'), self.request.GET.get('include'))
+        rows = {row[0]: row for row in Appointment.objects.filter(pk__in=pks).values_list(*columns)}
+        return json_response({'data': [selection.build(rows[pk]) for pk in pks]}, status=status)
+
+
+def timeline_page(patient_id, cursor=None, limit=None):
+    """``(entries, next_cursor)`` of a patient's timeline; raises ApiError for a bad cursor"""
+    try:
+        entries, more = timeline.page(patient_id, decode_cursor(cursor) if cursor else None, limit)
+    except (ValidationError, ValueError, TypeError):
+        raise ApiError(400, 'Invalid cursor.')
+    return entries, encode_cursor([entries[-1].occurred_at, entries[-1].pk]) if more else None
+
+
+class TimelineApiView(ResourceView):
+    """A patient's timeline, newest first (``?limit=``, ``?cursor=``)"""
+
+    def get(self, request, pk):
+        if not request.user.is_authenticated:
+            raise ApiError(401, 'Sign in to use the API.')
+        if not timeline.can_read(request.user, pk):
+            raise ApiError(403, "Only admins, doctors and the patient can read a patient's timeline.")
+        entries, cursor = timeline_page(pk, request.GET.get('cursor'), page_size(request.GET.get('limit')))
+        following = None
+        if cursor:
+            query = request.GET.copy()
+            query['cursor'] = cursor
+            following = f'{request.path}?{query.urlencode()}'
+        return json_response({'data': [{
+            'id': entry.pk, 'kind': entry.kind, 'occurred_at': entry.occurred_at, 'title': entry.title,
+            'detail': entry.detail, 'data': entry.data,
+        } for entry in entries], 'next': following})
+
+
+def api_root(request):
+    """Where each resource lives"""
+    return json_response({name: request.build_absolute_uri(reverse(f'api_v1_{name}')) for name in (
+        'doctors', 'patients', 'appointments', 'bills',
+    )})
@@ -0,0 +1,117 @@
+"""
+Archive and read-replica routing.
+
+Archived appointments and bills live in the ``archive`` alias when one is
+configured (``DATABASE_ARCHIVE_URL``), and in ``default`` otherwise.
+
+Reads go to the ``replica`` alias only while a request explicitly allows
+it (see ``ReplicaRoutingMiddleware`` and ``ReplicaReadMixin``) and the
+user has not written recently. Everything else, including every write
+and any read that follows a write in the same request, uses ``default``.
+
+The per-request state lives in a context variable so it is correct under
+both threaded WSGI workers and ASGI.
+"""
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+ARCHIVE_DB_ALIAS = 'archive'
+ARCHIVE_MODELS = {'archivedappointment', 'archivedbilling'}
+
+# Apps whose reads must never lag behind a write (e.g. a fresh login)
+PRIMARY_ONLY_APPS = {'sessions'}
+
+
+@dataclass
+class RoutingState:
+    replica_allowed: bool = False
+    wrote: bool = False
+
+
+_state = ContextVar('hospital_db_routing', default=None)
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in connections.settings
+
+
+def archive_configured():
+    return ARCHIVE_DB_ALIAS in connections.settings
+
+
+def archive_db():
+    """The alias holding the archive tables"""
+    return ARCHIVE_DB_ALIAS if archive_configured() else DEFAULT_DB_ALIAS
+
+
+def begin_request():
+    """Start routing for a request; returns a token for ``end_request``"""
+    return _state.set(RoutingState())
+
+
+def end_request(token):
+    _state.reset(token)
+
+
+def allow_replica():
+    """Let the current request read from the replica until it writes"""
+    state = _state.get()
+    if state is not None:
+        state.replica_allowed = True
+
+
+def wrote_primary():
+    state = _state.get()
+    return state is not None and state.wrote
+
+
+class ReplicaRouter:
+    """Send reads to the replica when the current request permits it"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        state = _state.get()
+        if state and state.replica_allowed and not state.wrote and replica_configured():
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+
+class ArchiveRouter:
+    """Keep the archive tables, and only those, in the archive database"""
+
+    def is_archived(self, model):
+        return model._meta.app_label == 'hospital' and model._meta.model_name in ARCHIVE_MODELS
+
+    def db_for_read(self, model, **hints):
+        return archive_db() if self.is_archived(model) else None
+
+    def db_for_write(self, model, **hints):
+        return archive_db() if self.is_archived(model) else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if self.is_archived(type(obj1)) or self.is_archived(type(obj2)):
+            return self.is_archived(type(obj1)) and self.is_archived(type(obj2))
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not archive_configured():
+            return None
+        if db == ARCHIVE_DB_ALIAS:
+            return app_label == 'hospital' and model_name in ARCHIVE_MODELS
+        if app_label == 'hospital' and model_name in ARCHIVE_MODELS:
+            return False
+        return None
@@ -0,0 +1,227 @@
+"""
+Doctors' day and week timelines.
+
+A day's timeline lists the doctor's bookings alongside the free slots of
+``SCHEDULE_SLOT_MINUTES`` between ``available_from`` and ``available_to``,
+and the gaps (runs of consecutive free slots) between bookings. A booking
+lasts as long as its type (``APPOINTMENT_DURATIONS``) and takes every slot
+it overlaps. Cancelled appointments free their slot.
+
+Each doctor-day is cached. A week is one ``get_many`` and, for the days
+that missed, one range query over the doctor/date index, however many
+days missed. Appointment signals drop the affected days; changes to a
+doctor or user expire them with the rest of ``hospital.caching``, in
+whose shared cache they live.
+
+The timelines are always built from the primary database: caching a
+lagging replica's view would keep it stale long after replication
+caught up.
+"""
+from dataclasses import dataclass
+from datetime import date, time, timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import FilteredRelation, Q
+
+from . import caching, metrics
+from .caching import cache
+from .models import Appointment, Doctor
+
+SCHEDULE_CACHE_TIMEOUT = 60 * 60
+STATUS_LABELS = dict(Appointment.STATUS_CHOICES)
+
+# Minutes per appointment type, unless overridden by APPOINTMENT_DURATIONS
+DEFAULT_DURATIONS = {
+    'consultation': 30,
+    'follow_up': 15,
+    'emergency': 45,
+    'routine': 20,
+}
+
+
+def slot_minutes():
+    return getattr(settings, 'SCHEDULE_SLOT_MINUTES', 30)
+
+
+def appointment_durations():
+    return {**DEFAULT_DURATIONS, **getattr(settings, 'APPOINTMENT_DURATIONS', {})}
+
+
+def appointment_minutes(appointment_type):
+    """How long an appointment of ``appointment_type`` takes"""
+    return appointment_durations().get(appointment_type, slot_minutes())
+
+
+def to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def to_time(minutes):
+    return time(min(minutes, 24 * 60 - 1) // 60, min(minutes, 24 * 60 - 1) % 60)
+
+
+@dataclass(frozen=True)
+class Booking:
+    appointment_id: int
+    start: time
+    end: time
+    patient_name: str
+    appointment_type: str
+    status: str
+    reason: str
+
+    @property
+    def status_display(self):
+        return STATUS_LABELS.get(self.status, self.status)
+
+
+@dataclass(frozen=True)
+class Slot:
+    """A stretch of the day: a booking, or a free slot when ``booking`` is None"""
+    start: time
+    end: time
+    booking: Optional[Booking] = None
+
+    @property
+    def is_free(self):
+        return self.booking is None
+
+
+@dataclass(frozen=True)
+class Gap:
+    """Consecutive free slots between bookings"""
+    start: time
+    end: time
+
+    @property
+    def minutes(self):
+        return to_minutes(self.end) - to_minutes(self.start)
+
+
+@dataclass(frozen=True)
+class DaySchedule:
+    day: date
+    timeline: Tuple[Slot, ...]
+    gaps: Tuple[Gap, ...]
+
+    @property
+    def bookings(self):
+        return [slot.booking for slot in self.timeline if slot.booking]
+
+    @property
+    def free_slots(self):
+        return [slot for slot in self.timeline if slot.is_free]
+
+    @property
+    def is_today(self):
+        return self.day == date.today()
+
+
+def build_day(day, available_from, available_to, bookings, working=True):
+    """Lay ``bookings`` (sorted by start) over the day's grid of slots"""
+    length = slot_minutes()
+    booked = [(to_minutes(b.start), to_minutes(b.end)) for b in bookings]
+    free = []
+    if working:
+        start, closing = to_minutes(available_from), to_minutes(available_to)
+        while start + length <= closing:
+            end = start + length
+            if not any(b_start < end and b_end > start for b_start, b_end in booked):
+                free.append(Slot(to_time(start), to_time(end)))
+            start = end
+    timeline = sorted(
+        [Slot(b.start, b.end, b) for b in bookings] + free,
+        key=lambda slot: (slot.start, slot.booking is None),
+    )
+    gaps = []
+    for slot in free:
+        if gaps and gaps[-1].end == slot.start:
+            gaps[-1] = Gap(gaps[-1].start, slot.end)
+        else:
+            gaps.append(Gap(slot.start, slot.end))
+    return DaySchedule(day, tuple(timeline), tuple(gaps))
+
+
+def schedule_key(doctor_id, day):
+    return caching.cache_key('schedule', f'{doctor_id}:{day.isoformat()}')
+
+
+def invalidate(doctor_id, *days):
+    """Drop the cached timelines of ``doctor_id`` on ``days``"""
+    if days:
+        cache.delete_many([schedule_key(doctor_id, day) for day in set(days)])
+
+
+def load_days(doctor_id, days):
+    """Build the timelines of ``days`` from the database in a single query"""
+    # Joined from the doctor, so their hours come back even with no bookings
+    booked = FilteredRelation('appointment', condition=Q(
+        appointment__appointment_date__range=(min(days), max(days)),
+    ) & ~Q(appointment__status='cancelled'))
+    # Never the replica, even in a view that allows it (see the module docstring)
+    rows = list(
+        Doctor.objects.using(DEFAULT_DB_ALIAS).filter(pk=doctor_id)
+        .annotate(booked=booked)
+        .order_by('booked__appointment_date', 'booked__appointment_time')
+        .values(
+            'available_from', 'available_to', 'is_available',
+            'booked__pk', 'booked__appointment_date', 'booked__appointment_time', 'booked__appointment_type',
+            'booked__status', 'booked__reason', 'booked__patient__user__first_name',
+            'booked__patient__user__last_name',
+        )
+    )
+    if not rows:
+        raise Doctor.DoesNotExist(f'No doctor with id {doctor_id}')
+    by_day = {day: [] for day in days}
+    durations = appointment_durations()
+    for row in rows:
+        if row['booked__appointment_date'] not in by_day:
+            continue
+        start = row['booked__appointment_time']
+        by_day[row['booked__appointment_date']].append(Booking(
+            appointment_id=row['booked__pk'],
+            start=start,
+            end=to_time(to_minutes(start) + durations.get(row['booked__appointment_type'], slot_minutes())),
+            patient_name=f"{row['booked__patient__user__first_name']} {row['booked__patient__user__last_name']}".strip(),
+            appointment_type=row['booked__appointment_type'],
+            status=row['booked__status'],
+            reason=row['booked__reason'],
+        ))
+    hours = rows[0]
+    return {
+        day: build_day(day, hours['available_from'], hours['available_to'], bookings, hours['is_available'])
+        for day, bookings in by_day.items()
+    }
+
+
+def doctor_schedule(doctor_id, days):
+    """The timelines of ``days`` for ``doctor_id``, from the cache where possible"""
+    keys = {schedule_key(doctor_id, day): day for day in days}
+    cached = cache.get_many(keys)
+    schedules = {keys[key]: schedule for key, schedule in cached.items()}
+    missing = [day for day in days if day not in schedules]
+    metrics.cache_lookups('schedule', len(schedules), len(missing))
+    if missing:
+        loaded = load_days(doctor_id, missing)
+        cache.set_many(
+            {schedule_key(doctor_id, day): schedule for day, schedule in loaded.items()},
+            SCHEDULE_CACHE_TIMEOUT,
+        )
+        schedules.update(loaded)
+    return [schedules[day] for day in days]
+
+
+def day_schedule(doctor_id, day):
+    return doctor_schedule(doctor_id, [day])[0]
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def week_schedule(doctor_id, day):
+    """The Monday-to-Sunday timelines of the week containing ``day``"""
+    monday = week_start(day)
+    return doctor_schedule(doctor_id, [monday + timedelta(days=offset) for offset in range(7)])
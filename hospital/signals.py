@@ -0,0 +1,155 @@
+"""
+Cache invalidation for the JSON detail payloads in ``hospital.api`` and
+the per-session user contexts in ``hospital.identity``.
+
+Direct edits drop the affected object's payload; doctor and user changes
+expire the whole generation. Anything that can change a user's role or
+Doctor/Patient PK makes their stored context stale.
+
+Appointment changes also drop the doctor's cached timeline for the
+appointment's day, and for its old day when it moved
+(``hospital.schedule``). Completing an appointment queues its bill
+(``tasks.generate_bill``). Cancelling, moving or deleting a booking offers
+the slot it vacated to the doctor's waitlist once the transaction commits
+(``hospital.waitlist``).
+
+Appointment and bill writes are added to the change feed the live
+dashboards stream (``hospital.feed``), in the same transaction. They and
+changes to patient records also update the patients' timelines
+(``hospital.timeline``).
+
+Every change also moves on the version stamps of the pages that show it
+(``hospital.conditional``), so their ETags change.
+"""
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching, conditional, feed, identity, schedule, tasks, timeline, waitlist
+from .models import Appointment, Billing, Doctor, Patient, UserProfile
+
+
+@receiver([post_save, post_delete], sender=Billing)
+def billing_changed(sender, instance, created=False, **kwargs):
+    caching.invalidate('bill', instance.pk)
+    conditional.bump('bill')
+    if Billing.appointment.is_cached(instance):
+        parties = (instance.appointment.doctor_id, instance.appointment.patient_id)
+    else:
+        parties = Appointment.objects.filter(pk=instance.appointment_id).values_list('doctor_id', 'patient_id').first()
+    if parties:
+        feed.record(
+            'bill', instance, feed_action(created, kwargs['signal']), *parties,
+            status=instance.payment_status, amount=str(instance.total_amount),
+        )
+    if kwargs['signal'] is post_delete:
+        timeline.forget(f'bill:{instance.pk}')
+    elif parties:
+        timeline.bill_saved(instance, parties[1])
+
+
+def feed_action(created, signal):
+    if signal is post_delete:
+        return 'deleted'
+    return 'created' if created else 'updated'
+
+
+@receiver(pre_save, sender=Appointment)
+def appointment_moving(sender, instance, **kwargs):
+    instance._previous_slot = None
+    if instance.pk:
+        instance._previous_slot = Appointment.objects.filter(pk=instance.pk).values_list(
+            'doctor_id', 'appointment_date', 'appointment_time', 'status'
+        ).first()
+
+
+def vacated_slot(instance, signal):
+    """The (doctor_id, date, time) this change freed up, if any"""
+    if signal is post_delete:
+        if instance.status != 'cancelled':
+            return instance.doctor_id, instance.appointment_date, instance.appointment_time
+        return None
+    previous = getattr(instance, '_previous_slot', None)
+    if not previous or previous[3] == 'cancelled':
+        return None
+    slot = (instance.doctor_id, instance.appointment_date, instance.appointment_time)
+    if instance.status == 'cancelled' or previous[:3] != slot:
+        return previous[:3]
+    return None
+
+
+@receiver([post_save, post_delete], sender=Appointment)
+def appointment_changed(sender, instance, created=False, **kwargs):
+    caching.invalidate('appointment', instance.pk)
+    feed.record(
+        'appointment', instance, feed_action(created, kwargs['signal']), instance.doctor_id, instance.patient_id,
+        date=str(instance.appointment_date), time=str(instance.appointment_time)[:5], status=instance.status,
+    )
+    schedule.invalidate(instance.doctor_id, instance.appointment_date)
+    previous = getattr(instance, '_previous_slot', None)
+    if previous and previous[:2] != (instance.doctor_id, instance.appointment_date):
+        schedule.invalidate(*previous[:2])
+    vacated = vacated_slot(instance, kwargs['signal'])
+    if vacated:
+        transaction.on_commit(partial(waitlist.offer_slot, *vacated))
+    if kwargs['signal'] is post_delete:
+        timeline.forget(f'appointment:{instance.pk}', f'note:{instance.pk}')
+        # Its bill was deleted first and dropped its own payload
+        return
+    timeline.appointment_saved(instance)
+    bill_ids = list(Billing.objects.filter(appointment_id=instance.pk).values_list('pk', flat=True))
+    caching.invalidate('bill', *bill_ids)
+    if bill_ids:
+        conditional.bump('bill')
+    if instance.status == 'completed' and not bill_ids:
+        tasks.generate_bill.delay(appointment_id=instance.pk)
+
+
+@receiver(pre_save, sender=Patient)
+def patient_editing(sender, instance, **kwargs):
+    instance._previous_record = timeline.record_before(instance)
+
+
+@receiver([post_save, post_delete], sender=Patient)
+def patient_changed(sender, instance, created=False, **kwargs):
+    caching.invalidate('patient', instance.pk)
+    conditional.bump('patient')
+    if created or kwargs['signal'] is post_delete:
+        identity.invalidate(instance.user_id)
+    if kwargs['signal'] is post_save:
+        timeline.patient_saved(instance, created, getattr(instance, '_previous_record', None))
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    identity.invalidate(instance.user_id)
+    conditional.bump('patient')
+    patient_ids = Patient.objects.filter(user_id=instance.user_id).values_list('pk', flat=True)
+    caching.invalidate('patient', *patient_ids)
+
+
+@receiver(post_save, sender=Doctor)
+def doctor_changed(sender, instance, created, **kwargs):
+    conditional.bump('doctor')
+    if created:
+        identity.invalidate(instance.user_id)
+    else:
+        caching.invalidate_all()
+
+
+@receiver(post_delete, sender=Doctor)
+def doctor_deleted(sender, instance, **kwargs):
+    identity.invalidate(instance.user_id)
+    conditional.bump('doctor')
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login; they must not flush the cache
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    caching.invalidate_all()
+    conditional.bump('user')
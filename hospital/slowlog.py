@@ -0,0 +1,174 @@
+"""
+Structured log of slow SQL statements.
+
+An execute wrapper on every connection times each statement. One slower
+than ``SLOW_QUERY_MS`` is logged to the ``hospital.slowlog`` logger as a
+single JSON line with:
+
+- the fingerprint (``hospital.profiling.fingerprint``), SQL and parameters;
+- the duration and database alias;
+- the request's path and resolved view, the first project line on the
+  stack (the ORM call that ran it) and the template line being rendered,
+  if any;
+- the plan: ``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` (without
+  ``ANALYZE``, so nothing runs twice) on PostgreSQL.
+
+``SlowQueryMiddleware`` (``hospital.middleware``) makes the request known
+to queries that run off its stack too, such as ``gather_queries``'s
+threads. ``settings.LOGGING`` sends the logger to ``SLOW_QUERY_LOG``, and
+``python manage.py slow_query_report`` aggregates that file into the
+statements that cost the most.
+"""
+import json
+import logging
+import sys
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.views import View
+
+from .profiling import fingerprint
+
+logger = logging.getLogger(__name__)
+
+MAX_SQL_LENGTH = 4000
+MAX_PARAMS = 50
+MAX_PARAM_LENGTH = 200
+EXPLAINED = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+_explaining = ContextVar('hospital_slowlog_explaining', default=False)
+_request = ContextVar('hospital_slowlog_request', default=None)
+# Files that only pass queries through; the caller is the code that called them
+PASSTHROUGH = {__file__, str(Path(__file__).with_name('async_utils.py'))}
+
+
+def threshold_ms():
+    return float(getattr(settings, 'SLOW_QUERY_MS', 0) or 0)
+
+
+def log_slow_query(execute, sql, params, many, context):
+    """Execute wrapper: time the statement and log it if it was slow"""
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - started) * 1000
+    threshold = threshold_ms()
+    if threshold and duration_ms >= threshold and not _explaining.get():
+        logger.info(json.dumps(entry(sql, params, many, duration_ms, context['connection']), default=str))
+    return result
+
+
+def instrument(connection, **kwargs):
+    if log_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_query)
+
+
+def install():
+    """Time statements on every connection, in requests, commands and workers alike"""
+    connection_created.connect(instrument, dispatch_uid='hospital.slowlog')
+    for alias in connections:
+        instrument(connections[alias])
+
+
+def begin_request(request):
+    return _request.set(request)
+
+
+def end_request(token):
+    _request.reset(token)
+
+
+def entry(sql, params, many, duration_ms, connection):
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'duration_ms': round(duration_ms, 2),
+        'alias': connection.alias,
+        'fingerprint': fingerprint(sql),
+        'sql': sql[:MAX_SQL_LENGTH],
+        'params': loggable_params(params, many),
+        **origin(_request.get()),
+        'plan': [] if many else explain(connection, sql, params),
+    }
+
+
+def loggable_params(params, many):
+    if params is None:
+        return None
+    if many:
+        params = list(params)
+        return {'rows': len(params), 'first': loggable_params(params[0], False) if params else None}
+    if isinstance(params, dict):
+        return {key: truncate(value) for key, value in list(params.items())[:MAX_PARAMS]}
+    return [truncate(value) for value in list(params)[:MAX_PARAMS]]
+
+
+def truncate(value):
+    if isinstance(value, (str, bytes)) and len(value) > MAX_PARAM_LENGTH:
+        return f'{value[:MAX_PARAM_LENGTH]!s}...'
+    return value
+
+
+def origin(request=None):
+    """The request, view, project code line and template line that ran the current statement"""
+    project = str(Path(settings.BASE_DIR))
+    found = {'path': None, 'view': None, 'caller': None, 'template': None}
+    if request is not None:
+        found['path'] = f'{request.method} {request.path}'
+        match = request.resolver_match
+        if match is not None:
+            found['view'] = getattr(match.func, 'view_class', match.func).__name__
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        filename = code.co_filename
+        if found['template'] is None and code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            template, token = getattr(node, 'origin', None), getattr(node, 'token', None)
+            if template is not None and token is not None:
+                found['template'] = f'{template.template_name}:{token.lineno}'
+        if (found['caller'] is None and filename.startswith(project) and filename not in PASSTHROUGH
+                and 'site-packages' not in filename):
+            found['caller'] = f'{Path(filename).relative_to(project)}:{frame.f_lineno} in {code.co_name}'
+        if found['view'] is None and isinstance(frame.f_locals.get('self'), View):
+            found['view'] = type(frame.f_locals['self']).__name__
+        frame = frame.f_back
+    return found
+
+
+def explain(connection, sql, params):
+    """The statement's plan as lines of text, or an empty list when it has none"""
+    words = sql.split(None, 1)
+    if not words or words[0].upper() not in EXPLAINED:
+        return []
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN '
+    else:
+        return []
+    token = _explaining.set(True)
+    # In a transaction, a savepoint keeps a failed EXPLAIN from aborting it;
+    # outside one the EXPLAIN runs in autocommit and needs no transaction
+    guard = transaction.atomic(using=connection.alias) if connection.in_atomic_block else nullcontext()
+    try:
+        with guard, connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as exc:
+        return [f'EXPLAIN failed: {exc}']
+    finally:
+        _explaining.reset(token)
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail): indent each step under its parent
+        depth = {0: -1}
+        lines = []
+        for step, parent, _, detail in rows:
+            depth[step] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[step] + detail)
+        return lines
+    return [line for line, in rows]
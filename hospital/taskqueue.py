@@ -0,0 +1,223 @@
+"""
+A small database-backed task queue.
+
+Functions decorated with ``@task`` are queued with ``func.delay(**kwargs)``
+(keyword arguments must be JSON-serialisable) and run by
+``manage.py run_tasks`` on a thread or process pool. The ``Task`` row is
+written in the caller's transaction, so a task is only ever picked up if
+the change that queued it committed.
+
+Workers claim due tasks with a conditional UPDATE, so several workers can
+share one database. A failed task is retried with exponential backoff
+until ``max_attempts`` is reached. While a task runs its worker renews
+the task's ``locked_at`` every third of the visibility timeout, so a
+task whose worker died is requeued once its lock is older than that
+timeout, however long a live task takes.
+"""
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import partial
+
+import django
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    """Register ``func`` as a task and give it a ``delay()`` method"""
+    if func is None:
+        return partial(task, name=name, max_attempts=max_attempts)
+    task_name = name or f'{func.__module__}.{func.__name__}'
+    REGISTRY[task_name] = func
+    func.task_name = task_name
+    func.delay = partial(enqueue, task_name, max_attempts=max_attempts)
+    return func
+
+
+def enqueue(name, *, countdown=0, max_attempts=None, **kwargs):
+    """Queue the task ``name`` to run with ``kwargs`` in ``countdown`` seconds"""
+    return Task.objects.create(
+        name=name,
+        kwargs=kwargs,
+        max_attempts=max_attempts or getattr(settings, 'TASK_MAX_ATTEMPTS', 5),
+        run_at=timezone.now() + timedelta(seconds=countdown),
+    )
+
+
+def retry_delay(attempts):
+    """Seconds before retry number ``attempts``: doubling, capped, with jitter"""
+    base = getattr(settings, 'TASK_RETRY_BACKOFF', 10)
+    ceiling = getattr(settings, 'TASK_RETRY_BACKOFF_MAX', 3600)
+    return min(ceiling, base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+def claim(worker_id, limit):
+    """Mark up to ``limit`` due tasks as running for this worker and return them"""
+    now = timezone.now()
+    with transaction.atomic():
+        due = Task.objects.filter(status='queued', run_at__lte=now).order_by('run_at')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        # The status guard keeps two workers from claiming the same row
+        Task.objects.filter(pk__in=ids, status='queued').update(
+            status='running', locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+        )
+    return list(Task.objects.filter(pk__in=ids, status='running', locked_by=worker_id, locked_at=now))
+
+
+def heartbeat(worker_id, task_ids):
+    """Renew the locks on the tasks this worker is still running"""
+    return Task.objects.filter(pk__in=list(task_ids), status='running', locked_by=worker_id).update(
+        locked_at=timezone.now(),
+    )
+
+
+def requeue_stale(timeout):
+    """Put back tasks whose worker stopped reporting for ``timeout`` seconds"""
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return Task.objects.filter(status='running', locked_at__lt=cutoff).update(
+        status='queued', locked_by='', locked_at=None,
+    )
+
+
+def execute(task_id):
+    """Run one claimed task and record the outcome; returns True on success"""
+    close_old_connections()
+    try:
+        task = Task.objects.get(pk=task_id)
+        try:
+            func = REGISTRY.get(task.name) or discover(task.name)
+            if func is None:
+                raise LookupError(f'No task registered as {task.name!r}')
+            func(**task.kwargs)
+        except Exception:
+            record_failure(task, traceback.format_exc())
+            return False
+        Task.objects.filter(pk=task.pk).update(
+            status='done', finished_at=timezone.now(), locked_by='', last_error='',
+        )
+        return True
+    finally:
+        close_old_connections()
+
+
+def record_failure(task, error):
+    if task.attempts >= task.max_attempts:
+        logger.error('Task %s failed permanently after %d attempts', task, task.attempts)
+        updates = {'status': 'failed', 'finished_at': timezone.now()}
+    else:
+        delay = retry_delay(task.attempts)
+        logger.warning('Task %s failed, retrying in %.0fs', task, delay)
+        updates = {'status': 'queued', 'run_at': timezone.now() + timedelta(seconds=delay)}
+    Task.objects.filter(pk=task.pk).update(locked_by='', locked_at=None, last_error=error[-10000:], **updates)
+
+
+def discover(name):
+    """Import every app's ``tasks`` module and look ``name`` up again"""
+    autodiscover_modules('tasks')
+    return REGISTRY.get(name)
+
+
+class Worker:
+    """Claims due tasks and runs them on a thread or process pool"""
+
+    def __init__(self, pool='thread', concurrency=4, poll_interval=1.0, visibility_timeout=300):
+        if pool not in ('thread', 'process'):
+            raise ValueError(f'pool must be "thread" or "process", not {pool!r}')
+        self.pool = pool
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+        self.stopping = threading.Event()
+        # Futures of the tasks in flight, to their Task pks
+        self.running = {}
+        self.last_heartbeat = 0.0
+        self.processed = 0
+        self.failed = 0
+
+    def make_executor(self):
+        if self.pool == 'process':
+            # Spawned, not forked, so children never share the parent's
+            # database connections
+            return ProcessPoolExecutor(
+                self.concurrency, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+            )
+        return ThreadPoolExecutor(self.concurrency, thread_name_prefix='hospital-task')
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def run(self, once=False):
+        """
+        Process tasks until stopped; with ``once``, until nothing is due.
+
+        In-flight tasks are always allowed to finish before returning.
+        """
+        autodiscover_modules('tasks')
+        self.last_heartbeat = time.monotonic()
+        with self.make_executor() as executor:
+            while not self.stopping.is_set():
+                requeue_stale(self.visibility_timeout)
+                free = self.concurrency - len(self.running)
+                claimed = claim(self.worker_id, free) if free else []
+                for claimed_task in claimed:
+                    self.running[executor.submit(execute, claimed_task.pk)] = claimed_task.pk
+                if once and not claimed and not self.running:
+                    break
+                if self.running:
+                    self.wait_for_tasks()
+                elif not claimed:
+                    self.stopping.wait(self.poll_interval)
+            while self.running:
+                self.wait_for_tasks()
+        connection.close()
+
+    def wait_for_tasks(self):
+        """Collect the tasks that finish within a poll interval and renew the others' locks"""
+        done, _ = wait(self.running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+        self.collect(done)
+        for future in done:
+            del self.running[future]
+        now = time.monotonic()
+        if self.running and now - self.last_heartbeat >= self.visibility_timeout / 3:
+            heartbeat(self.worker_id, self.running.values())
+            self.last_heartbeat = now
+
+    def collect(self, futures):
+        for future in futures:
+            self.processed += 1
+            try:
+                succeeded = future.result()
+            except Exception:
+                # The task's own errors are recorded by execute(); this is
+                # the pool itself failing, e.g. a killed child process.
+                logger.exception('Task runner crashed')
+                succeeded = False
+            if not succeeded:
+                self.failed += 1
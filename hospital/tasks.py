@@ -0,0 +1,90 @@
+"""
+Side effects that run on the task queue instead of inside the request.
+
+Each task takes primary keys rather than objects and reloads what it
+needs, so it sees the committed state when it runs, and is safe to run
+again after a retry.
+"""
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.mail import send_mail
+from django.template.loader import render_to_string
+
+from . import waitlist
+from .models import Appointment, Billing, UserProfile, WaitlistEntry
+from .taskqueue import task
+
+THUMBNAIL_SIZE = (200, 200)
+
+
+@task
+def send_email(subject, body, recipients, from_email=None, html_body=None):
+    send_mail(subject, body, from_email, recipients, html_message=html_body)
+
+
+@task
+def send_welcome_email(user_id):
+    profile = UserProfile.objects.select_related('user').get(user_id=user_id)
+    if profile.user.email:
+        body = render_to_string('emails/welcome.txt', {'user': profile.user, 'role': profile.get_role_display()})
+        send_mail('Welcome to the Hospital Management System', body, None, [profile.user.email])
+
+
+@task
+def send_appointment_confirmation(appointment_id):
+    appointment = Appointment.objects.select_related('patient__user', 'doctor__user').get(pk=appointment_id)
+    email = appointment.patient.user.email
+    if email:
+        body = render_to_string('emails/appointment_confirmation.txt', {'appointment': appointment})
+        send_mail(f'Appointment confirmed for {appointment.appointment_date}', body, None, [email])
+
+
+@task
+def send_waitlist_offer(entry_id):
+    entry = WaitlistEntry.objects.select_related(
+        'patient__user', 'doctor__user', 'offered_appointment',
+    ).get(pk=entry_id)
+    email = entry.patient.user.email
+    if email and entry.status == 'offered':
+        body = render_to_string('emails/waitlist_offer.txt', {'entry': entry})
+        send_mail(f'A slot opened up on {entry.appointment_date}', body, None, [email])
+
+
+@task
+def expire_waitlist_offer(entry_id):
+    """Pass an unanswered offer on to the next patient"""
+    waitlist.release_offer(entry_id, 'expired')
+
+
+@task
+def generate_bill(appointment_id):
+    """Create the consultation bill for a completed appointment, once"""
+    appointment = Appointment.objects.select_related('doctor').get(pk=appointment_id)
+    if appointment.status != 'completed':
+        return
+    Billing.objects.get_or_create(
+        appointment=appointment,
+        defaults={'total_amount': appointment.doctor.consultation_fee, 'notes': 'Consultation'},
+    )
+
+
+@task
+def make_profile_thumbnail(profile_id):
+    profile = UserProfile.objects.get(pk=profile_id)
+    if not profile.profile_picture:
+        return
+    # Pillow takes longer to import than the rest of this module; only the worker needs it
+    from PIL import Image
+
+    with profile.profile_picture.open('rb') as picture:
+        image = Image.open(picture)
+        image.thumbnail(THUMBNAIL_SIZE)
+        output = BytesIO()
+        image.convert('RGB').save(output, format='JPEG', quality=85)
+    name = f'{profile.pk}.jpg'
+    if profile.profile_thumbnail:
+        profile.profile_thumbnail.delete(save=False)
+    profile.profile_thumbnail.save(name, ContentFile(output.getvalue()), save=False)
+    # update() skips the profile signals: a thumbnail changes no cached data
+    UserProfile.objects.filter(pk=profile.pk).update(profile_thumbnail=profile.profile_thumbnail.name)
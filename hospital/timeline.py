@@ -0,0 +1,251 @@
+"""
+Patients' medical timelines: appointments, visit notes, bills and changes
+to the patient record, newest first, in one list.
+
+The timeline is a read model kept up to date as the records are written
+(``hospital.signals``). Saving an appointment writes its entry, and a note
+entry while it has notes; saving a bill writes the bill's; a change to the
+patient record adds an entry saying what changed. Entries copy what the
+timeline shows (the doctor's name, the status, the amount), so a page of
+it is one range of ``hospital_timeline_patient_idx`` and no joins, however
+many years of history the patient has. Pages are keyset pages, as in the
+JSON API: each starts after the last entry's ``(occurred_at, id)``.
+
+An appointment or bill that is deleted leaves the timeline, except when
+archival moves it (``keeping()``): the archived visit is still part of the
+patient's history. ``rebuild`` writes the entries of the records that
+already exist, live and archived (``rebuild_timeline``).
+"""
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from .identity import get_user_context
+from .models import Appointment, ArchivedAppointment, ArchivedBilling, Billing, Doctor, Patient, TimelineEntry
+
+ORDERING = ('-occurred_at', '-id')
+UPDATE_FIELDS = ['patient', 'kind', 'occurred_at', 'title', 'detail', 'data']
+
+# Patient fields whose changes are added to the timeline
+RECORD_FIELDS = (
+    'blood_group', 'allergies', 'medical_history', 'date_of_birth', 'gender', 'emergency_contact', 'address',
+)
+
+APPOINTMENT_TYPES = dict(Appointment.APPOINTMENT_TYPE_CHOICES)
+APPOINTMENT_STATUSES = dict(Appointment.STATUS_CHOICES)
+PAYMENT_STATUSES = dict(Billing.PAYMENT_STATUS_CHOICES)
+PAYMENT_METHODS = dict(Billing.PAYMENT_METHOD_CHOICES)
+
+DOCTOR_NAME = Concat('user__first_name', Value(' '), 'user__last_name')
+
+_keeping = ContextVar('timeline_keeping', default=False)
+
+
+@contextmanager
+def keeping():
+    """Deletes inside the block leave the deleted records' entries in place"""
+    token = _keeping.set(True)
+    try:
+        yield
+    finally:
+        _keeping.reset(token)
+
+
+def write(entries):
+    """Add ``entries``, replacing those with the same keys"""
+    TimelineEntry.objects.bulk_create(
+        entries, update_conflicts=True, unique_fields=['key'], update_fields=UPDATE_FIELDS,
+    )
+
+
+def forget(*keys):
+    """Drop the entries of deleted records, unless the records are being archived"""
+    if not _keeping.get():
+        TimelineEntry.objects.filter(key__in=keys).delete()
+
+
+def visit_entries(visit):
+    """
+    The entries for an appointment, from a dict of its fields with the
+    doctor's ``doctor_name`` and ``specialization``: its own, and its note
+    entry or else None.
+    """
+    pk, doctor = visit['id'], visit['doctor_name']
+    occurred_at = timezone.make_aware(datetime.combine(visit['appointment_date'], visit['appointment_time']))
+    entry = TimelineEntry(
+        patient_id=visit['patient_id'], key=f'appointment:{pk}', kind='appointment', occurred_at=occurred_at,
+        title=f"{APPOINTMENT_TYPES.get(visit['appointment_type'], visit['appointment_type'])} with Dr. {doctor}",
+        detail=visit['reason'],
+        data={
+            'appointment_id': pk, 'doctor_id': visit['doctor_id'], 'doctor': doctor,
+            'specialization': visit['specialization'], 'status': visit['status'],
+            'status_display': APPOINTMENT_STATUSES.get(visit['status'], visit['status']),
+        },
+    )
+    note = None
+    if visit['notes']:
+        note = TimelineEntry(
+            patient_id=visit['patient_id'], key=f'note:{pk}', kind='note', occurred_at=occurred_at,
+            title=f'Notes from Dr. {doctor}', detail=visit['notes'],
+            data={'appointment_id': pk, 'doctor_id': visit['doctor_id'], 'doctor': doctor},
+        )
+    return entry, note
+
+
+def bill_entry(bill):
+    """The entry for a bill, from a dict of its fields and its appointment's ``patient_id``"""
+    status = PAYMENT_STATUSES.get(bill['payment_status'], bill['payment_status'])
+    detail = status
+    if bill['payment_status'] == 'paid' and bill['payment_method']:
+        detail = f"{status} by {PAYMENT_METHODS.get(bill['payment_method'], bill['payment_method'])}"
+    return TimelineEntry(
+        patient_id=bill['patient_id'], key=f"bill:{bill['id']}", kind='bill', occurred_at=bill['created_at'],
+        title=f"Bill #{bill['id']:05d}: {bill['total_amount']}", detail=detail,
+        data={
+            'bill_id': bill['id'], 'appointment_id': bill['appointment_id'],
+            'amount': str(bill['total_amount']), 'status': bill['payment_status'],
+            'paid_at': bill['payment_date'].isoformat() if bill['payment_date'] else None,
+        },
+    )
+
+
+def registered_entry(patient_id, patient_code, joined):
+    return TimelineEntry(
+        patient_id=patient_id, key=f'registered:{patient_id}', kind='profile', occurred_at=joined,
+        title=f'Registered as patient {patient_code}', data={'patient_id': patient_code},
+    )
+
+
+def record_entry(patient_id, changes):
+    """An entry for a change to the patient record; ``changes`` maps field names to their new values"""
+    labels = [Patient._meta.get_field(name).verbose_name for name in changes]
+    return TimelineEntry(
+        patient_id=patient_id, key=f'record:{uuid.uuid4().hex}', kind='profile', occurred_at=timezone.now(),
+        title=f"{', '.join(labels).capitalize()} updated",
+        detail='\n'.join(f'{label.capitalize()}: {value or "-"}' for label, value in zip(labels, changes.values())),
+        data={'fields': changes},
+    )
+
+
+def appointment_saved(appointment):
+    if Appointment.doctor.is_cached(appointment) and Doctor.user.is_cached(appointment.doctor):
+        doctor_name, specialization = appointment.doctor.user.get_full_name(), appointment.doctor.specialization
+    else:
+        doctor_name, specialization = Doctor.objects.filter(pk=appointment.doctor_id).values_list(
+            DOCTOR_NAME, 'specialization',
+        ).get()
+    visit = {name: getattr(appointment, name) for name in (
+        'id', 'patient_id', 'doctor_id', 'appointment_type', 'status', 'reason', 'notes',
+    )}
+    # Either may still be the string a caller assigned
+    for name in ('appointment_date', 'appointment_time'):
+        visit[name] = Appointment._meta.get_field(name).to_python(getattr(appointment, name))
+    entry, note = visit_entries({**visit, 'doctor_name': doctor_name, 'specialization': specialization})
+    write([entry, note] if note else [entry])
+    if note is None:
+        TimelineEntry.objects.filter(key=f'note:{appointment.pk}').delete()
+
+
+def bill_saved(bill, patient_id):
+    write([bill_entry({
+        **{name: getattr(bill, name) for name in (
+            'id', 'appointment_id', 'total_amount', 'payment_status', 'payment_method', 'payment_date', 'created_at',
+        )},
+        'patient_id': patient_id,
+    })])
+
+
+def record_before(patient):
+    """The tracked fields of ``patient`` as stored, before it is saved"""
+    if not patient.pk:
+        return None
+    return Patient.objects.filter(pk=patient.pk).values(*RECORD_FIELDS).first()
+
+
+def patient_saved(patient, created, previous):
+    if created:
+        write([registered_entry(patient.pk, patient.patient_id, timezone.now())])
+        return
+    if previous is None:
+        return
+    current = {name: Patient._meta.get_field(name).to_python(getattr(patient, name)) for name in RECORD_FIELDS}
+    changes = {name: str(value or '') for name, value in current.items() if value != previous[name]}
+    if changes:
+        write([record_entry(patient.pk, changes)])
+
+
+def rebuild(patient_ids=None, batch_size=500):
+    """
+    Write the entries of every existing appointment, bill and patient (or
+    ``patient_ids``' only), live and archived; returns how many. Running it
+    again rewrites the same entries; record changes are not stored anywhere
+    else, so none are added.
+    """
+    def only(queryset, lookup):
+        return queryset if patient_ids is None else queryset.filter(**{f'{lookup}__in': patient_ids})
+
+    patients = only(Patient.objects.all(), 'pk')
+    # Archived rows may belong to patients who are gone
+    known = set(patients.values_list('pk', flat=True))
+    visit_fields = ('id', 'appointment_date', 'appointment_time', 'appointment_type', 'status', 'reason', 'notes')
+    bill_fields = ('id', 'appointment_id', 'total_amount', 'payment_status', 'payment_method', 'payment_date',
+                   'created_at')
+    # (rows, the column holding the patient's pk, the entries for a row)
+    sources = [
+        (patients.values('pk', 'patient_id', 'user__date_joined'), 'pk', lambda row: [
+            registered_entry(row['pk'], row['patient_id'], row['user__date_joined']),
+        ]),
+        (only(Appointment.objects.all(), 'patient_id').values(
+            *visit_fields, 'patient_id', 'doctor_id',
+            doctor_name=Concat('doctor__user__first_name', Value(' '), 'doctor__user__last_name'),
+            specialization=F('doctor__specialization'),
+        ), 'patient_id', visit_entries),
+        (only(ArchivedAppointment.objects.all(), 'patient_ref').values(
+            *visit_fields, 'doctor_name', 'specialization', patient_id=F('patient_ref'), doctor_id=F('doctor_ref'),
+        ), 'patient_id', visit_entries),
+        (only(Billing.objects.all(), 'appointment__patient_id').values(
+            *bill_fields, patient_id=F('appointment__patient_id'),
+        ), 'patient_id', lambda row: [bill_entry(row)]),
+        (only(ArchivedBilling.objects.all(), 'appointment__patient_ref').values(
+            *bill_fields, patient_id=F('appointment__patient_ref'),
+        ), 'patient_id', lambda row: [bill_entry(row)]),
+    ]
+    written, batch = 0, []
+    for rows, owner, entries_of in sources:
+        for row in rows.iterator(chunk_size=batch_size):
+            if row[owner] in known:
+                batch.extend(entry for entry in entries_of(row) if entry is not None)
+            if len(batch) >= batch_size:
+                write(batch)
+                written, batch = written + len(batch), []
+    write(batch)
+    return written + len(batch)
+
+
+def page(patient_id, before=None, limit=None):
+    """
+    ``(entries, more)``: up to ``limit`` entries of the patient's timeline,
+    newest first, and whether older ones follow. ``before`` is the
+    ``(occurred_at, id)`` of the last entry of the previous page; bad values
+    raise ValidationError, ValueError or TypeError.
+    """
+    limit = limit or getattr(settings, 'TIMELINE_PAGE_SIZE', 25)
+    entries = TimelineEntry.objects.filter(patient_id=patient_id)
+    if before:
+        at, pk = before
+        # The bound on occurred_at alone starts the index range at the cursor
+        entries = entries.filter(Q(occurred_at__lt=at) | Q(occurred_at=at, id__lt=pk), occurred_at__lte=at)
+    entries = list(entries.order_by(*ORDERING)[:limit + 1])
+    return entries[:limit], len(entries) > limit
+
+
+def can_read(user, patient_id):
+    """Admins and doctors read any patient's timeline, patients their own"""
+    current = get_user_context(user)
+    return current.role in ('admin', 'doctor') or (current.patient_id is not None and current.patient_id == patient_id)
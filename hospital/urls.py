@@ -1,6 +1,7 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import api, graph, rest, views
+from .forms import QueuedPasswordResetForm
 
 urlpatterns = [
     # Public pages
@@ -9,6 +10,7 @@ urlpatterns = [
     path('contact/', views.ContactView.as_view(), name='contact'),
     path('doctors/', views.DoctorListView.as_view(), name='doctors'),
     path('doctors/<int:pk>/', views.DoctorDetailView.as_view(), name='doctor_detail'),
+    path('doctors/<int:pk>/schedule/', views.DoctorScheduleView.as_view(), name='doctor_schedule'),
     
     # Authentication
     path('login/', auth_views.LoginView.as_view(), name='login'),
@@ -17,20 +19,55 @@ urlpatterns = [
     
     # Dashboard and profile
     path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
+    path('events/', views.event_stream, name='events'),
     path('profile/', views.profile_view, name='profile'),
+    path('schedule/', views.DoctorScheduleView.as_view(), name='my_schedule'),
+    path('capacity/', views.CapacityPlannerView.as_view(), name='capacity'),
+    path('profiling/', views.ProfilingView.as_view(), name='profiling'),
     
     # Appointments
     path('appointments/', views.AppointmentListView.as_view(), name='appointments'),
     path('appointments/book/', views.AppointmentCreateView.as_view(), name='book_appointment'),
+    path('waitlist/', views.WaitlistView.as_view(), name='waitlist'),
+    path('waitlist/join/', views.WaitlistJoinView.as_view(), name='join_waitlist'),
+    path('waitlist/<int:pk>/accept/', views.waitlist_respond, {'action': 'accept'}, name='accept_waitlist_offer'),
+    path('waitlist/<int:pk>/decline/', views.waitlist_respond, {'action': 'decline'}, name='decline_waitlist_offer'),
+    path('waitlist/<int:pk>/leave/', views.waitlist_respond, {'action': 'leave'}, name='leave_waitlist'),
     
     # Patients (admin/doctor only)
     path('patients/', views.PatientListView.as_view(), name='patients'),
+    path('patients/<int:pk>/timeline/', views.PatientTimelineView.as_view(), name='patient_timeline'),
     
     # Billing
     path('billing/', views.BillingListView.as_view(), name='billing'),
     
+    # Appointment and bill history, including archived records
+    path('history/', views.HistoryView.as_view(), name='history'),
+    
+    # Prometheus metrics
+    path('metrics', views.metrics_view, name='metrics'),
+    
+    # JSON detail payloads for the list page modals
+    path('api/appointments/<int:pk>/', api.appointment_detail, name='api_appointment_detail'),
+    path('api/patients/<int:pk>/', api.patient_detail, name='api_patient_detail'),
+    path('api/bills/<int:pk>/', api.bill_detail, name='api_bill_detail'),
+    
+    # Versioned JSON API for the kiosk and mobile clients
+    path('api/v1/', rest.api_root, name='api_v1_root'),
+    path('api/v1/doctors/', rest.DoctorApiView.as_view(), name='api_v1_doctors'),
+    path('api/v1/doctors/<int:pk>/', rest.DoctorApiView.as_view(), name='api_v1_doctor'),
+    path('api/v1/patients/', rest.PatientApiView.as_view(), name='api_v1_patients'),
+    path('api/v1/patients/<int:pk>/', rest.PatientApiView.as_view(), name='api_v1_patient'),
+    path('api/v1/patients/<int:pk>/timeline/', rest.TimelineApiView.as_view(), name='api_v1_patient_timeline'),
+    path('api/v1/appointments/', rest.AppointmentApiView.as_view(), name='api_v1_appointments'),
+    path('api/v1/appointments/<int:pk>/', rest.AppointmentApiView.as_view(http_method_names=['get', 'head', 'options']),
+         name='api_v1_appointment'),
+    path('api/v1/bills/', rest.BillApiView.as_view(), name='api_v1_bills'),
+    path('api/v1/bills/<int:pk>/', rest.BillApiView.as_view(), name='api_v1_bill'),
+    path('api/v1/query/', graph.query_view, name='api_v1_query'),
+    
     # Password reset
-    path('password_reset/', auth_views.PasswordResetView.as_view(), name='password_reset'),
+    path('password_reset/', auth_views.PasswordResetView.as_view(form_class=QueuedPasswordResetForm), name='password_reset'),
     path('password_reset/done/', auth_views.PasswordResetDoneView.as_view(), name='password_reset_done'),
     path('reset/<uidb64>/<token>/', auth_views.PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
     path('reset/done/', auth_views.PasswordResetCompleteView.as_view(), name='password_reset_complete'),
@@ -1,3 +1,10 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import NON_FIELD_ERRORS, PermissionDenied
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_POST
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
@@ -7,35 +14,56 @@ from django.views.generic import (
     ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
 )
 from django.urls import reverse_lazy
+from django.db import transaction
 from django.db.models import Q, Count
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import date, timedelta
-from .models import Doctor, Patient, Appointment, Billing, UserProfile
+from .models import Doctor, Patient, Appointment, Billing, UserProfile, WaitlistEntry
+from . import archive, capacity, conflicts, feed, metrics, profiling, schedule, timeline, waitlist
+from .identity import get_user_context
+from .async_utils import AsyncLoginRequiredMixin, async_login_required, gather_queries
+from .conditional import ConditionalGetMixin, appointment_state
+from .rest import ApiError, timeline_page
+from . import tasks
 from .forms import (
     CustomUserCreationForm, DoctorForm, PatientForm, AppointmentForm,
-    AppointmentSearchForm, BillingForm, UserProfileForm
+    AppointmentSearchForm, BillingForm, CapacityFilterForm, RecordSearchForm, UserProfileForm, WaitlistForm
 )
 
-class HomeView(TemplateView):
-    """Home page view"""
+class ReplicaReadMixin:
+    """Let GET requests to this view read from the replica database"""
+    use_replica = True
+
+class HomeView(ReplicaReadMixin, ConditionalGetMixin, TemplateView):
+    """Home page view; the three counts run concurrently"""
     template_name = 'hospital/home.html'
+    cache_stamps = ('doctor', 'patient', 'user')
+    public_cache = True
     
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['total_doctors'] = Doctor.objects.filter(is_available=True).count()
-        context['total_patients'] = Patient.objects.count()
-        context['total_appointments'] = Appointment.objects.filter(
-            appointment_date__gte=date.today()
-        ).count()
-        return context
+    def page_state(self):
+        # Upcoming appointments are counted from today
+        return date.today(), *appointment_state(Appointment.objects.all())
+    
+    async def get(self, request, *args, **kwargs):
+        context = self.get_context_data(**kwargs)
+        context.update(await gather_queries(
+            total_doctors=Doctor.objects.filter(is_available=True).count,
+            total_patients=Patient.objects.count,
+            total_appointments=Appointment.objects.filter(appointment_date__gte=date.today()).count,
+        ))
+        return self.render_to_response(context)
 
-class AboutView(TemplateView):
+class AboutView(ConditionalGetMixin, TemplateView):
     """About page view"""
     template_name = 'hospital/about.html'
+    cache_stamps = ('user',)
+    public_cache = True
 
-class ContactView(TemplateView):
+class ContactView(ConditionalGetMixin, TemplateView):
     """Contact page view"""
     template_name = 'hospital/contact.html'
+    cache_stamps = ('user',)
 
 def signup_view(request):
     """Custom signup view with role assignment"""
@@ -71,6 +99,8 @@ def signup_view(request):
                     patient_id=patient_id
                 )
             
+            tasks.send_welcome_email.delay(user_id=user.pk)
+            metrics.SIGNUPS.inc(role=profile.role)
             login(request, user)
             messages.success(request, f'Welcome {user.get_full_name()}! Your account has been created.')
             return redirect('dashboard')
@@ -79,62 +109,128 @@ def signup_view(request):
     
     return render(request, 'registration/signup.html', {'form': form})
 
-class DashboardView(LoginRequiredMixin, TemplateView):
-    """Dashboard view with role-based content"""
+class DashboardView(AsyncLoginRequiredMixin, ReplicaReadMixin, TemplateView):
+    """
+    Dashboard view with role-based content; each role's queries run concurrently.
+    
+    The page listens to the change feed (``event_stream``) and, on a write it
+    may show, fetches ``?sections=...`` to re-render only the sections that
+    event touches, with only their queries.
+    """
     template_name = 'hospital/dashboard.html'
+    # Each role's live sections (templates/hospital/dashboard/<role>_<section>.html) and the queries they need
+    LIVE_SECTIONS = {
+        'admin': {
+            'stats': ('total_doctors', 'total_patients', 'total_appointments', 'pending_bills'),
+            'recent_appointments': ('recent_appointments',),
+        },
+        'doctor': {
+            'stats': ('doctor', 'today_schedule', 'upcoming_appointments'),
+            'today_schedule': ('today_schedule',),
+        },
+        'patient': {
+            'stats': ('patient', 'upcoming_appointments', 'recent_bills'),
+            'upcoming_appointments': ('upcoming_appointments',),
+            'recent_bills': ('recent_bills',),
+        },
+    }
     
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user = self.request.user
+    async def get(self, request, *args, **kwargs):
+        context = self.get_context_data(**kwargs)
+        if 'sections' in request.GET:
+            return await self.live_sections(context, request.GET['sections'].split(','))
+        context.update(await self.dashboard_context(request.user))
+        return self.render_to_response(context)
+    
+    async def live_sections(self, context, names):
+        context.update(await self.dashboard_context(self.request.user, sections=names))
+        sections = self.LIVE_SECTIONS.get(context['user_role'], {})
+        templates = {name: f"hospital/dashboard/{context['user_role']}_{name}.html" for name in names if name in sections}
+        rendered = await sync_to_async(lambda: {
+            name: render_to_string(template, context, self.request) for name, template in templates.items()
+        })()
+        return JsonResponse(rendered)
+    
+    async def dashboard_context(self, user, sections=None):
+        current = await sync_to_async(get_user_context)(user)
+        today = date.today()
         
-        try:
-            profile = user.userprofile
-            context['user_role'] = profile.role
+        if current.role == 'patient':
+            appointments = Appointment.objects.visible_to(user).select_related('doctor__user')
+            bills = Billing.objects.visible_to(user).select_related('appointment__doctor__user')
+            queries = {
+                'patient': Patient.objects.select_related('user__userprofile').filter(pk=current.patient_id).first,
+                'upcoming_appointments': lambda: list(appointments.filter(
+                    appointment_date__gte=today
+                ).order_by('appointment_date', 'appointment_time')[:5]),
+                'recent_bills': lambda: list(bills.order_by('-created_at')[:5]),
+            }
+            required = 'patient'
             
-            if profile.role == 'patient':
-                patient = Patient.objects.get(user=user)
-                context['patient'] = patient
-                context['upcoming_appointments'] = Appointment.objects.filter(
-                    patient=patient,
-                    appointment_date__gte=date.today()
-                ).order_by('appointment_date', 'appointment_time')[:5]
-                context['recent_bills'] = Billing.objects.filter(
-                    appointment__patient=patient
-                ).order_by('-created_at')[:5]
-                
-            elif profile.role == 'doctor':
-                doctor = Doctor.objects.get(user=user)
-                context['doctor'] = doctor
-                context['todays_appointments'] = Appointment.objects.filter(
-                    doctor=doctor,
-                    appointment_date=date.today()
-                ).order_by('appointment_time')
-                context['upcoming_appointments'] = Appointment.objects.filter(
-                    doctor=doctor,
-                    appointment_date__gt=date.today()
-                ).order_by('appointment_date', 'appointment_time')[:5]
-                
-            elif profile.role == 'admin':
-                context['total_doctors'] = Doctor.objects.count()
-                context['total_patients'] = Patient.objects.count()
-                context['total_appointments'] = Appointment.objects.count()
-                context['pending_bills'] = Billing.objects.filter(payment_status='pending').count()
-                
+        elif current.role == 'doctor':
+            appointments = Appointment.objects.visible_to(user).select_related('patient__user')
+            queries = {
+                'doctor': Doctor.objects.select_related('user__userprofile').filter(pk=current.doctor_id).first,
+                'today_schedule': lambda: current.doctor_id and schedule.day_schedule(current.doctor_id, today),
+                'upcoming_appointments': lambda: list(appointments.filter(
+                    appointment_date__gt=today
+                ).order_by('appointment_date', 'appointment_time')[:5]),
+            }
+            required = 'doctor'
+            
+        elif current.role == 'admin':
+            # Pick the five newest ids first so only those rows are joined
+            latest = Appointment.objects.order_by('-created_at').values('pk')[:5]
+            queries = {
+                'total_doctors': Doctor.objects.count,
+                'total_patients': Patient.objects.count,
+                'total_appointments': Appointment.objects.count,
+                'pending_bills': Billing.objects.filter(payment_status='pending').count,
                 # Recent activities
-                context['recent_appointments'] = Appointment.objects.order_by('-created_at')[:5]
-                context['recent_registrations'] = UserProfile.objects.order_by('-created_at')[:5]
-                
-        except (UserProfile.DoesNotExist, Patient.DoesNotExist, Doctor.DoesNotExist):
-            context['user_role'] = 'unknown'
+                'recent_appointments': lambda: list(Appointment.objects.filter(pk__in=latest).select_related(
+                    'patient__user', 'doctor__user'
+                ).order_by('-created_at')),
+                'recent_registrations': lambda: list(
+                    UserProfile.objects.select_related('user').order_by('-created_at')[:5]
+                ),
+            }
+            required = None
             
+        else:
+            return {'user_role': 'unknown'}
+        
+        if sections is not None:
+            needed = {name for section in sections for name in self.LIVE_SECTIONS[current.role].get(section, ())}
+            queries = {name: query for name, query in queries.items() if name in needed}
+        context = await gather_queries(**queries)
+        context['user_role'] = current.role
+        if required in context and context[required] is None:
+            context['user_role'] = 'unknown'
         return context
 
-class DoctorListView(ListView):
+@async_login_required
+async def event_stream(request):
+    """
+    Appointment and bill events the user may have missed, as server-sent
+    events the browser polls for. Under an ASGI server
+    ``hospital.feed.EventStreamApp`` answers this URL with a stream instead.
+    """
+    key = feed.subscription(await sync_to_async(get_user_context)(request.user))
+    if key is None:
+        raise PermissionDenied
+    last_event_id = feed.parse_event_id(request.headers.get('Last-Event-ID'))
+    response = HttpResponse(await feed.catch_up(key, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+class DoctorListView(ReplicaReadMixin, ConditionalGetMixin, ListView):
     """List all available doctors"""
     model = Doctor
     template_name = 'hospital/doctors.html'
     context_object_name = 'doctors'
     paginate_by = 12
+    cache_stamps = ('doctor', 'user')
+    public_cache = True
     
     def get_queryset(self):
         queryset = Doctor.objects.filter(is_available=True)
@@ -160,25 +256,104 @@ class DoctorListView(ListView):
         context['current_search'] = self.request.GET.get('search', '')
         return context
 
-class DoctorDetailView(DetailView):
+class DoctorDetailView(ConditionalGetMixin, DetailView):
     """Doctor detail view"""
     model = Doctor
     template_name = 'hospital/doctor_detail.html'
     context_object_name = 'doctor'
+    cache_stamps = ('doctor', 'user')
+    public_cache = True
+
+def get_user_role(user):
+    """Role from the user's profile, or None if they have no profile"""
+    return get_user_context(user).role
+
+class StaffRequiredMixin(UserPassesTestMixin):
+    """Restrict a view to admin and doctor accounts"""
+    
+    def test_func(self):
+        return get_user_role(self.request.user) in ['admin', 'doctor']
+
+class DoctorScheduleView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """A doctor's week: bookings, free slots and gaps. Doctors see their own, admins anyone's."""
+    template_name = 'hospital/doctor_schedule.html'
+    
+    def test_func(self):
+        current = get_user_context(self.request.user)
+        if current.role == 'admin':
+            return 'pk' in self.kwargs
+        return current.role == 'doctor' and self.kwargs.get('pk', current.doctor_id) == current.doctor_id
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        pk = self.kwargs.get('pk') or get_user_context(self.request.user).doctor_id
+        doctor = get_object_or_404(Doctor.objects.select_related('user'), pk=pk)
+        try:
+            week = schedule.week_start(parse_date(self.request.GET.get('week', '')) or date.today())
+        except ValueError:
+            week = schedule.week_start(date.today())
+        context.update({
+            'doctor': doctor,
+            'days': schedule.week_schedule(doctor.pk, week),
+            'previous_week': week - timedelta(days=7),
+            'next_week': week + timedelta(days=7),
+        })
+        return context
+
+class AdminRequiredMixin(UserPassesTestMixin):
+    """Restrict a view to admin accounts"""
+    
+    def test_func(self):
+        return get_user_role(self.request.user) == 'admin'
+
+class CapacityPlannerView(LoginRequiredMixin, AdminRequiredMixin, ReplicaReadMixin, TemplateView):
+    """Booked, free and cancelled slots for every doctor and day in a range; ?format=csv to export"""
+    template_name = 'hospital/capacity.html'
+    
+    def get(self, request, *args, **kwargs):
+        form = CapacityFilterForm(request.GET or None)
+        if form.is_bound and not form.is_valid():
+            if request.GET.get('format') == 'csv':
+                return JsonResponse({'errors': form.errors}, status=400)
+            return self.render_to_response(self.get_context_data(form=form, grid=None), status=400)
+        filters = form.cleaned_data if form.is_bound else {}
+        grid = capacity.capacity_grid(
+            filters.get('start') or date.today(),
+            filters.get('days') or 14,
+            filters.get('specialization'),
+        )
+        if request.GET.get('format') == 'csv':
+            response = StreamingHttpResponse(capacity.csv_chunks(grid), content_type='text/csv')
+            response['Content-Disposition'] = (
+                f'attachment; filename="capacity-{grid.dates[0]}-{grid.dates[-1]}.csv"'
+            )
+            return response
+        return self.render_to_response(self.get_context_data(form=form, grid=grid))
 
-class PatientListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class ProfilingView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """Slowest endpoints and requests from this process's sampled profiles (staff only)"""
+    template_name = 'hospital/profiling.html'
+    
+    def test_func(self):
+        return self.request.user.is_staff
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update({
+            'endpoints': profiling.endpoints(),
+            'slowest': profiling.slowest(),
+            'sample_rate': profiling.sample_rate(),
+            'samples': len(profiling.profiles()),
+        })
+        return context
+
+class PatientListView(LoginRequiredMixin, StaffRequiredMixin, ConditionalGetMixin, ListView):
     """List all patients (admin and doctor access only)"""
     model = Patient
     template_name = 'hospital/patients.html'
     context_object_name = 'patients'
     paginate_by = 20
-    
-    def test_func(self):
-        try:
-            profile = self.request.user.userprofile
-            return profile.role in ['admin', 'doctor']
-        except:
-            return False
+    cache_stamps = ('patient', 'user')
     
     def get_queryset(self):
         queryset = Patient.objects.all()
@@ -191,31 +366,55 @@ class PatientListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
                 Q(patient_id__icontains=search)
             )
         
-        return queryset
+        return queryset.select_related('user__userprofile').only(
+            'id', 'patient_id', 'date_of_birth', 'blood_group', 'emergency_contact',
+            'user__first_name', 'user__last_name', 'user__email', 'user__userprofile__phone',
+        ).order_by('patient_id')
+
+class PatientTimelineView(LoginRequiredMixin, UserPassesTestMixin, ReplicaReadMixin, TemplateView):
+    """A patient's appointments, notes, bills and record changes, newest first; ?cursor= for older ones"""
+    template_name = 'hospital/patient_timeline.html'
+    
+    def test_func(self):
+        return timeline.can_read(self.request.user, self.kwargs['pk'])
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        patient = get_object_or_404(Patient.objects.select_related('user'), pk=self.kwargs['pk'])
+        cursor = self.request.GET.get('cursor')
+        try:
+            entries, next_cursor = timeline_page(patient.pk, cursor)
+        except ApiError:
+            # A mangled link: start from the newest entries
+            cursor = None
+            entries, next_cursor = timeline_page(patient.pk)
+        context.update({
+            'patient': patient,
+            'entries': entries,
+            'next_cursor': next_cursor,
+            'first_page': not cursor,
+        })
+        return context
 
-class AppointmentListView(LoginRequiredMixin, ListView):
+class AppointmentListView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, ListView):
     """List appointments based on user role"""
     model = Appointment
     template_name = 'hospital/appointments.html'
     context_object_name = 'appointments'
     paginate_by = 20
+    cache_stamps = ('doctor', 'patient', 'user')
+    
+    def page_state(self):
+        return appointment_state(Appointment.objects.visible_to(self.request.user))
     
     def get_queryset(self):
-        user = self.request.user
-        try:
-            profile = user.userprofile
-            
-            if profile.role == 'patient':
-                patient = Patient.objects.get(user=user)
-                queryset = Appointment.objects.filter(patient=patient)
-            elif profile.role == 'doctor':
-                doctor = Doctor.objects.get(user=user)
-                queryset = Appointment.objects.filter(doctor=doctor)
-            else:  # admin
-                queryset = Appointment.objects.all()
-                
-        except:
-            queryset = Appointment.objects.none()
+        queryset = Appointment.objects.visible_to(self.request.user).select_related(
+            'patient__user', 'doctor__user'
+        ).only(
+            'id', 'appointment_date', 'appointment_time', 'status', 'reason', 'notes',
+            'patient__patient_id', 'patient__user__first_name', 'patient__user__last_name',
+            'doctor__specialization', 'doctor__user__first_name', 'doctor__user__last_name',
+        )
         
         # Apply search filters
         form = AppointmentSearchForm(self.request.GET)
@@ -252,52 +451,162 @@ class AppointmentCreateView(LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('appointments')
     
     def form_valid(self, form):
-        try:
-            patient = Patient.objects.get(user=self.request.user)
-            form.instance.patient = patient
-            
-            # Check for conflicts
-            existing = Appointment.objects.filter(
-                doctor=form.instance.doctor,
-                appointment_date=form.instance.appointment_date,
-                appointment_time=form.instance.appointment_time,
-                status='scheduled'
-            ).exists()
-            
-            if existing:
-                messages.error(self.request, 'This time slot is already booked. Please choose another time.')
-                return self.form_invalid(form)
-            
-            messages.success(self.request, 'Appointment booked successfully!')
-            return super().form_valid(form)
-            
-        except Patient.DoesNotExist:
+        patient_id = get_user_context(self.request.user).patient_id
+        if patient_id is None:
             messages.error(self.request, 'Only patients can book appointments.')
             return redirect('home')
+        form.instance.patient_id = patient_id
+        
+        # Checked and saved under the doctor's lock, so no booking slips in between
+        with transaction.atomic():
+            conflicts.lock_doctor(form.instance.doctor_id)
+            clashes = conflicts.overlapping(
+                form.instance.appointment_date, form.instance.appointment_time,
+                form.instance.appointment_type, doctor_id=form.instance.doctor_id,
+            )
+            if clashes:
+                messages.error(
+                    self.request,
+                    f'This time overlaps a booking from {clashes[0].start:%H:%M} to {clashes[0].end:%H:%M}. '
+                    'Please choose another time.',
+                )
+                metrics.BOOKING_CONFLICTS.inc(reason='overlap')
+                return self.form_invalid(form, slot_taken=True)
+            response = super().form_valid(form)
+            tasks.send_appointment_confirmation.delay(appointment_id=self.object.pk)
+        
+        messages.success(self.request, 'Appointment booked successfully!')
+        metrics.BOOKINGS.inc(source='web')
+        return response
+    
+    def form_invalid(self, form, slot_taken=False):
+        # The active-slot constraint caught an exact double booking
+        taken = {constraint.violation_error_message for constraint in Appointment._meta.constraints}
+        if any(error in taken for error in form.errors.get(NON_FIELD_ERRORS, [])):
+            metrics.BOOKING_CONFLICTS.inc(reason='slot_taken')
+        return self.render_to_response(self.get_context_data(form=form, slot_taken=slot_taken))
+
+class PatientRequiredMixin(UserPassesTestMixin):
+    """Restrict a view to patient accounts"""
+    
+    def test_func(self):
+        return get_user_context(self.request.user).patient_id is not None
+
+class WaitlistView(LoginRequiredMixin, PatientRequiredMixin, ListView):
+    """The patient's waitlist entries, with any slot currently held for them"""
+    template_name = 'hospital/waitlist.html'
+    context_object_name = 'entries'
+    paginate_by = 20
+    
+    def get_queryset(self):
+        return WaitlistEntry.objects.filter(
+            patient_id=get_user_context(self.request.user).patient_id,
+        ).select_related('doctor__user', 'offered_appointment').order_by('-appointment_date', '-created_at')
 
-class BillingListView(LoginRequiredMixin, ListView):
+class WaitlistJoinView(LoginRequiredMixin, PatientRequiredMixin, CreateView):
+    """Join a doctor's waitlist for a day (patient only)"""
+    model = WaitlistEntry
+    form_class = WaitlistForm
+    template_name = 'hospital/waitlist_form.html'
+    success_url = reverse_lazy('waitlist')
+    
+    def get_initial(self):
+        # Prefilled from a failed booking
+        return {key: self.request.GET[key] for key in ('doctor', 'appointment_date', 'appointment_type')
+                if key in self.request.GET}
+    
+    def form_valid(self, form):
+        form.instance.patient_id = get_user_context(self.request.user).patient_id
+        already = WaitlistEntry.objects.filter(
+            patient_id=form.instance.patient_id,
+            doctor=form.instance.doctor,
+            appointment_date=form.instance.appointment_date,
+            status__in=['waiting', 'offered'],
+        ).exists()
+        if already:
+            messages.info(self.request, 'You are already on this waitlist.')
+            return redirect('waitlist')
+        messages.success(self.request, 'You have joined the waitlist. We will email you if a slot opens up.')
+        return super().form_valid(form)
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['hold_minutes'] = int(waitlist.hold_duration().total_seconds() // 60)
+        return context
+
+@login_required
+@require_POST
+def waitlist_respond(request, pk, action):
+    """Accept or decline a held slot, or leave the waitlist"""
+    patient_id = get_user_context(request.user).patient_id
+    if action == 'accept':
+        if waitlist.accept_offer(pk, patient_id):
+            messages.success(request, 'Appointment booked successfully!')
+        else:
+            messages.error(request, 'Sorry, this offer has expired.')
+    elif action == 'decline':
+        if waitlist.release_offer(pk, 'declined', patient_id=patient_id):
+            messages.info(request, 'You have declined the offered slot.')
+    else:
+        WaitlistEntry.objects.filter(pk=pk, patient_id=patient_id, status='waiting').update(status='withdrawn')
+        messages.info(request, 'You have left the waitlist.')
+    return redirect('waitlist')
+
+class BillingListView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, ListView):
     """List billing records"""
     model = Billing
     template_name = 'hospital/billing.html'
     context_object_name = 'bills'
     paginate_by = 20
+    cache_stamps = ('bill', 'doctor', 'patient', 'user')
     
     def get_queryset(self):
-        user = self.request.user
-        try:
-            profile = user.userprofile
-            
-            if profile.role == 'patient':
-                patient = Patient.objects.get(user=user)
-                return Billing.objects.filter(appointment__patient=patient)
-            elif profile.role == 'doctor':
-                doctor = Doctor.objects.get(user=user)
-                return Billing.objects.filter(appointment__doctor=doctor)
-            else:  # admin
-                return Billing.objects.all()
-                
-        except:
-            return Billing.objects.none()
+        return Billing.objects.visible_to(self.request.user).select_related(
+            'appointment__patient__user', 'appointment__doctor__user'
+        ).only(
+            'id', 'created_at', 'total_amount', 'discount_amount', 'payment_status', 'due_date',
+            'appointment__appointment_date', 'appointment__patient__patient_id',
+            'appointment__patient__user__first_name', 'appointment__patient__user__last_name',
+            'appointment__doctor__specialization',
+            'appointment__doctor__user__first_name', 'appointment__doctor__user__last_name',
+        ).order_by('-created_at')
+
+class HistoryView(LoginRequiredMixin, ReplicaReadMixin, ListView):
+    """Appointments or bills, live and archived together; ?format=csv to export"""
+    template_name = 'hospital/history.html'
+    context_object_name = 'records'
+    paginate_by = 20
+    
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('format') == 'csv':
+            response = StreamingHttpResponse(archive.csv_chunks(self.get_queryset()), content_type='text/csv')
+            response['Content-Disposition'] = f'attachment; filename="{self.kind()}.csv"'
+            return response
+        return super().get(request, *args, **kwargs)
+    
+    def kind(self):
+        return 'bills' if self.request.GET.get('kind') == 'bills' else 'appointments'
+    
+    def get_queryset(self):
+        form = RecordSearchForm(self.request.GET)
+        filters = form.cleaned_data if form.is_valid() else {}
+        common = {name: filters.get(name) for name in ('patient_name', 'date_from', 'date_to')}
+        if self.kind() == 'bills':
+            return archive.bill_records(self.request.user, payment_status=filters.get('payment_status'), **common)
+        return archive.appointment_records(
+            self.request.user, doctor_name=filters.get('doctor_name'), status=filters.get('status'), **common,
+        )
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        context.update({
+            'search_form': RecordSearchForm(self.request.GET),
+            'kind': self.kind(),
+            'query': query.urlencode(),
+        })
+        return context
 
 @login_required
 def profile_view(request):
@@ -338,6 +647,8 @@ def profile_view(request):
         
         if all(forms_valid):
             profile_form.save()
+            if 'profile_picture' in profile_form.changed_data:
+                tasks.make_profile_thumbnail.delay(profile_id=profile.pk)
             
             if doctor_form:
                 doctor = doctor_form.save(commit=False)
@@ -390,3 +701,17 @@ def logout_view(request):
         messages.success(request, f'Goodbye {user_name}! You have been logged out successfully.')
     return redirect('home')
 
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. It needs the ``METRICS_TOKEN`` bearer
+    token; without one set, only local requests are served, and only with
+    ``DEBUG`` on, since behind a proxy every request comes from this host.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = settings.DEBUG and request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1')
+    if not allowed:
+        raise PermissionDenied
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,134 @@
+"""
+Waitlists for fully booked doctors.
+
+Patients join the waitlist for a doctor on a day. When a slot on that day
+is vacated (an appointment is cancelled, moved or deleted; see
+``hospital.signals``), ``offer_slot()`` holds it for the next eligible
+patient. The next patient is the first ``waiting`` entry of the
+(doctor, day, status, -priority, created_at) index, so finding them is one
+index seek however long the list.
+
+The hold is an appointment with status ``held``. Like any booking, it is
+checked and inserted under the doctor's lock (``conflicts.lock_doctor``),
+so a concurrent booking and an offer cannot both get the slot. The patient has ``WAITLIST_HOLD_MINUTES`` to accept;
+declining or letting the hold lapse cancels the held appointment, which
+vacates the slot again and offers it to the next patient in turn.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from . import conflicts, metrics, tasks
+from .models import Appointment, WaitlistEntry
+
+# Candidates examined per vacated slot before giving up on it
+CANDIDATE_LIMIT = 20
+
+
+def hold_duration():
+    return timedelta(minutes=getattr(settings, 'WAITLIST_HOLD_MINUTES', 30))
+
+
+def next_in_line(doctor_id, day):
+    """Waiting entries for ``doctor_id`` on ``day``, next first"""
+    return WaitlistEntry.objects.filter(doctor_id=doctor_id, appointment_date=day, status='waiting').order_by(
+        '-priority', 'created_at'
+    )
+
+
+def slot_has_passed(day, at):
+    return timezone.make_aware(datetime.combine(day, at)) <= timezone.now()
+
+
+def offer_slot(doctor_id, day, at):
+    """
+    Hold the vacated slot for the next eligible waitlisted patient.
+
+    Patients who already have an appointment at that time, or whose
+    appointment type is too long to fit before the doctor's next booking,
+    are skipped.
+    Returns the offered entry, or None when nobody is waiting or the slot
+    was taken first.
+    """
+    if slot_has_passed(day, at):
+        return None
+    with transaction.atomic():
+        # Held until the hold is inserted, so no booking takes the slot after the check
+        conflicts.lock_doctor(doctor_id)
+        candidates = next_in_line(doctor_id, day)
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        fits = {}
+        for entry in candidates[:CANDIDATE_LIMIT]:
+            # Longer appointment types may not fit before the next booking
+            if entry.appointment_type not in fits:
+                fits[entry.appointment_type] = not conflicts.overlapping(
+                    day, at, entry.appointment_type, doctor_id=doctor_id,
+                )
+            if not fits[entry.appointment_type]:
+                continue
+            if conflicts.overlapping(day, at, entry.appointment_type, patient_id=entry.patient_id):
+                continue
+            try:
+                with transaction.atomic():
+                    held = Appointment.objects.create(
+                        patient_id=entry.patient_id, doctor_id=doctor_id, appointment_date=day,
+                        appointment_time=at, appointment_type=entry.appointment_type,
+                        reason=entry.reason, status='held',
+                    )
+            except IntegrityError:
+                # Booked by someone else since it was vacated
+                return None
+            entry.status = 'offered'
+            entry.offered_appointment = held
+            entry.offer_expires_at = timezone.now() + hold_duration()
+            entry.save(update_fields=['status', 'offered_appointment', 'offer_expires_at'])
+            tasks.send_waitlist_offer.delay(entry_id=entry.pk)
+            tasks.expire_waitlist_offer.delay(entry_id=entry.pk, countdown=hold_duration().total_seconds())
+            return entry
+    return None
+
+
+def accept_offer(entry_id, patient_id):
+    """Turn the patient's held slot into a scheduled appointment; returns it, or None if the offer lapsed"""
+    with transaction.atomic():
+        entry = WaitlistEntry.objects.select_for_update().filter(
+            pk=entry_id, patient_id=patient_id, status='offered',
+        ).first()
+        if entry is None or entry.offer_expires_at <= timezone.now():
+            return None
+        appointment = entry.offered_appointment
+        appointment.status = 'scheduled'
+        appointment.save()
+        entry.status = 'booked'
+        entry.save(update_fields=['status'])
+    metrics.BOOKINGS.inc(source='waitlist')
+    tasks.send_appointment_confirmation.delay(appointment_id=appointment.pk)
+    return appointment
+
+
+def release_offer(entry_id, status, patient_id=None):
+    """
+    End an offer as ``declined`` or ``expired`` and cancel its hold,
+    which passes the slot to the next patient. Returns False if the entry
+    no longer holds an offer.
+    """
+    with transaction.atomic():
+        entries = WaitlistEntry.objects.select_for_update().filter(pk=entry_id, status='offered')
+        if patient_id is not None:
+            entries = entries.filter(patient_id=patient_id)
+        entry = entries.first()
+        if entry is None:
+            return False
+        if status == 'expired' and entry.offer_expires_at > timezone.now():
+            return False
+        entry.status = status
+        entry.save(update_fields=['status'])
+        held = entry.offered_appointment
+        if held is not None and held.status == 'held':
+            held.status = 'cancelled'
+            held.save()
+    return True
+
@@ -0,0 +1,24 @@
+from django.contrib import admin
+from django.contrib.admin.apps import SimpleAdminConfig
+from django.contrib.admin.checks import check_admin_app, check_dependencies
+from django.core import checks
+
+
+def check_discovered_admin(app_configs, **kwargs):
+    """The admin checks, run once every admin module is loaded"""
+    admin.autodiscover()
+    return check_admin_app(app_configs, **kwargs)
+
+
+class AdminConfig(SimpleAdminConfig):
+    """
+    The admin without autodiscovery at startup.
+
+    ``admin.py`` modules load with the URLconf or right before the admin
+    checks, so management commands and workers that need neither (see
+    ``bench_startup``) skip them.
+    """
+
+    def ready(self):
+        checks.register(check_dependencies, checks.Tags.admin)
+        checks.register(check_discovered_admin, checks.Tags.admin)
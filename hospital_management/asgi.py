@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_management.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# The dashboards' event streams are served beside Django; see hospital/feed.py
+from hospital.feed import EventStreamApp  # noqa: E402
+
+application = EventStreamApp(django_application)
@@ -0,0 +1,42 @@
+"""
+SQLite backend with connection-level tuning.
+
+Journal mode, synchronous level and mmap size are per-connection (or
+per-file) settings that Django's stock backend has no option for. List
+them in ``OPTIONS['pragmas']`` and they are executed on every new
+connection, in order.
+
+``OPTIONS['transaction_mode']`` (DEFERRED, IMMEDIATE or EXCLUSIVE) controls
+how ``atomic()`` blocks begin. IMMEDIATE takes the write lock up front, so
+a read-then-write transaction such as a booking waits on ``busy_timeout``
+instead of failing with "database is locked" when it tries to upgrade.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    @property
+    def transaction_mode(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f'Unsupported SQLite transaction_mode: {mode!r}')
+        return mode
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
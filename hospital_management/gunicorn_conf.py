@@ -0,0 +1,129 @@
+"""
+Gunicorn configuration for production:
+
+    gunicorn -c python:hospital_management.gunicorn_conf
+
+``SERVER_WORKER_CLASS`` picks the worker:
+
+    gthread   (default) the WSGI app on threaded workers
+    uvicorn   the ASGI app on uvicorn workers, so the async views run
+              natively on an event loop
+
+The worker count follows the CPUs this process may use (the affinity
+mask, capped by a cgroup CPU quota): cores + 1 threaded workers of
+``SERVER_THREADS`` threads each, or one uvicorn worker per core.
+``WEB_CONCURRENCY`` overrides the count. Each thread, and each of a
+worker's ``ASYNC_QUERY_WORKERS`` query threads, holds its own database
+connection, so size the database's connection limit to match.
+
+The app is preloaded in the master: Django, the URLconf with every view,
+form and admin module, and the project's compiled templates load once,
+and ``gc.freeze()`` keeps the collector from touching them, so forked
+workers share those pages copy-on-write. No database connection is open
+when workers fork. Workers are recycled after ``SERVER_MAX_REQUESTS``
+requests (with jitter, so they do not all restart at once), which bounds
+slow leaks.
+
+Reloading: ``kill -HUP <master>`` replaces the workers gracefully, but
+preloaded workers fork from the old code. To deploy new code without
+dropping requests, ``kill -USR2`` the master (it starts a new master on
+the new code next to the old one), then ``kill -WINCH`` and
+``kill -QUIT`` the old master once the new workers answer. Or set
+``SERVER_PRELOAD=0`` so HUP loads new code, at the cost of the shared
+memory.
+"""
+import gc
+import math
+import os
+from pathlib import Path
+
+from hospital_management.db import env_bool
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_management.settings')
+
+WORKER_CLASSES = {
+    'gthread': ('gthread', 'hospital_management.wsgi:application'),
+    'uvicorn': ('uvicorn.workers.UvicornWorker', 'hospital_management.asgi:application'),
+}
+
+
+def available_cores(cgroup_cpu_max='/sys/fs/cgroup/cpu.max'):
+    """CPUs this process may use: its affinity mask, capped by a cgroup v2 CPU quota"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        quota, period = Path(cgroup_cpu_max).read_text().split()
+        if quota != 'max':
+            cores = min(cores, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(cores, 1)
+
+
+def worker_settings(kind, cores, env=os.environ):
+    """(workers, threads) for the worker class ``kind`` on ``cores`` CPUs"""
+    threads = int(env.get('SERVER_THREADS', 4)) if kind == 'gthread' else 1
+    default = cores + 1 if kind == 'gthread' else cores
+    return int(env.get('WEB_CONCURRENCY', default)), threads
+
+
+def warm():
+    """Load what every worker would otherwise load on its first requests"""
+    from django.template import engines
+    from django.template.exceptions import TemplateDoesNotExist, TemplateSyntaxError
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+    for engine in engines.all():
+        for directory in map(Path, getattr(engine, 'dirs', [])):
+            for path in directory.rglob('*'):
+                if path.suffix in ('.html', '.txt'):
+                    try:
+                        engine.get_template(path.relative_to(directory).as_posix())
+                    except (TemplateDoesNotExist, TemplateSyntaxError):
+                        pass
+
+
+_kind = os.environ.get('SERVER_WORKER_CLASS', 'gthread')
+if _kind not in WORKER_CLASSES:
+    raise ValueError(f'SERVER_WORKER_CLASS must be one of {sorted(WORKER_CLASSES)}, not {_kind!r}')
+worker_class, wsgi_app = WORKER_CLASSES[_kind]
+workers, threads = worker_settings(_kind, available_cores())
+
+bind = os.environ.get('SERVER_BIND', '0.0.0.0:8000').split(',')
+preload_app = env_bool(os.environ, 'SERVER_PRELOAD', True)
+max_requests = int(os.environ.get('SERVER_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+timeout = int(os.environ.get('SERVER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Heartbeat files on tmpfs: a disk-backed /tmp can stall workers in containers
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+accesslog = os.environ.get('SERVER_ACCESS_LOG') or None
+errorlog = '-'
+pidfile = os.environ.get('SERVER_PIDFILE') or None
+proc_name = 'hospital'
+
+
+def on_starting(server):
+    import django
+
+    django.setup()
+    from hospital import metrics
+
+    # Counters start from zero with the server (see hospital/metrics.py)
+    metrics.clear()
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+
+    warm()
+    # Workers must open their own connections, never share the master's
+    connections.close_all()
+    gc.freeze()
@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
-# import os
+
+from .db import archive_config, cache_config, database_config, replica_config, session_engine
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -31,7 +33,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    'hospital_management.apps.AdminConfig',  # django.contrib.admin, loaded on first use
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -44,11 +46,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'hospital.middleware.MetricsMiddleware',
+    'hospital.middleware.ProfilingMiddleware',
+    'hospital.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'hospital.middleware.UserContextMiddleware',
+    'hospital.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -58,14 +65,21 @@ ROOT_URLCONF = 'hospital_management.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': ["templates"],
-        'APP_DIRS': True,
+        'DIRS': [BASE_DIR / 'templates'],
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'hospital.context_processors.user_role',
+            ],
+            # Parse each template once per process instead of on every render.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
             ],
         },
     },
@@ -77,13 +91,150 @@ WSGI_APPLICATION = 'hospital_management.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Configured from DATABASE_URL and related variables; see hospital_management/db.py
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(BASE_DIR),
+}
+
+_replica = replica_config(BASE_DIR)
+if _replica:
+    DATABASES['replica'] = _replica
+
+_archive = archive_config(BASE_DIR)
+if _archive:
+    DATABASES['archive'] = _archive
+
+# Archived records live in 'archive' when it exists; read-only views read
+# from 'replica' when it exists; see hospital/routers.py
+DATABASE_ROUTERS = ['hospital.routers.ArchiveRouter', 'hospital.routers.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they write, so they
+# always see their own changes despite replication lag
+DATABASE_REPLICA_STICKY_SECONDS = 15
+
+# Threads (and so extra database connections) per process that async views
+# use to run independent queries concurrently; 0 runs them one after another
+# on the request's own connection. See hospital/async_utils.py
+ASYNC_QUERY_WORKERS = 4
+
+# Background tasks (hospital/taskqueue.py): attempts before a task is
+# marked failed, and the retry backoff in seconds (doubling, capped)
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BACKOFF = 10
+TASK_RETRY_BACKOFF_MAX = 3600
+
+# Appointment reminders (hospital/reminders.py): the delivery backend
+# ('email', 'console', 'file' or a dotted path), sender threads, sends per
+# second across all of them (0 for no limit) and attempts per reminder
+REMINDER_BACKEND = 'email'
+REMINDER_WORKERS = 8
+REMINDER_RATE_LIMIT = 20
+REMINDER_MAX_ATTEMPTS = 3
+REMINDER_FILE_PATH = BASE_DIR / 'reminders.log'
+
+# Minutes each appointment type takes, for overlap checks and the doctor
+# timelines (hospital/conflicts.py, hospital/schedule.py); types left out
+# keep their default (consultation 30, follow-up 15, emergency 45, routine 20)
+APPOINTMENT_DURATIONS = {}
+
+# Archival (hospital/archive.py): finished appointments and their settled
+# bills move to the archive tables this many months after the visit
+ARCHIVE_AFTER_MONTHS = 12
+
+# Monthly appointment partitions on PostgreSQL (hospital/partitions.py):
+# months created ahead of the current one by migrate and partition_appointments
+APPOINTMENT_PARTITION_MONTHS_AHEAD = 3
+
+# Request profiling (hospital/profiling.py): share of requests profiled
+# (0 turns the middleware off), profiles kept per process for the staff
+# page at /profiling/, and whether to trace peak memory (slows sampled requests)
+PROFILING_SAMPLE_RATE = 0
+PROFILING_BUFFER_SIZE = 1000
+PROFILING_TRACE_MEMORY = True
+
+# Metrics (hospital/metrics.py): where each process keeps its samples
+# (shared by every worker; cleared when the server starts), how long the
+# pending-bill gauges are cached, and the bearer token /metrics requires
+# (without one it only answers local requests, and only with DEBUG on).
+# The tests record into a temporary directory (hospital_management/test_runner.py).
+METRICS_DIR = os.environ.get('METRICS_DIR')  # default: hospital-metrics in the temp directory
+METRICS_GAUGE_CACHE_SECONDS = 60
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+TEST_RUNNER = 'hospital_management.test_runner.TestRunner'
+
+# Slow queries (hospital/slowlog.py): statements taking at least this many
+# milliseconds (0, the default, turns the log off) are written with their
+# plan, one JSON line each, to SLOW_QUERY_LOG; summarise it with slow_query_report
+SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 0))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', BASE_DIR / 'slow_queries.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            # Reopens the file after logrotate moves it; every process appends whole lines
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'formatter': 'message',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'hospital.slowlog': {'handlers': ['slow_queries'], 'level': 'INFO', 'propagate': False},
+    },
 }
 
+# Waitlists (hospital/waitlist.py): minutes a vacated slot is held for the
+# offered patient before it passes to the next one
+WAITLIST_HOLD_MINUTES = 30
+
+# Page caching (hospital/conditional.py): seconds shared caches may keep
+# public pages served to anonymous visitors, and seconds browsers may reuse
+# a signed-in user's page before revalidating it (0: every visit checks
+# the ETag, which costs a 304 instead of a render)
+PAGE_CACHE_PUBLIC_SECONDS = int(os.environ.get('PAGE_CACHE_PUBLIC_SECONDS', 60))
+PAGE_CACHE_PRIVATE_SECONDS = int(os.environ.get('PAGE_CACHE_PRIVATE_SECONDS', 0))
+
+# Change feed (hospital/feed.py): seconds between each process's polls for
+# new events, seconds a stream stays open before the browser reconnects
+# (and catches up), between heartbeats, and that an id skipped over is
+# looked for before it counts as rolled back; milliseconds between the
+# browser's polls under WSGI, which cannot stream; prune_change_feed keeps
+# FEED_RETENTION_HOURS of events
+FEED_POLL_SECONDS = 1
+FEED_STREAM_SECONDS = 300
+FEED_HEARTBEAT_SECONDS = 15
+FEED_WSGI_RETRY_MS = 10000
+FEED_GAP_SECONDS = 60
+FEED_RETENTION_HOURS = 24
+
+# JSON API (hospital/rest.py): rows per page by default and at most (?limit=),
+# and the most appointments one batch may book or change
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+API_BATCH_LIMIT = 100
+
+# Patient timelines (hospital/timeline.py): entries per page of the timeline page
+TIMELINE_PAGE_SIZE = 25
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# Configured from CACHE_URL and CACHE_SHARED; see hospital_management/db.py
+CACHES = cache_config()
+
+# Sessions
+# https://docs.djangoproject.com/en/5.0/topics/http/sessions/
+
+SESSION_ENGINE = session_engine()
+SESSION_CACHE_ALIAS = 'shared'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
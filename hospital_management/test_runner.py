@@ -0,0 +1,21 @@
+"""
+Test runner that records the suite's metrics into a temporary directory,
+so running the tests never adds to a server's ``METRICS_DIR``.
+"""
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.TemporaryDirectory(prefix='hospital-metrics-tests-')
+        self.metrics_settings = override_settings(METRICS_DIR=self.metrics_dir.name)
+        self.metrics_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.metrics_settings.disable()
+        self.metrics_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Load test for a running server, in the style of a locustfile.
+
+Each virtual user logs in (when given credentials), then requests the
+main routes in weighted random order until the time is up. Only the
+standard library is needed, so it runs on any machine that can reach the
+server. Run it on other cores than the server: it is one process, so it
+tops out at a few thousand requests a second.
+
+    python setup_hospital.py
+    gunicorn -c python:hospital_management.gunicorn_conf &
+    python load_test.py --users 32 --seconds 30 --username admin --password admin123
+
+Reports requests, throughput, latency percentiles and errors per route.
+Add routes with ``--route /path/:weight``.
+"""
+import argparse
+import http.client
+import random
+import re
+import statistics
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+# (path, weight): how often a virtual user picks each route
+PUBLIC_ROUTES = [('/', 4), ('/doctors/', 3), ('/about/', 1)]
+LOGGED_IN_ROUTES = [('/dashboard/', 4), ('/appointments/', 3), ('/billing/', 2), ('/history/', 1)]
+
+CSRF_FIELD = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class VirtualUser:
+    """One keep-alive connection with its own cookies"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.origin = f'{parts.scheme}://{parts.netloc}'
+        self.cookies = {}
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+        for header, value in response.getheaders():
+            if header.lower() == 'set-cookie':
+                name, _, rest = value.partition('=')
+                self.cookies[name.strip()] = rest.split(';', 1)[0]
+        return response.status, content
+
+    def login(self, username, password):
+        status, content = self.request('GET', '/login/')
+        token = CSRF_FIELD.search(content.decode('utf-8', 'replace'))
+        if status != 200 or token is None:
+            raise RuntimeError(f'GET /login/ returned {status} without a CSRF token')
+        body = urlencode({'username': username, 'password': password, 'csrfmiddlewaretoken': token.group(1)})
+        status, _ = self.request('POST', '/login/', body, {
+            'Content-Type': 'application/x-www-form-urlencoded', 'Referer': f'{self.origin}/login/',
+        })
+        if status != 302:
+            raise RuntimeError(f'Logging in as {username!r} failed with status {status}')
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.login_failures = []
+
+    def add(self, path, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(path, []).append(seconds * 1000)
+            if not ok:
+                self.errors[path] = self.errors.get(path, 0) + 1
+
+
+def run_user(args, routes, results, deadline, rng):
+    paths, weights = zip(*routes)
+    user = VirtualUser(args.url, args.timeout)
+    if args.username:
+        try:
+            user.login(args.username, args.password)
+        except (OSError, http.client.HTTPException, RuntimeError) as exc:
+            with results.lock:
+                results.login_failures.append(exc)
+            return
+    while time.perf_counter() < deadline:
+        path = rng.choices(paths, weights)[0]
+        started = time.perf_counter()
+        try:
+            status, _ = user.request('GET', path)
+            ok = status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+        results.add(path, time.perf_counter() - started, ok)
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def report(results, seconds):
+    print(f'{"route":<22}{"requests":>9}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    every = []
+    for path, samples in sorted(results.latencies.items()):
+        samples.sort()
+        every += samples
+        print(f'{path:<22}{len(samples):>9}{len(samples) / seconds:>9.1f}{statistics.median(samples):>9.1f}'
+              f'{percentile(samples, 0.95):>9.1f}{percentile(samples, 0.99):>9.1f}{results.errors.get(path, 0):>8}')
+    if every:
+        every.sort()
+        print(f'{"total":<22}{len(every):>9}{len(every) / seconds:>9.1f}{statistics.median(every):>9.1f}'
+              f'{percentile(every, 0.95):>9.1f}{percentile(every, 0.99):>9.1f}{sum(results.errors.values()):>8}')
+
+
+def parse_route(value):
+    path, _, weight = value.rpartition(':')
+    if not path.startswith('/'):
+        raise argparse.ArgumentTypeError(f'expected /path/:weight, got {value!r}')
+    return path, int(weight)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the main routes of a running server')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to test')
+    parser.add_argument('--users', type=int, default=16, help='Concurrent virtual users')
+    parser.add_argument('--seconds', type=float, default=30, help='How long to run')
+    parser.add_argument('--spawn-rate', type=float, default=10, help='Virtual users started per second')
+    parser.add_argument('--username', help='Log every virtual user in and add the logged-in routes')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--route', type=parse_route, action='append', default=[], help='Extra /path/:weight')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request fails')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    routes = PUBLIC_ROUTES + (LOGGED_IN_ROUTES if args.username else []) + args.route
+    results = Results()
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    threads = []
+    for number in range(args.users):
+        rng = random.Random(args.seed + number)
+        thread = threading.Thread(target=run_user, args=(args, routes, results, deadline, rng), daemon=True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(1 / args.spawn_rate)
+    for thread in threads:
+        thread.join()
+    print(f'{args.users} users against {args.url} for {args.seconds:.0f}s')
+    if results.login_failures:
+        print(f'{len(results.login_failures)} user(s) could not log in, e.g.: {results.login_failures[0]}')
+    report(results, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
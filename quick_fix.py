@@ -6,39 +6,46 @@ This will fix the current issues and set up the system properly.
 
 import os
 import sys
-import subprocess
 
-def run_command(command, description, ignore_admin_errors=False):
-    """Run a command and handle errors"""
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_management.settings')
+
+def run_step(step, description, ignore_admin_errors=False):
+    """Run a step in this process and handle errors"""
     print(f"🔄 {description}...")
     try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
+        step()
         print(f"✅ {description} completed")
         return True
-    except subprocess.CalledProcessError as e:
-        error_msg = e.stderr.lower()
+    except Exception as e:
+        error_msg = str(e).lower()
         if ignore_admin_errors and ('admin' in error_msg or 'billingadmin' in error_msg):
             print(f"⚠️  Admin error ignored: {description}")
             return True
-        print(f"❌ Error: {e.stderr}")
+        print(f"❌ Error: {e}")
         return False
 
 def main():
     print("🔧 Quick Fix for Hospital Management System")
     print("=" * 50)
     
+    # Django starts once and every step runs in this process
+    import django
+    django.setup()
+    from django.core.management import call_command
+    
     # Step 1: Create and apply migrations
     print("Step 1: Database setup...")
-    if not run_command("python manage.py makemigrations hospital", "Creating migrations", ignore_admin_errors=True):
+    if not run_step(lambda: call_command('makemigrations', 'hospital'), "Creating migrations", ignore_admin_errors=True):
         print("⚠️  Continuing anyway...")
     
-    if not run_command("python manage.py migrate", "Applying migrations", ignore_admin_errors=True):
+    if not run_step(lambda: call_command('migrate'), "Applying migrations", ignore_admin_errors=True):
         print("❌ Migration failed. Please check for errors.")
         return
     
     # Step 2: Create simple sample data
     print("\nStep 2: Creating sample data...")
-    if not run_command("python create_simple_data.py", "Creating sample data"):
+    import create_simple_data
+    if not run_step(create_simple_data.main, "Creating sample data"):
         print("❌ Sample data creation failed.")
         return
     
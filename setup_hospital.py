@@ -8,20 +8,19 @@ This script will:
 
 import os
 import sys
-import subprocess
 
-def run_command(command, description):
-    """Run a command and handle errors"""
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_management.settings')
+
+def run_step(step, description):
+    """Run a setup step in this process and handle errors"""
     print(f"🔄 {description}...")
     try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
+        step()
         print(f"✅ {description} completed successfully")
-        if result.stdout:
-            print(result.stdout)
         return True
-    except subprocess.CalledProcessError as e:
+    except Exception as e:
         print(f"❌ Error during {description}:")
-        print(e.stderr)
+        print(e)
         return False
 
 def main():
@@ -33,25 +32,31 @@ def main():
         print("❌ manage.py not found. Please run this script from the project root directory.")
         sys.exit(1)
     
+    # Every step runs in this one process: Django starts once, not once per step
+    import django
+    django.setup()
+    from django.core.management import call_command
+    
     # Run migrations first
-    migration_commands = [
-        ("python manage.py makemigrations", "Creating migrations"),
-        ("python manage.py migrate", "Applying migrations"),
+    migration_steps = [
+        (lambda: call_command('makemigrations'), "Creating migrations"),
+        (lambda: call_command('migrate'), "Applying migrations"),
     ]
     
     print("📋 Step 1: Setting up database...")
-    for command, description in migration_commands:
-        if not run_command(command, description):
+    for step, description in migration_steps:
+        if not run_step(step, description):
             print(f"❌ Setup failed at: {description}")
             sys.exit(1)
     
     print("\n📋 Step 2: Creating sample data...")
-    data_commands = [
-        ("python create_simple_data.py", "Creating sample data"),
+    import create_simple_data
+    data_steps = [
+        (create_simple_data.main, "Creating sample data"),
     ]
     
-    for command, description in data_commands:
-        if not run_command(command, description):
+    for step, description in data_steps:
+        if not run_step(step, description):
             print(f"❌ Setup failed at: {description}")
             sys.exit(1)
     
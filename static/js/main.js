@@ -15,6 +15,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize dashboard charts
     initDashboardCharts();
+    
+    // Initialize on-demand modal content
+    initRemoteModals();
 });
 
 // Animation initialization
@@ -125,6 +128,62 @@ function initBootstrapComponents() {
     });
 }
 
+// Remote modals: a single modal per page, filled from the JSON payload at the
+// trigger's data-detail-url when it opens, instead of one modal per table row
+function initRemoteModals() {
+    document.querySelectorAll('[data-remote-modal]').forEach(modal => {
+        const loading = modal.querySelector('[data-loading]');
+        const loaded = modal.querySelector('[data-loaded]');
+        
+        modal.addEventListener('show.bs.modal', function(event) {
+            const trigger = event.relatedTarget;
+            const url = trigger && trigger.getAttribute('data-detail-url');
+            if (!url) return;
+            
+            loading.innerHTML = '<div class="spinner-border text-primary" role="status"></div>';
+            loading.classList.remove('d-none');
+            loaded.classList.add('d-none');
+            fetch(url, { headers: { 'Accept': 'application/json' } })
+                .then(response => {
+                    if (!response.ok) throw new Error(response.statusText);
+                    return response.json();
+                })
+                .then(data => {
+                    fillRemoteModal(modal, data);
+                    loading.classList.add('d-none');
+                    loaded.classList.remove('d-none');
+                })
+                .catch(() => {
+                    loading.innerHTML = `
+                        <i class="fas fa-exclamation-triangle fa-2x text-danger mb-2"></i>
+                        <p class="text-muted mb-0">Unable to load details. Please try again.</p>
+                    `;
+                });
+        });
+    });
+}
+
+// Resolve a dotted path such as "appointment.doctor.name" in a payload
+function lookupField(data, path) {
+    return path.split('.').reduce((value, key) => (value == null ? value : value[key]), data);
+}
+
+function fillRemoteModal(modal, data) {
+    modal.querySelectorAll('[data-field]').forEach(el => {
+        const value = lookupField(data, el.dataset.field);
+        el.textContent = value || el.dataset.default || '';
+    });
+    modal.querySelectorAll('[data-badge]').forEach(el => {
+        el.className = `badge bg-${lookupField(data, el.dataset.badge) || 'secondary'}`;
+    });
+    modal.querySelectorAll('[data-show-if]').forEach(el => {
+        el.classList.toggle('d-none', !lookupField(data, el.dataset.showIf));
+    });
+    modal.querySelectorAll('[data-id-field]').forEach(el => {
+        el.dataset.id = lookupField(data, el.dataset.idField);
+    });
+}
+
 // Search functionality
 function initSearchFunctionality() {
     const searchInputs = document.querySelectorAll('input[type="search"], .search-input');